@@ -62,11 +62,182 @@ class Settings(metaclass=Singleton):
             return 'external'
         return 'python'
 
+    @classmethod
+    def adb_transport(cls):
+        cls.initialize()
+        if 'adb_transport' in cls.data and cls.data['adb_transport'] == 'socket':
+            return 'socket'
+        return 'process'
+
     @classmethod
     def adb_run_as_root(cls):
         cls.initialize()
         return 'adb_run_as_root' in cls.data and cls.data['adb_run_as_root'] is True
 
+    @classmethod
+    def adb_shell_sessions(cls) -> int:
+        cls.initialize()
+        if 'adb_shell_sessions' in cls.data and isinstance(cls.data['adb_shell_sessions'], int):
+            return max(cls.data['adb_shell_sessions'], 0)
+        return 2
+
+    @classmethod
+    def worker_threads(cls) -> int:
+        cls.initialize()
+        if 'worker_threads' in cls.data and isinstance(cls.data['worker_threads'], int):
+            return max(cls.data['worker_threads'], 2)
+        return 4
+
+    @classmethod
+    def device_concurrency(cls) -> int:
+        """
+        Maximum number of operations running at once per device. 0 - no limit
+        """
+        cls.initialize()
+        if 'device_concurrency' in cls.data and isinstance(cls.data['device_concurrency'], int):
+            return max(cls.data['device_concurrency'], 0)
+        return 2
+
+    @classmethod
+    def transfer_retries(cls) -> int:
+        cls.initialize()
+        if 'transfer_retries' in cls.data and isinstance(cls.data['transfer_retries'], int):
+            return max(cls.data['transfer_retries'], 0)
+        return 2
+
+    @classmethod
+    def transfer_mode(cls) -> str:
+        """
+        Directory transfer mode: 'sync' - file by file, 'tar' - one tar stream, 'auto' - tar for directories
+        """
+        cls.initialize()
+        if 'transfer_mode' in cls.data and cls.data['transfer_mode'] in ('sync', 'tar', 'auto'):
+            return cls.data['transfer_mode']
+        return 'auto'
+
+    @classmethod
+    def transfer_compression(cls) -> str:
+        """
+        Compression of downloads by the device: 'off', 'on' or 'auto' - compressible files over slow links only
+        """
+        cls.initialize()
+        if 'transfer_compression' in cls.data and cls.data['transfer_compression'] in ('off', 'on', 'auto'):
+            return cls.data['transfer_compression']
+        return 'auto'
+
+    @classmethod
+    def transfer_streams(cls) -> int:
+        """
+        Number of parallel range reads of a large file download (external core)
+        """
+        cls.initialize()
+        if 'transfer_streams' in cls.data and isinstance(cls.data['transfer_streams'], int):
+            return max(cls.data['transfer_streams'], 1)
+        return 4
+
+    @classmethod
+    def transfer_verify(cls) -> bool:
+        """
+        Finished transfers are verified by checksums of the device and local files, mismatches are retried
+        """
+        cls.initialize()
+        return 'transfer_verify' in cls.data and cls.data['transfer_verify'] is True
+
+    @classmethod
+    def transfer_skip_identical(cls) -> bool:
+        """
+        Files whose destination already exists with the same size and checksum are not transferred
+        """
+        cls.initialize()
+        return 'transfer_skip_identical' in cls.data and cls.data['transfer_skip_identical'] is True
+
+    @classmethod
+    def sync_checksums(cls) -> bool:
+        """
+        Sync compares newer files of the same size by SHA-256 (skipped if identical) instead of copying them
+        """
+        cls.initialize()
+        return 'sync_checksums' in cls.data and cls.data['sync_checksums'] is True
+
+    @classmethod
+    def listing_cache_ttl(cls) -> float:
+        """
+        Seconds a cached directory listing is shown without listing the directory again. 0 - no cache
+        """
+        cls.initialize()
+        if 'listing_cache_ttl' in cls.data and isinstance(cls.data['listing_cache_ttl'], (int, float)):
+            return max(cls.data['listing_cache_ttl'], 0)
+        return 30
+
+    @classmethod
+    def listing_cache_memory(cls) -> int:
+        """
+        Memory (megabytes) of the cached directory listings, least recently used ones are evicted
+        """
+        cls.initialize()
+        if 'listing_cache_memory' in cls.data and isinstance(cls.data['listing_cache_memory'], int):
+            return max(cls.data['listing_cache_memory'], 0)
+        return 64
+
+    @classmethod
+    def listing_cache_stale(cls) -> bool:
+        """
+        Expired cached listings are shown at once while the directory is listed again in the background
+        """
+        cls.initialize()
+        return cls.data.get('listing_cache_stale') is not False
+
+    @classmethod
+    def listing_index(cls) -> bool:
+        """
+        Cached listings are also kept on disk, the last known listings of a device are shown at once after a restart
+        """
+        cls.initialize()
+        return cls.data.get('listing_index') is not False
+
+    @classmethod
+    def device_index_root(cls) -> str:
+        """
+        Directory of the devices indexed for the search ('/' - the whole device, as far as it's readable)
+        """
+        cls.initialize()
+        if 'device_index_root' in cls.data and isinstance(cls.data['device_index_root'], str):
+            return cls.data['device_index_root']
+        return '/sdcard/'
+
+    @classmethod
+    def prefetch_directories(cls) -> int:
+        """
+        Maximum number of directories (subdirectories and the parent of the shown one) listed in the background.
+        0 - no prefetch
+        """
+        cls.initialize()
+        if 'prefetch_directories' in cls.data and isinstance(cls.data['prefetch_directories'], int):
+            return max(cls.data['prefetch_directories'], 0)
+        return 16
+
+    @classmethod
+    def prefetch_memory(cls) -> int:
+        """
+        Memory (megabytes) of the listings prefetched for one directory
+        """
+        cls.initialize()
+        if 'prefetch_memory' in cls.data and isinstance(cls.data['prefetch_memory'], int):
+            return max(cls.data['prefetch_memory'], 0)
+        return 8
+
+    @classmethod
+    def operation_timeout(cls, operation: str) -> float:
+        """
+        Deadline (seconds) of an operation: 'shell', 'files', 'devices' or 'transfer'. 0 - no deadline
+        """
+        cls.initialize()
+        defaults = {'shell': 30, 'files': 60, 'devices': 30, 'transfer': 0}
+        timeouts = cls.data.get('operation_timeouts')
+        if isinstance(timeouts, dict) and isinstance(timeouts.get(operation), (int, float)):
+            return max(timeouts[operation], 0)
+        return defaults.get(operation, 0)
+
     @classmethod
     def preserve_timestamp(cls):
         cls.initialize()
@@ -0,0 +1,340 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import datetime
+import logging
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
+
+from app.core.configurations import Settings
+from app.data.models import File
+
+
+@contextmanager
+def connect(filename: str) -> sqlite3.Connection:
+    """
+    Connection of one transaction, it's committed and closed on exit
+    """
+    connection = sqlite3.connect(filename, timeout=10)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+LISTINGS_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS listings ('
+    ' device TEXT NOT NULL, path TEXT NOT NULL, listed REAL NOT NULL, mtime TEXT, PRIMARY KEY (device, path))',
+    'CREATE TABLE IF NOT EXISTS files ('
+    ' device TEXT NOT NULL, directory TEXT NOT NULL, name TEXT NOT NULL, permissions TEXT, owner TEXT,'
+    ' "group" TEXT, other TEXT, size INTEGER, date TEXT, link TEXT, link_type TEXT)',
+    'CREATE INDEX IF NOT EXISTS files_directory ON files (device, directory)',
+)
+
+
+class ListingIndex:
+    """
+    ListingIndex - directory listings of the devices (by serial) kept in 'listings.sqlite' next to the settings,
+    so the last known listings are shown at once after a restart. A listing is stored with the time it was listed
+    and the modification time of the directory, an unchanged directory doesn't have to be listed again.
+    Writes are done in order by one background thread, reads use their own connections (WAL journal)
+    """
+
+    filename = os.path.join(os.path.dirname(Settings.filename), 'listings.sqlite')
+    MAX_AGE = 30 * 24 * 60 * 60  # Seconds, older listings are removed when the index is opened
+
+    __writer = None
+    __lock = threading.Lock()
+
+    @staticmethod
+    def key(path: str) -> str:
+        return posixpath.join(posixpath.normpath(path), '')
+
+    @classmethod
+    def connect(cls):
+        return connect(cls.filename)
+
+    @classmethod
+    def writer(cls) -> ThreadPoolExecutor:
+        with cls.__lock:
+            if not cls.__writer:
+                cls.__writer = ThreadPoolExecutor(1, thread_name_prefix='ListingIndex')
+                cls.__writer.submit(cls.__write, cls.__open)
+            return cls.__writer
+
+    @classmethod
+    def get(cls, device: str, path: str) -> (List[File], str):
+        """
+        Indexed listing of the directory and the modification time of the directory: (files, mtime).
+        (None, None) if it's not indexed
+        """
+        if not Settings.listing_index() or not os.path.exists(cls.filename):
+            return None, None
+        path = cls.key(path)
+        try:
+            with cls.connect() as connection:
+                listing = connection.execute(
+                    'SELECT mtime FROM listings WHERE device = ? AND path = ?', (device, path)
+                ).fetchone()
+                if not listing:
+                    return None, None
+                rows = connection.execute(
+                    'SELECT name, permissions, owner, "group", other, size, date, link, link_type FROM files'
+                    ' WHERE device = ? AND directory = ?', (device, path)
+                ).fetchall()
+        except sqlite3.Error as error:
+            logging.error('Listing index: %s' % error)
+            return None, None
+
+        return [
+            File(
+                name=name, path=path + name, permissions=permissions, owner=owner, group=group, other=other,
+                size=size, date_time=datetime.datetime.fromisoformat(date) if date else None,
+                link=link, link_type=link_type
+            ) for name, permissions, owner, group, other, size, date, link, link_type in rows
+        ], listing[0]
+
+    @classmethod
+    def put(cls, device: str, path: str, files: List[File], mtime: str = None):
+        """
+        Stores the listing. Without 'mtime' the modification time of the indexed listing is kept: it was taken
+        before that listing, so it's still valid for the newer one
+        """
+        if Settings.listing_index():
+            cls.writer().submit(cls.__write, cls.__put, device, cls.key(path), files, mtime, time.time())
+
+    @classmethod
+    def invalidate(cls, device: str, path: str, recursive: bool = False):
+        """
+        Removes the listing of the directory, with 'recursive' - also the listings of its subdirectories
+        """
+        if Settings.listing_index():
+            cls.writer().submit(cls.__write, cls.__invalidate, device, cls.key(path), recursive)
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Waits for the pending writes
+        """
+        with cls.__lock:
+            if cls.__writer:
+                cls.__writer.shutdown(wait=True)
+                cls.__writer = None
+
+    @classmethod
+    def __write(cls, method: callable, *args):
+        try:
+            with cls.connect() as connection:
+                method(connection, *args)
+        except sqlite3.Error as error:
+            logging.error('Listing index: %s' % error)
+
+    @classmethod
+    def __open(cls, connection: sqlite3.Connection):
+        for statement in LISTINGS_SCHEMA:
+            connection.execute(statement)
+        old = connection.execute(
+            'SELECT device, path FROM listings WHERE listed < ?', (time.time() - cls.MAX_AGE,)
+        ).fetchall()
+        for device, path in old:
+            cls.__invalidate(connection, device, path, False)
+
+    @classmethod
+    def __put(
+            cls, connection: sqlite3.Connection, device: str, path: str, files: List[File], mtime: str, listed: float
+    ):
+        if mtime is None:
+            previous = connection.execute(
+                'SELECT mtime FROM listings WHERE device = ? AND path = ?', (device, path)
+            ).fetchone()
+            mtime = previous[0] if previous else None
+        cls.__invalidate(connection, device, path, False)
+        connection.execute('INSERT INTO listings VALUES (?, ?, ?, ?)', (device, path, listed, mtime))
+        connection.executemany(
+            'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                (
+                    device, path, file.name, file.permissions, file.owner, file.group, file.other, file.raw_size,
+                    file.raw_date.isoformat() if file.raw_date else None, file.link, file.link_type
+                ) for file in files
+            )
+        )
+
+    @classmethod
+    def __invalidate(cls, connection: sqlite3.Connection, device: str, path: str, recursive: bool):
+        if recursive:
+            condition, args = 'substr(%s, 1, ?) = ?', (device, len(path), path)
+        else:
+            condition, args = '%s = ?', (device, path)
+        connection.execute('DELETE FROM listings WHERE device = ? AND ' + condition % 'path', args)
+        connection.execute('DELETE FROM files WHERE device = ? AND ' + condition % 'directory', args)
+
+
+DEVICE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS devices ('
+    ' device TEXT PRIMARY KEY, root TEXT NOT NULL, indexed REAL NOT NULL, entries INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS entries ('
+    ' id INTEGER PRIMARY KEY, device TEXT NOT NULL, directory TEXT NOT NULL, name TEXT NOT NULL COLLATE NOCASE,'
+    ' size INTEGER, mtime INTEGER, permissions TEXT)',
+    'CREATE INDEX IF NOT EXISTS entries_directory ON entries (device, directory)',
+    'CREATE INDEX IF NOT EXISTS entries_name ON entries (device, name)',
+)
+# Full-text index of the names, it's updated by DeviceIndex (rebuilt after a walk of the whole tree)
+DEVICE_SCHEMA_FTS = "CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(" \
+                    "name, content='entries', content_rowid='id', tokenize='trigram')"
+
+
+class DeviceIndex:
+    """
+    DeviceIndex - names, sizes and modification times of all files of the devices (by serial), kept in 'index.sqlite'
+    next to the settings. Names are searched by a trigram full-text index (SQLite FTS5), so any part of a name
+    matches. Without FTS5 (old SQLite) and for queries shorter than a trigram, names are matched by their beginning,
+    through the index of the names
+    """
+
+    filename = os.path.join(os.path.dirname(Settings.filename), 'index.sqlite')
+    LIMIT = 1000  # Results of a search
+
+    __fts = None  # FTS5 trigram tokenizer is available
+    __lock = threading.Lock()
+
+    @classmethod
+    @contextmanager
+    def connect(cls) -> sqlite3.Connection:
+        with connect(cls.filename) as connection:
+            with cls.__lock:
+                if cls.__fts is None:
+                    for statement in DEVICE_SCHEMA:
+                        connection.execute(statement)
+                    try:
+                        connection.execute(DEVICE_SCHEMA_FTS)
+                        cls.__fts = True
+                    except sqlite3.OperationalError as error:
+                        logging.error('Full-text search is not available: %s' % error)
+                        cls.__fts = False
+            yield connection
+
+    @classmethod
+    def status(cls, device: str) -> (str, float, int):
+        """
+        Root, time and number of the entries of the last indexing of the device: (root, time, entries).
+        (None, None, 0) if the device is not indexed
+        """
+        if not os.path.exists(cls.filename):
+            return None, None, 0
+        try:
+            with cls.connect() as connection:
+                row = connection.execute(
+                    'SELECT root, indexed, entries FROM devices WHERE device = ?', (device,)
+                ).fetchone()
+        except sqlite3.Error as error:
+            logging.error('Device index: %s' % error)
+            return None, None, 0
+        return row or (None, None, 0)
+
+    @classmethod
+    def search(cls, device: str, query: str, limit: int = LIMIT) -> List[File]:
+        """
+        Indexed files of the device whose names contain the query (case insensitive), at most 'limit'
+        """
+        query = query.strip()
+        if not query or not os.path.exists(cls.filename):
+            return []
+        columns = 'entries.directory, entries.name, entries.size, entries.mtime, entries.permissions'
+        try:
+            with cls.connect() as connection:
+                if cls.__fts and len(query) >= 3:
+                    rows = connection.execute(
+                        # CROSS JOIN keeps the full-text index first, the planner prefers the index of the device
+                        'SELECT %s FROM names CROSS JOIN entries ON entries.id = names.rowid'
+                        ' WHERE names MATCH ? AND entries.device = ? LIMIT ?' % columns,
+                        ('"%s"' % query.replace('"', '""'), device, limit)
+                    ).fetchall()
+                else:
+                    # Names of the range [query, query + the last character) start with the query
+                    rows = connection.execute(
+                        'SELECT %s FROM entries WHERE device = ? AND name >= ? AND name < ? LIMIT ?' % columns,
+                        (device, query, query + '\U0010ffff', limit)
+                    ).fetchall()
+        except sqlite3.Error as error:
+            logging.error('Device index: %s' % error)
+            return []
+
+        return [
+            File(
+                name=name, path=posixpath.join(directory, name), size=size, permissions=permissions,
+                date_time=datetime.datetime.fromtimestamp(mtime) if mtime else None
+            ) for directory, name, size, mtime, permissions in rows
+        ]
+
+    @classmethod
+    def directories(cls, connection: sqlite3.Connection, device: str) -> dict:
+        """
+        Modification times of the indexed directories: {path: mtime}
+        """
+        return {
+            posixpath.join(directory, name): mtime for directory, name, mtime in connection.execute(
+                "SELECT directory, name, mtime FROM entries WHERE device = ? AND permissions LIKE 'd%'", (device,)
+            )
+        }
+
+    @classmethod
+    def insert(cls, connection: sqlite3.Connection, device: str, entries: List[tuple]):
+        """
+        Adds the entries (path, size, mtime, permissions)
+        """
+        connection.executemany(
+            'INSERT INTO entries (device, directory, name, size, mtime, permissions) VALUES (?, ?, ?, ?, ?, ?)', (
+                (device, *posixpath.split(path), size, mtime, permissions)
+                for path, size, mtime, permissions in entries
+            )
+        )
+
+    @classmethod
+    def remove(cls, connection: sqlite3.Connection, device: str, directories: List[str] = None):
+        """
+        Removes the entries in the directories, all entries of the device without 'directories'.
+        Returns the last id of the entries, the entries added after it are in the full-text index after 'finish'
+        """
+        if directories is None:
+            connection.execute('DELETE FROM entries WHERE device = ?', (device,))
+        else:
+            for path in directories:
+                if cls.__fts:
+                    connection.execute(
+                        "INSERT INTO names (names, rowid, name) SELECT 'delete', id, name FROM entries"
+                        " WHERE device = ? AND directory = ?", (device, path)
+                    )
+                connection.execute('DELETE FROM entries WHERE device = ? AND directory = ?', (device, path))
+        return connection.execute('SELECT coalesce(max(id), 0) FROM entries').fetchone()[0]
+
+    @classmethod
+    def touch(cls, connection: sqlite3.Connection, device: str, directories: dict):
+        """
+        Updates the modification times of the directories: {path: mtime}
+        """
+        connection.executemany(
+            'UPDATE entries SET mtime = ? WHERE device = ? AND directory = ? AND name = ?',
+            ((mtime, device, *posixpath.split(path)) for path, mtime in directories.items())
+        )
+
+    @classmethod
+    def finish(cls, connection: sqlite3.Connection, device: str, root: str, since: int = None):
+        """
+        Adds the names of the entries added after 'since' to the full-text index (without 'since' it's rebuilt,
+        much faster than adding a whole tree) and records the indexing of the device
+        """
+        if cls.__fts and since is None:
+            connection.execute("INSERT INTO names (names) VALUES ('rebuild')")
+        elif cls.__fts:
+            connection.execute('INSERT INTO names (rowid, name) SELECT id, name FROM entries WHERE id > ?', (since,))
+        entries, = connection.execute('SELECT count(*) FROM entries WHERE device = ?', (device,)).fetchone()
+        connection.execute(
+            'INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)', (device, root, time.time(), entries)
+        )
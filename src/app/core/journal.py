@@ -0,0 +1,292 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from app.core.configurations import Settings
+from app.helpers.tools import CancellationToken, OperationCancelled, STREAM_BUFFER_SIZE, json_to_dict
+
+
+class TransferJournal:
+    """
+    TransferJournal - completed byte ranges of the resumable downloads, kept in 'transfers.json' next to the settings.
+    Entries are keyed by the local path of the download, the file is replaced atomically on every update
+    """
+
+    filename = os.path.join(os.path.dirname(Settings.filename), 'transfers.json')
+    __lock = threading.Lock()
+
+    @classmethod
+    def entries(cls) -> dict:
+        with cls.__lock:
+            if not os.path.exists(cls.filename):
+                return {}
+            return json_to_dict(cls.filename)
+
+    @classmethod
+    def entry(cls, key: str) -> dict:
+        return cls.entries().get(key)
+
+    @classmethod
+    def pending(cls, device: str) -> List[dict]:
+        """
+        Unfinished downloads of the device, 'path' of an entry is the local path of the download
+        """
+        return [dict(entry, path=key) for key, entry in cls.entries().items() if entry.get('device') == device]
+
+    @classmethod
+    def update(cls, key: str, entry: dict):
+        cls.__modify(lambda entries: entries.__setitem__(key, entry))
+
+    @classmethod
+    def remove(cls, key: str):
+        cls.__modify(lambda entries: entries.pop(key, None))
+
+    @classmethod
+    def discard(cls, key: str):
+        """
+        Removes the entry and the partial file of the download
+        """
+        cls.remove(key)
+        if os.path.exists(key + ResumableDownload.SUFFIX):
+            os.remove(key + ResumableDownload.SUFFIX)
+
+    @classmethod
+    def __modify(cls, method: callable):
+        with cls.__lock:
+            entries = json_to_dict(cls.filename) if os.path.exists(cls.filename) else {}
+            method(entries)
+            temp = cls.filename + '.tmp'
+            with open(temp, 'w') as file:
+                json.dump(entries, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, cls.filename)
+
+
+def merge(ranges: List[list]) -> List[list]:
+    """
+    Sorted and merged byte ranges [start, end)
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing(ranges: List[list], size: int) -> List[list]:
+    """
+    Byte ranges [start, end) of [0, size) not covered by 'ranges'
+    """
+    result = []
+    position = 0
+    for start, end in merge(ranges):
+        if start > position:
+            result.append([position, start])
+        position = max(position, end)
+    if position < size:
+        result.append([position, size])
+    return result
+
+
+class ResumableDownload:
+    """
+    ResumableDownload - download of a large file by chunks, read by device side range reads (`dd skip= count=`).
+    Data is written to '<path>.part', every completed chunk is recorded in TransferJournal after it is synced,
+    so a broken download (or a closed application) continues from the missing ranges.
+    Chunks can be read by several streams at once, each one writes at its offset of the preallocated part.
+    The file is renamed to its path when the checksum of the device file matches
+
+    Keyword arguments:
+    device -- device id
+    source -- device path of the file
+    path -- local path of the download
+    size -- size of the device file
+    mtime -- modification time of the device file, changed file is downloaded from the beginning
+    progress_callback -- called with (source, percent)
+    """
+
+    SUFFIX = '.part'
+    BLOCK_SIZE = 1024 * 1024  # Bytes, unit of the device side range reads
+    CHUNK_SIZE = 8 * BLOCK_SIZE  # Bytes, journal is updated after every chunk
+
+    def __init__(self, device: str, source: str, path: str, size: int, mtime: str, progress_callback: callable):
+        self.device = device
+        self.source = source
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.progress_callback = progress_callback
+        self.entry = None
+        self.__lock = threading.Lock()
+        self.__active = {}  # Start of a chunk being written: bytes written
+
+    @property
+    def part(self) -> str:
+        return self.path + self.SUFFIX
+
+    @property
+    def done(self) -> int:
+        return sum(end - start for start, end in self.entry['ranges'])
+
+    def chunks(self) -> List[list]:
+        """
+        Missing byte ranges of the download split into chunks [start, end), aligned to BLOCK_SIZE
+        """
+        chunks = []
+        for start, end in missing(self.entry['ranges'], self.size):
+            for offset in range(start, end, self.CHUNK_SIZE):
+                chunks.append([offset, min(offset + self.CHUNK_SIZE, end)])
+        return chunks
+
+    def open(self):
+        """
+        Loads the journal entry of the download, the download starts over if the device file or the part is changed
+        """
+        entry = TransferJournal.entry(self.path)
+        if not entry or (entry.get('device'), entry.get('source'), entry.get('size'), entry.get('mtime')) != \
+                (self.device, self.source, self.size, self.mtime) or not os.path.exists(self.part) or \
+                os.path.getsize(self.part) != self.size:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.part, 'wb') as file:
+                file.truncate(self.size)
+            entry = dict(device=self.device, source=self.source, size=self.size, mtime=self.mtime, ranges=[])
+            TransferJournal.update(self.path, entry)
+        self.entry = entry
+        return self
+
+    def write(self, start: int, end: int, data) -> int:
+        """
+        Writes the chunk [start, end) from 'data' (iterable of bytes), records it in the journal.
+        Returns the number of written bytes, the chunk is not recorded if the data is shorter
+        """
+        size = 0
+        with open(self.part, 'r+b') as file:
+            file.seek(start)
+            for chunk in data:
+                if CancellationToken.current():
+                    CancellationToken.current().check()
+                chunk = chunk[:end - start - size]
+                file.write(chunk)
+                size += len(chunk)
+                with self.__lock:
+                    self.__active[start] = size
+                    written = self.done + sum(self.__active.values())
+                self.progress_callback(self.source, min(int(written * 100 / self.size), 99))
+            file.flush()
+            os.fsync(file.fileno())
+        with self.__lock:
+            self.__active.pop(start, None)
+            if size == end - start:
+                self.entry['ranges'] = merge(self.entry['ranges'] + [[start, end]])
+                TransferJournal.update(self.path, self.entry)
+        return size
+
+    def checksum(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.part, 'rb') as file:
+            for chunk in iter(lambda: file.read(STREAM_BUFFER_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def run(self, read: callable, checksum: callable, streams: int = 1) -> (str, str):
+        """
+        Downloads the missing chunks and verifies the file
+
+        Keyword arguments:
+        read -- called with (offset, count) in blocks, returns iterable of bytes. Must be thread safe if streams > 1
+        checksum -- returns sha256 hex digest of the device file, None if it can't be calculated.
+                    It's called in a thread of its own, the device file is hashed while it's downloaded.
+                    It's cancelled (its token) when the download fails, if it fails the file is not verified
+        streams -- number of chunks read at once (default 1)
+        """
+        started = time.time()
+        self.open()
+        resumed = self.done
+        token = CancellationToken.current()
+
+        def fetch(chunk: list) -> (list, int):
+            start, end = chunk
+            if not token:
+                data = read(start // self.BLOCK_SIZE, -(-(end - start) // self.BLOCK_SIZE))
+                return chunk, self.write(start, end, data)
+            # Threads of the pool stop with the operation, queued chunks of a cancelled one are not read
+            with token.activate():
+                token.check()
+                data = read(start // self.BLOCK_SIZE, -(-(end - start) // self.BLOCK_SIZE))
+                return chunk, self.write(start, end, data)
+
+        # Hashing has a token of its own: it stops with the operation and when the download fails
+        hashing_token = CancellationToken()
+        unregister = token.register(hashing_token.cancel) if token else lambda: None
+
+        def abandon():
+            hashing_token.cancel()
+            unregister()
+
+        def hash_device() -> str:
+            with hashing_token.activate():
+                return checksum()
+
+        hashing = ThreadPoolExecutor(1, thread_name_prefix='Checksum')
+        expected = hashing.submit(hash_device)
+        hashing.shutdown(wait=False)
+
+        chunks = self.chunks()
+        pool = None
+        if streams > 1 and len(chunks) > 1:
+            pool = ThreadPoolExecutor(min(streams, len(chunks)))
+            results = as_completed([pool.submit(fetch, chunk) for chunk in chunks])
+            results = (future.result() for future in results)
+        else:
+            results = map(fetch, chunks)
+        try:
+            # The first failed chunk stops the download, the queued chunks are not read
+            for (start, end), size in results:
+                if size != end - start:
+                    abandon()
+                    return None, "%s: short read at %d (%d of %d bytes)" % (self.source, start, size, end - start)
+        except BaseException:
+            abandon()
+            raise
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        try:
+            expected = expected.result()
+        except OperationCancelled:
+            raise
+        except Exception as error:
+            # All the chunks arrived, a failed checksum only leaves the file not verified
+            logging.error('Checksum of %s failed: %s' % (self.source, error))
+            expected = None
+        finally:
+            unregister()
+        if token:
+            token.check()
+        if expected and expected != self.checksum():
+            logging.error('Checksum mismatch of %s, the download is started over' % self.source)
+            TransferJournal.discard(self.path)
+            return None, "%s: checksum mismatch, the download is started over" % self.source
+
+        os.replace(self.part, self.path)
+        TransferJournal.remove(self.path)
+        self.progress_callback(self.source, 100)
+        duration = max(time.time() - started, 0.001)
+        return "%s: %d bytes pulled%s%s, %s. %.1f MB/s" % (
+            self.source, self.size - resumed,
+            ' by %d streams' % streams if streams > 1 else '',
+            ' (resumed at %d)' % resumed if resumed else '',
+            'sha256 verified' if expected else 'not verified',
+            (self.size - resumed) / duration / 1024 / 1024
+        ), None
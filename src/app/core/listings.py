@@ -0,0 +1,108 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from app.core.configurations import Settings
+from app.core.index import ListingIndex
+from app.data.models import File
+
+
+class ListingCache:
+    """
+    ListingCache - directory listings by device and path. A listing is fresh for 'listing_cache_ttl' seconds,
+    an expired one can still be shown while the directory is listed again ('listing_cache_stale').
+    Least recently used listings are evicted when they take more than 'listing_cache_memory' megabytes.
+    Our own changes of the device (rename, delete, new folder, upload) invalidate the listings they affect,
+    also in the ListingIndex
+    """
+
+    ENTRY_SIZE = 300  # Bytes, approximate memory of a File
+
+    __entries = OrderedDict()  # (device id, path): (files, time of the listing, size in bytes)
+    __size = 0
+    __generation = 0  # Incremented by invalidation, listings started before it are not cached
+    __lock = threading.Lock()
+
+    @staticmethod
+    def key(device: str, path: str) -> tuple:
+        return device, posixpath.join(posixpath.normpath(path), '')
+
+    @classmethod
+    def generation(cls) -> int:
+        """
+        Taken when a listing is started, see 'put'
+        """
+        return cls.__generation
+
+    @classmethod
+    def get(cls, device: str, path: str) -> (List[File], bool):
+        """
+        Cached listing of the directory and whether it's fresh: (files, fresh), (None, False) if not cached
+        """
+        ttl = Settings.listing_cache_ttl()
+        with cls.__lock:
+            entry = cls.__entries.get(cls.key(device, path))
+            if not entry or not ttl:
+                return None, False
+            cls.__entries.move_to_end(cls.key(device, path))
+            files, listed, _ = entry
+            return list(files), time.monotonic() - listed < ttl
+
+    @classmethod
+    def fresh(cls, device: str, path: str) -> bool:
+        ttl = Settings.listing_cache_ttl()
+        with cls.__lock:
+            entry = cls.__entries.get(cls.key(device, path))
+            return bool(entry and ttl) and time.monotonic() - entry[1] < ttl
+
+    @classmethod
+    def put(cls, device: str, path: str, files: List[File], generation: int = None, mtime: str = None):
+        """
+        Caches the listing, it's also stored in the ListingIndex (with the modification time of the directory).
+        It's dropped if listings were invalidated since 'generation'
+        """
+        limit = Settings.listing_cache_memory() * 1024 * 1024
+        size = len(files) * cls.ENTRY_SIZE
+        if not Settings.listing_cache_ttl() or size > limit:
+            return
+        with cls.__lock:
+            if generation is not None and generation != cls.__generation:
+                return
+            cls.__remove(cls.key(device, path))
+            files = list(files)
+            cls.__entries[cls.key(device, path)] = (files, time.monotonic(), size)
+            cls.__size += size
+            while cls.__size > limit:
+                cls.__remove(next(iter(cls.__entries)))
+            # Under the lock, so the index gets the listings and the invalidations in the same order
+            ListingIndex.put(device, path, files, mtime)
+
+    @classmethod
+    def invalidate(cls, device: str, path: str, recursive: bool = False):
+        """
+        Removes the listing of the directory, with 'recursive' - also the listings of its subdirectories
+        """
+        device, path = cls.key(device, path)
+        with cls.__lock:
+            cls.__generation += 1
+            for key in list(cls.__entries):
+                if key[0] == device and (key[1] == path or recursive and key[1].startswith(path)):
+                    cls.__remove(key)
+            ListingIndex.invalidate(device, path, recursive)
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__generation += 1
+            cls.__entries.clear()
+            cls.__size = 0
+
+    @classmethod
+    def __remove(cls, key: tuple):
+        entry = cls.__entries.pop(key, None)
+        if entry:
+            cls.__size -= entry[2]
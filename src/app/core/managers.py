@@ -6,8 +6,10 @@ import posixpath
 from PyQt5.QtCore import QObject
 from adb_shell.adb_device import AdbDeviceTcp, AdbDeviceUsb
 
+from app.core.configurations import Settings
 from app.data.models import File, Device
-from app.helpers.tools import Communicate, Singleton, get_python_rsa_keys_signer, AsyncRepositoryWorker
+from app.helpers.tools import Communicate, Singleton, get_python_rsa_keys_signer, AsyncRepositoryWorker, \
+    JobScheduler
 
 
 class ADBManager:
@@ -70,6 +72,7 @@ class ADBManager:
 class PythonADBManager(ADBManager):
     signer = get_python_rsa_keys_signer()
     device = None
+    transport_timeout = None  # Seconds, default timeout of a read or write of the device
 
     @classmethod
     def connect(cls, device_id: str) -> str:
@@ -79,11 +82,13 @@ class PythonADBManager(ADBManager):
             if device_id.__contains__(':'):
                 host = device_id.split(':')[0]
                 port = device_id.split(':')[1]
-            cls.device = AdbDeviceTcp(host=host, port=port, default_transport_timeout_s=10.)
+            cls.transport_timeout = 10.
+            cls.device = AdbDeviceTcp(host=host, port=port, default_transport_timeout_s=cls.transport_timeout)
             cls.device.connect(rsa_keys=[cls.signer], auth_timeout_s=1.)
             return '%s:%s' % (host, port)
 
-        cls.device = AdbDeviceUsb(serial=device_id, default_transport_timeout_s=3.)
+        cls.transport_timeout = 3.
+        cls.device = AdbDeviceUsb(serial=device_id, default_transport_timeout_s=cls.transport_timeout)
         cls.device.connect(rsa_keys=[cls.signer], auth_timeout_s=30.)
         return device_id
 
@@ -102,31 +107,41 @@ class PythonADBManager(ADBManager):
 class WorkersManager:
     """
     Async Workers Manager
-    Contains a list of workers
+    Contains the running workers by their ids, workers are executed by the JobScheduler
     """
     __metaclass__ = Singleton
     instance = QObject()
-    workers = []
+    workers = {}
+
+    @classmethod
+    def scheduler(cls) -> JobScheduler:
+        return JobScheduler.instance(Settings.worker_threads(), Settings.device_concurrency())
 
     @classmethod
     def work(cls, worker: AsyncRepositoryWorker) -> bool:
-        for _worker in cls.workers:
-            if _worker == worker or _worker.id == worker.id:
-                cls.workers.remove(_worker)
-                del _worker
-                break
+        # Closed workers (finished, cancelled or timed out) free their places
+        workers = [_worker for _worker in cls.workers.get(worker.id, []) if not _worker.closed]
+        if worker in workers:
+            return False
+        if not worker.device and ADBManager.get_device():
+            worker.device = ADBManager.get_device().id
+        cls.scheduler()
         worker.setParent(cls.instance)
-        cls.workers.append(worker)
+        cls.workers[worker.id] = workers + [worker]
         return True
 
+    @classmethod
+    def cancel(cls, worker_id: int):
+        for worker in cls.workers.get(worker_id, []):
+            if not worker.closed:
+                worker.cancel(silent=True)
+
     @classmethod
     def check(cls, worker_id: int) -> bool:
-        for worker in cls.workers:
-            if worker.id == worker_id:
-                if worker.closed:
-                    return True
-                return False
-        return False
+        """
+        True if no worker with the id is running
+        """
+        return all(worker.closed for worker in cls.workers.get(worker_id, []))
 
 
 class Global:
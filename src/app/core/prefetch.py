@@ -0,0 +1,77 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import posixpath
+from itertools import chain, islice
+from typing import List
+
+from app.core.configurations import Settings
+from app.core.index import ListingIndex
+from app.core.listings import ListingCache
+from app.data.models import File
+from app.data.repositories import FileRepository
+from app.helpers.tools import CancellationToken
+
+
+class ListingPrefetcher:
+    """
+    ListingPrefetcher - lists the directories likely opened next (the parent and the subdirectories of the shown one)
+    into the ListingCache. It runs as a background job, one directory after another, and the explorer cancels it
+    with every new listing, so interactive listings never wait for it. Listings shown from the ListingIndex
+    are revalidated by the modification times of their directories
+    """
+
+    RESOLUTION = 1  # Seconds, of the modification times of the directories
+
+    @classmethod
+    def targets(cls, device: str, path: str, files: List[File]) -> List[str]:
+        """
+        Directories to prefetch, at most 'prefetch_directories'. Fresh cached listings are skipped
+        """
+        path = posixpath.join(path, '')
+        parent = [posixpath.join(posixpath.dirname(path[:-1]), '')] if path != '/' else []
+        children = (posixpath.join(file.path, '') for file in files if file.isdir and file.name not in ('.', '..'))
+        paths = (directory for directory in chain(parent, children) if not ListingCache.fresh(device, directory))
+        return list(islice(paths, Settings.prefetch_directories()))
+
+    @classmethod
+    def prefetch(cls, device: str, paths: List[str]) -> (int, str):
+        """
+        Lists the directories into the ListingCache until they take 'prefetch_memory'. Returns the number of listings
+        """
+        budget = Settings.prefetch_memory() * 1024 * 1024
+        count = 0
+        for path in paths:
+            if CancellationToken.current():
+                CancellationToken.current().check()
+            generation = ListingCache.generation()
+            files, error = FileRepository.files(path)
+            if files is None or error:
+                continue  # Not readable (e.g. permission denied), it's listed again when it's opened
+            budget -= len(files) * ListingCache.ENTRY_SIZE
+            if budget < 0:
+                break
+            ListingCache.put(device, path, files, generation)
+            count += 1
+        return count, None
+
+    @classmethod
+    def revalidate(cls, device: str, path: str, mtime: str = None) -> (List[File], str):
+        """
+        Listing of the directory shown from the ListingIndex. The indexed one is valid while the modification time
+        of the directory is the same, otherwise the directory is listed again
+        """
+        generation = ListingCache.generation()
+        times, _ = FileRepository.modified(path)
+        # A directory modified within the resolution of its modification time could change again without changing it:
+        # the listing is stored without the time, so it's not trusted
+        modified = str(times[0]) if times and times[1] - times[0] > cls.RESOLUTION else None
+        if mtime and modified == mtime:
+            files, _ = ListingIndex.get(device, path)
+            if files is not None:
+                return files, None
+
+        files, error = FileRepository.files(path)
+        if files is not None and not error:
+            # Modification time taken before the listing is stored with it
+            ListingCache.put(device, path, files, generation, modified)
+        return files, error
@@ -0,0 +1,64 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import posixpath
+import time
+from functools import partial
+
+from app.core.index import DeviceIndex
+from app.data.repositories import FileRepository
+
+
+class DeviceIndexer:
+    """
+    DeviceIndexer - fills the DeviceIndex. The first indexing of a device walks the whole tree of the root
+    in one streaming `find`. Later ones list only the directories of the tree (with their modification times)
+    and list again the entries of the new and changed directories, the entries of the removed ones are dropped
+    """
+
+    @staticmethod
+    def root(path: str) -> str:
+        return posixpath.normpath(path) if path != '/' else path
+
+    @classmethod
+    def index(cls, device: str, root: str) -> (str, str):
+        """
+        Indexes the tree of 'root' on the device, runs as a background operation
+        """
+        started = time.time()
+        root = cls.root(root)
+        with DeviceIndex.connect() as connection:
+            indexed, _, _ = DeviceIndex.status(device)
+            known = DeviceIndex.directories(connection, device) if indexed == root else {}
+            if not known:
+                DeviceIndex.remove(connection, device)
+                count, error = FileRepository.tree([root], partial(DeviceIndex.insert, connection, device))
+                if error:
+                    connection.rollback()
+                    return None, error
+                DeviceIndex.finish(connection, device, root)
+                return "%d entries of %s indexed in %.1f s" % (count, root, time.time() - started), None
+
+            current = {}
+            _, error = FileRepository.tree(
+                [root], lambda batch: current.update((path, mtime) for path, _, mtime, _ in batch), directories=True
+            )
+            if error:
+                connection.rollback()
+                return None, error
+            changed = [path for path, mtime in current.items() if known.get(path) != mtime]
+            removed = [path for path in known if path not in current and path.startswith(root)]
+            since = DeviceIndex.remove(connection, device, changed + removed)
+            count = 0
+            if changed:
+                count, error = FileRepository.tree(
+                    changed, partial(DeviceIndex.insert, connection, device), children=True
+                )
+                if error:
+                    connection.rollback()
+                    return None, error
+            # Directories listed again get their new modification times, also if their parents are not changed
+            DeviceIndex.touch(connection, device, {path: current[path] for path in changed})
+            DeviceIndex.finish(connection, device, root, since)
+        return "%d changed directories of %s (%d entries), %d removed, updated in %.1f s" % (
+            len(changed), root, count, len(removed), time.time() - started
+        ), None
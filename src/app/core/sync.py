@@ -0,0 +1,199 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import logging
+import os
+import posixpath
+from typing import List
+
+from app.core.journal import ResumableDownload
+from app.core.transfers import TransferQueue
+from app.data.models import File, TransferType
+from app.data.repositories import FileRepository
+from app.helpers.checksum import Hasher
+
+
+class SyncPlan:
+    """
+    SyncPlan - difference of a device directory and a local directory, relative paths use '/'.
+    'type' is the direction: TransferType.DOWNLOAD - device to computer, TransferType.UPLOAD - computer to device
+    """
+
+    def __init__(self, **kwargs):
+        self.type = kwargs.get("type")
+        self.device_path = kwargs.get("device_path")
+        self.local_path = kwargs.get("local_path")
+        self.sizes = kwargs.get("sizes") or {}  # Relative path: size of the source file
+        self.copy: List[str] = kwargs.get("copy") or []  # New files
+        self.update: List[str] = kwargs.get("update") or []  # Changed files
+        self.delete: List[str] = kwargs.get("delete") or []  # Files missing on the source
+        self.unchanged = kwargs.get("unchanged") or 0
+        self.error = kwargs.get("error")  # Listing of the device is incomplete, nothing is deleted then
+
+    @property
+    def source(self) -> str:
+        return self.device_path if self.type == TransferType.DOWNLOAD else self.local_path
+
+    @property
+    def destination(self) -> str:
+        return self.local_path if self.type == TransferType.DOWNLOAD else self.device_path
+
+    @property
+    def size(self) -> int:
+        return sum(self.sizes[path] for path in self.copy + self.update)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.copy or self.update or self.delete or self.error)
+
+    @property
+    def summary(self) -> str:
+        summary = "%s → %s\n%d new, %d changed, %d unchanged, %d missing on the source. %d bytes to transfer" % (
+            self.source, self.destination, len(self.copy), len(self.update), self.unchanged, len(self.delete),
+            self.size
+        )
+        if self.error:
+            summary += "\nListing of the device is incomplete, files are not deleted: %s" % self.error
+        return summary
+
+    def report(self, limit: int = 1000) -> str:
+        """
+        Dry run report: '+' new, '~' changed and '-' deleted (only with deletion) files, at most 'limit' lines
+        """
+        lines = ['+ %s' % path for path in self.copy] + \
+                ['~ %s' % path for path in self.update] + \
+                ['- %s' % path for path in self.delete]
+        if len(lines) > limit:
+            lines = lines[:limit] + ['... %d more' % (len(lines) - limit)]
+        return "\n".join(lines)
+
+
+class DirectorySync:
+    """
+    DirectorySync - one-way sync of a device directory and a local directory (rsync style).
+    Manifests of both sides (size and modification time, one `find` on the device) are compared,
+    only new and changed files are transferred (by TransferQueue), files missing on the source can be deleted.
+    A file is changed if its size differs or the source is newer. With checksums, newer files of the same size
+    are compared by SHA-256 (`sha256sum` on the device) and skipped if identical.
+    Nothing is deleted when the listing of the device had errors: unlisted files are not missing
+    """
+
+    MTIME_TOLERANCE = 2  # Seconds, FAT file systems keep modification time with 2 seconds precision
+
+    @classmethod
+    def local_manifest(cls, path: str) -> dict:
+        manifest = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                if name.endswith(ResumableDownload.SUFFIX):
+                    continue
+                file = os.path.join(root, name)
+                try:
+                    stat = os.stat(file)
+                except OSError as error:
+                    logging.error(error)
+                    continue
+                manifest[os.path.relpath(file, path).replace(os.sep, '/')] = (stat.st_size, int(stat.st_mtime))
+        return manifest
+
+    @classmethod
+    def local_checksums(cls, path: str, files: List[str]) -> dict:
+        paths = {file: os.path.join(path, *file.split('/')) for file in files}
+        digests = Hasher.digests(list(paths.values()))
+        return {file: digests[local] for file, local in paths.items() if local in digests}
+
+    @classmethod
+    def plan(cls, direction: str, device_path: str, local_path: str, checksums: bool = False) -> (SyncPlan, str):
+        """
+        Builds the sync plan (dry run), nothing is transferred
+
+        Keyword arguments:
+        direction -- TransferType.DOWNLOAD (device to computer) or TransferType.UPLOAD (computer to device)
+        device_path -- device directory
+        local_path -- local directory
+        checksums -- compare newer files of the same size by SHA-256 (default False)
+        """
+        device_path = posixpath.join(device_path, '')
+        remote, error = FileRepository.manifest(device_path)
+        if remote is None and direction == TransferType.DOWNLOAD:
+            return None, error
+        # Destination directory of an upload is created by the transfers, a partial listing is an error
+        error = error if remote is not None else None
+        remote = remote or {}
+        local = cls.local_manifest(local_path) if os.path.isdir(local_path) else {}
+        source, destination = (remote, local) if direction == TransferType.DOWNLOAD else (local, remote)
+
+        plan = SyncPlan(
+            type=direction, device_path=device_path, local_path=local_path,
+            sizes={path: size for path, (size, _) in source.items()},
+            delete=[] if error else sorted(set(destination) - set(source)),
+            error=error
+        )
+        candidates = []
+        for path in sorted(source):
+            if path not in destination:
+                plan.copy.append(path)
+            elif source[path][0] != destination[path][0]:
+                plan.update.append(path)
+            elif source[path][1] > destination[path][1] + cls.MTIME_TOLERANCE:
+                candidates.append(path)
+            else:
+                plan.unchanged += 1
+
+        if checksums and candidates:
+            remote_checksums, _ = FileRepository.checksums([device_path + path for path in candidates])
+            local_checksums = cls.local_checksums(local_path, candidates)
+            for path in candidates:
+                digest = (remote_checksums or {}).get(device_path + path)
+                if digest and digest == local_checksums.get(path):
+                    plan.unchanged += 1
+                else:
+                    plan.update.append(path)
+        else:
+            plan.update.extend(candidates)
+        return plan, None
+
+    @classmethod
+    def transfer(cls, plan: SyncPlan):
+        """
+        Queues transfers of the new and changed files, grouped by their directories
+        """
+        directories = {}
+        for path in plan.copy + plan.update:
+            directories.setdefault(posixpath.dirname(path), []).append(path)
+
+        queue = TransferQueue.instance()
+        for directory, paths in sorted(directories.items()):
+            if plan.type == TransferType.DOWNLOAD:
+                destination = os.path.join(plan.local_path, *directory.split('/')) if directory else plan.local_path
+                os.makedirs(destination, exist_ok=True)
+                queue.download([
+                    File(
+                        name=posixpath.basename(path),
+                        path=plan.device_path + path,
+                        size=plan.sizes[path],
+                        permissions='-rw-rw----'
+                    ) for path in paths
+                ], destination)
+            else:
+                queue.upload(
+                    [os.path.join(plan.local_path, *path.split('/')) for path in paths],
+                    plan.device_path + (directory + '/' if directory else '')
+                )
+
+    @classmethod
+    def delete(cls, plan: SyncPlan) -> (str, str):
+        """
+        Deletes files of the destination missing on the source
+        """
+        errors = []
+        for path in plan.delete:
+            if plan.type == TransferType.DOWNLOAD:
+                try:
+                    os.remove(os.path.join(plan.local_path, *path.split('/')))
+                except OSError as error:
+                    errors.append(str(error))
+            else:
+                _, error = FileRepository.delete(File(path=plan.device_path + path, permissions='-rw-rw----'))
+                if error:
+                    errors.append(str(error))
+        return "%d file(s) deleted" % (len(plan.delete) - len(errors)), "\n".join(errors) or None
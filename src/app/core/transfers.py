@@ -0,0 +1,434 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import itertools
+import logging
+import os
+import posixpath
+import time
+from collections import deque
+from functools import partial
+from typing import List
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject
+
+from app.core.configurations import Settings
+from app.core.journal import TransferJournal
+from app.core.main import Adb
+from app.core.managers import Global
+from app.core.verification import TransferVerifier
+from app.data.models import File, MessageData, Transfer, TransferMode, TransferStatus, TransferType
+from app.data.repositories import FileRepository
+from app.helpers import compression
+from app.helpers.tools import AsyncRepositoryWorker, JobScheduler
+
+
+class TransferQueue(QObject):
+    """
+    TransferQueue - downloads and uploads of the application.
+    Every transfer runs as a bulk job of the JobScheduler, at most 'device_concurrency' transfers per device at once.
+    Transfers can be paused (a running one is stopped and starts again on resume), cancelled and retried,
+    failed transfers are retried automatically 'transfer_retries' times.
+    Small files with the same destination are transferred in batches (one `adb pull/push` for many sources),
+    retries are never batched. Downloads of compressible files are compressed by the device
+    when the measured bandwidth of the device is low ('transfer_compression').
+    Large files are downloaded by chunks recorded in TransferJournal, a failed or paused download continues
+    from the missing chunks, also after a restart of the application (restore).
+    Transfers are verified by checksums ('transfer_verify'): the sources are hashed while they are transferred,
+    the destinations in the background once finished. Files identical to their destination are skipped
+    ('transfer_skip_identical')
+    """
+
+    DOWNLOAD_WORKER_ID = 399
+    UPLOAD_WORKER_ID = 398
+    VERIFY_WORKER_ID = 397
+
+    changed = QtCore.pyqtSignal()  # Transfers are added or their status changed
+
+    THROUGHPUT_WINDOW = 5  # Seconds
+
+    BATCH_FILES = 64
+    BATCH_FILE_SIZE = 4 * 1024 * 1024  # Bytes, larger files are transferred alone
+
+    COMPRESSION_BANDWIDTH = 10 * 1024 * 1024  # Bytes/sec, slower devices get compressed downloads
+    BANDWIDTH_SAMPLE_SIZE = 1024 * 1024  # Bytes, smaller transfers don't tell the bandwidth
+
+    RESUMABLE_FILE_SIZE = 64 * 1024 * 1024  # Bytes, larger files are downloaded by chunks (TransferJournal)
+
+    __bandwidth = {}  # Device id: measured bandwidth of uncompressed transfers, bytes/sec
+
+    __instance = None
+
+    def __init__(self):
+        super(TransferQueue, self).__init__()
+        self.transfers: List[Transfer] = []
+        self.workers = {}
+        self.__ids = itertools.count(1)
+        self.__samples = deque()
+
+    @classmethod
+    def instance(cls):
+        if not cls.__instance:
+            cls.__instance = TransferQueue()
+        return cls.__instance
+
+    def download(self, files: List[File], destination: str = None):
+        device = Adb.manager().get_device()
+        for file in files:
+            self.transfers.append(
+                Transfer(
+                    id=next(self.__ids),
+                    type=TransferType.DOWNLOAD,
+                    device=device.id if device else None,
+                    source=file.path,
+                    destination=destination,
+                    size=0 if file.isdir else file.raw_size,
+                    files=0 if file.isdir else 1,
+                    mode=self.__mode(file.isdir, file.raw_size)
+                )
+            )
+        self.__changed()
+
+    def upload(self, sources: List[str], destination: str = None):
+        device = Adb.manager().get_device()
+        for source in sources:
+            self.transfers.append(
+                Transfer(
+                    id=next(self.__ids),
+                    type=TransferType.UPLOAD,
+                    device=device.id if device else None,
+                    source=source,
+                    destination=destination or Adb.manager().path(),
+                    size=0 if os.path.isdir(source) else os.path.getsize(source),
+                    files=0 if os.path.isdir(source) else 1,
+                    mode=self.__mode(os.path.isdir(source))
+                )
+            )
+        self.__changed()
+
+    @staticmethod
+    def __mode(directory: bool, size: int = 0) -> str:
+        if not directory and size >= TransferQueue.RESUMABLE_FILE_SIZE:
+            return TransferMode.RESUMABLE
+        mode = Settings.transfer_mode()
+        if mode == 'tar' or (mode == 'auto' and directory):
+            return TransferMode.TAR
+        return TransferMode.SYNC
+
+    def pause(self, transfer: Transfer):
+        if transfer.active:
+            self.__stop(transfer, TransferStatus.PAUSED)
+
+    def resume(self, transfer: Transfer):
+        if transfer.status == TransferStatus.PAUSED:
+            transfer.status = TransferStatus.QUEUED
+            self.__changed()
+
+    def cancel(self, transfer: Transfer):
+        if transfer.active or transfer.status == TransferStatus.PAUSED:
+            self.__stop(transfer, TransferStatus.CANCELLED)
+            if transfer.mode == TransferMode.RESUMABLE:
+                destination = transfer.destination or Settings.device_downloads_path(Adb.manager().get_device())
+                self.__discard(os.path.join(destination, transfer.name))
+
+    def restore(self, entries: List[dict]):
+        """
+        Queues unfinished resumable downloads of the journal (TransferJournal.pending)
+        """
+        for entry in entries:
+            self.transfers.append(
+                Transfer(
+                    id=next(self.__ids),
+                    type=TransferType.DOWNLOAD,
+                    device=entry['device'],
+                    source=entry['source'],
+                    destination=os.path.dirname(entry['path']),
+                    size=entry['size'],
+                    files=1,
+                    mode=TransferMode.RESUMABLE
+                )
+            )
+        self.__changed()
+
+    @staticmethod
+    def __discard(path: str):
+        try:
+            TransferJournal.discard(path)
+        except OSError as error:
+            logging.error('Could not remove the partial download %s: %s' % (path, error))
+
+    def retry(self, transfer: Transfer):
+        if transfer.status in (TransferStatus.FAILED, TransferStatus.CANCELLED):
+            transfer.attempts = 0
+            transfer.status = TransferStatus.QUEUED
+            self.__changed()
+
+    def clear(self):
+        """
+        Removes finished (done, failed and cancelled) transfers
+        """
+        self.transfers = [
+            transfer for transfer in self.transfers
+            if transfer.active or transfer.status == TransferStatus.PAUSED
+        ]
+        self.changed.emit()
+
+    def statistics(self) -> (int, int, int, int, float, float):
+        """
+        Aggregate progress of the transfers in the queue (not cancelled):
+        (transferred bytes, total bytes, transferred files, total files, throughput bytes/sec, ETA seconds or None)
+        """
+        transfers = [transfer for transfer in self.transfers if transfer.status != TransferStatus.CANCELLED]
+        transferred = sum(transfer.transferred for transfer in transfers)
+        size = sum(transfer.size for transfer in transfers)
+        files_done = sum(transfer.files_done for transfer in transfers)
+        files = sum(transfer.files for transfer in transfers)
+
+        now = time.monotonic()
+        self.__samples.append((now, transferred))
+        while len(self.__samples) > 2 and self.__samples[0][0] < now - self.THROUGHPUT_WINDOW:
+            self.__samples.popleft()
+        (first_time, first), (last_time, last) = self.__samples[0], self.__samples[-1]
+        throughput = max(last - first, 0) / (last_time - first_time) if last_time > first_time else 0.
+        eta = (size - transferred) / throughput if throughput and size else None
+        return transferred, size, files_done, files, throughput, eta
+
+    def __stop(self, transfer: Transfer, status: str):
+        transfer.status = status
+        worker = self.workers.pop(transfer.id, None)
+        if worker:
+            worker.cancel(silent=True)
+            # Other transfers of the stopped batch are queued again
+            for _transfer in self.transfers:
+                if self.workers.get(_transfer.id) is worker:
+                    del self.workers[_transfer.id]
+                    _transfer.status = TransferStatus.QUEUED
+        self.__changed()
+
+    def __changed(self):
+        self.__schedule()
+        self.changed.emit()
+
+    def __schedule(self):
+        limit = Settings.device_concurrency()
+        running = {}
+        for transfer in self.transfers:
+            if transfer.status == TransferStatus.RUNNING:
+                running[transfer.device] = running.get(transfer.device, 0) + 1
+
+        for transfer in self.transfers:
+            if transfer.status != TransferStatus.QUEUED:
+                continue
+            if limit and running.get(transfer.device, 0) >= limit:
+                continue
+            running[transfer.device] = running.get(transfer.device, 0) + 1
+            self.__start(self.__batch(transfer))
+
+    def __batchable(self, transfer: Transfer) -> bool:
+        return transfer.status == TransferStatus.QUEUED and transfer.attempts == 0 and \
+            transfer.mode == TransferMode.SYNC and transfer.files == 1 and transfer.size <= self.BATCH_FILE_SIZE
+
+    def __batch(self, transfer: Transfer) -> List[Transfer]:
+        batch = [transfer]
+        if not self.__batchable(transfer):
+            return batch
+        for _transfer in self.transfers:
+            if len(batch) >= self.BATCH_FILES:
+                break
+            if _transfer is not transfer and self.__batchable(_transfer) and \
+                    (_transfer.type, _transfer.device, _transfer.destination) == \
+                    (transfer.type, transfer.device, transfer.destination):
+                batch.append(_transfer)
+        return batch
+
+    def __start(self, transfers: List[Transfer]):
+        for transfer in transfers:
+            transfer.reset()
+            transfer.status = TransferStatus.RUNNING
+            transfer.attempts += 1
+        worker = AsyncRepositoryWorker(
+            worker_id=self.DOWNLOAD_WORKER_ID if transfers[0].type == TransferType.DOWNLOAD else self.UPLOAD_WORKER_ID,
+            name=transfers[0].type,
+            repository_method=self.__run,
+            arguments=(transfers, len(transfers) == 1 and self.__compress(transfers[0])),
+            response_callback=partial(self.__response, transfers),
+            timeout=Settings.operation_timeout('transfer'),
+            priority=JobScheduler.BULK,
+            device=transfers[0].device
+        )
+        if Adb.worker().work(worker):
+            for transfer in transfers:
+                self.workers[transfer.id] = worker
+            worker.start()
+
+    def __compress(self, transfer: Transfer) -> bool:
+        setting = Settings.transfer_compression()
+        if setting == 'off' or transfer.type != TransferType.DOWNLOAD or transfer.mode == TransferMode.RESUMABLE or \
+                not compression.compressible(transfer.source):
+            return False
+        if setting == 'on':
+            return True
+        bandwidth = self.__bandwidth.get(transfer.device)
+        if bandwidth is None:
+            # Wireless devices (serial is 'host:port') are slow until measured otherwise
+            return ':' in (transfer.device or '')
+        return bandwidth < self.COMPRESSION_BANDWIDTH
+
+    @classmethod
+    def __run(cls, transfers: List[Transfer], compress: bool = False) -> (str, str):
+        started = time.monotonic()
+        data, error = cls.__transfer(transfers, compress)
+        size = sum(transfer.size for transfer in transfers if not transfer.verified)  # Skipped are not measured
+        if not error and not compress and size >= cls.BANDWIDTH_SAMPLE_SIZE:
+            bandwidth = size / max(time.monotonic() - started, 0.001)
+            previous = cls.__bandwidth.get(transfers[0].device)
+            cls.__bandwidth[transfers[0].device] = bandwidth if previous is None else (previous + bandwidth) / 2
+        return data, error
+
+    @classmethod
+    def __transfer(cls, transfers: List[Transfer], compress: bool) -> (str, str):
+        if Settings.transfer_skip_identical():
+            identical = TransferVerifier.identical(transfers)
+            for transfer in identical:
+                transfer.update(transfer.source, 100)
+                transfer.verified = True
+            transfers = [transfer for transfer in transfers if transfer not in identical]
+            if not transfers:
+                return "%d identical file(s) skipped" % len(identical), None
+        if Settings.transfer_verify():
+            # Sources are hashed while they are transferred, the verification only hashes the destinations
+            for transfer in transfers:
+                TransferVerifier.start(transfer)
+
+        if len(transfers) == 1:
+            return cls.__run_one(transfers[0], compress)
+
+        # Progress lines of the batch are matched to the transfers by path (device path or file name)
+        paths = {}
+        for transfer in transfers:
+            paths[transfer.source] = paths[transfer.name] = transfer
+
+        def progress_callback(path: str, progress: int):
+            transfer = paths.get(path) or paths.get(posixpath.basename(path.replace('\\', '/')))
+            if transfer:
+                transfer.update(path, progress)
+
+        sources = [transfer.source for transfer in transfers]
+        started = time.time()
+        if transfers[0].type == TransferType.DOWNLOAD:
+            data, error = FileRepository.download(progress_callback, sources, transfers[0].destination)
+        else:
+            data, error = FileRepository.upload(progress_callback, sources, transfers[0].destination)
+        if error:
+            # Errors of a batch are not per file, its files are checked at the destination
+            arrived = TransferVerifier.arrived(transfers, started)
+            for transfer in transfers:
+                transfer.missing = transfer not in arrived
+        return data, error
+
+    @staticmethod
+    def __run_one(transfer: Transfer, compress: bool) -> (str, str):
+        if transfer.type == TransferType.DOWNLOAD:
+            if not transfer.files:
+                usage, _ = FileRepository.disk_usage(transfer.source)
+                if usage:
+                    transfer.size, transfer.files = usage
+            mode = TransferMode.COMPRESSED if compress else transfer.mode
+            return FileRepository.download(transfer.update, transfer.source, transfer.destination, mode)
+
+        if os.path.isdir(transfer.source):
+            files = [os.path.join(root, name) for root, _, names in os.walk(transfer.source) for name in names]
+            transfer.size, transfer.files = sum(os.path.getsize(file) for file in files), len(files)
+        else:
+            transfer.size, transfer.files = os.path.getsize(transfer.source), 1
+        return FileRepository.upload(transfer.update, transfer.source, transfer.destination, transfer.mode)
+
+    def __response(self, transfers: List[Transfer], data, error):
+        for transfer in transfers:
+            self.workers.pop(transfer.id, None)
+        transfers = [transfer for transfer in transfers if transfer.status == TransferStatus.RUNNING]
+        if not transfers:
+            return  # Paused or cancelled
+
+        verify = []
+        for transfer in transfers:
+            transfer.message, transfer.error = data, error
+            if transfer.verified:
+                transfer.message, transfer.error = "Identical to the destination, skipped", None
+            # Files of a failed batch found at the destination are done, the others are retried one by one
+            failed = error and (not data if len(transfers) == 1 else transfer.missing)
+            if failed and transfer.attempts <= Settings.transfer_retries():
+                transfer.status = TransferStatus.QUEUED
+            elif failed:
+                transfer.status = TransferStatus.FAILED
+            elif Settings.transfer_verify() and not transfer.verified:
+                transfer.status = TransferStatus.VERIFYING
+                verify.append(transfer)
+            else:
+                transfer.status = TransferStatus.DONE
+                transfer.files_done = transfer.files
+
+        if verify:
+            self.__verify(verify)
+        self.__finished(transfers[0])
+
+    def __verify(self, transfers: List[Transfer]):
+        worker = AsyncRepositoryWorker(
+            worker_id=self.VERIFY_WORKER_ID,
+            name='Verification',
+            repository_method=TransferVerifier.verify,
+            arguments=(transfers,),
+            response_callback=partial(self.__verified, transfers),
+            timeout=Settings.operation_timeout('transfer'),
+            priority=JobScheduler.BACKGROUND,
+            device=transfers[0].device
+        )
+        if Adb.worker().work(worker):
+            for transfer in transfers:
+                self.workers[transfer.id] = worker
+            worker.start()
+
+    def __verified(self, transfers: List[Transfer], failures: dict, error: str):
+        for transfer in transfers:
+            self.workers.pop(transfer.id, None)
+        transfers = [transfer for transfer in transfers if transfer.status == TransferStatus.VERIFYING]
+        if not transfers:
+            return  # Paused or cancelled
+
+        for transfer in transfers:
+            transfer.verified = True
+            reason = (failures or {}).get(transfer.id)
+            if not reason:
+                # Without checksums of the device the transfer is done, but not verified
+                status = "not verified (%s)" % error if error else "verified"
+                transfer.status = TransferStatus.DONE
+                transfer.files_done = transfer.files
+                transfer.message = "%s, %s" % (transfer.message, status) if transfer.message else status
+                continue
+            logging.error('Verification of %s failed: %s' % (transfer.source, reason))
+            transfer.error = reason
+            if transfer.attempts <= Settings.transfer_retries():
+                transfer.status = TransferStatus.QUEUED
+            else:
+                transfer.status = TransferStatus.FAILED
+        self.__finished(transfers[0])
+
+    def __finished(self, transfer: Transfer):
+        self.__changed()
+        # Current directory is refreshed once its uploads are finished
+        if transfer.type == TransferType.UPLOAD and transfer.destination == Adb.manager().path() and not any(
+                _transfer.active and _transfer.destination == transfer.destination for _transfer in self.transfers
+        ):
+            Global().communicate.files__refresh.emit()
+        if not any(transfer.active for transfer in self.transfers):
+            self.__notify()
+
+    def __notify(self):
+        done = len([transfer for transfer in self.transfers if transfer.status == TransferStatus.DONE])
+        failed = [transfer for transfer in self.transfers if transfer.status == TransferStatus.FAILED]
+        body = "%d transfer(s) finished" % done
+        if failed:
+            body += "<br/><span style='color: red; font-weight: 600'>%d failed:</span><br/>%s" % (
+                len(failed), "<br/>".join("%s: %s" % (transfer.name, transfer.error) for transfer in failed[:5])
+            )
+        Global().communicate.notification.emit(MessageData(title='Transfers', timeout=15000, body=body))
@@ -0,0 +1,218 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import logging
+import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from app.core.configurations import Settings
+from app.core.journal import ResumableDownload
+from app.core.main import Adb
+from app.data.models import Transfer, TransferType
+from app.data.repositories import FileRepository
+from app.helpers.checksum import ALGORITHMS, Hasher
+from app.helpers.tools import CancellationToken
+
+
+class TransferVerifier:
+    """
+    TransferVerifier - compares files of the transfers with their sources by checksums.
+    Checksums of the sources are calculated while the transfers run ('start'): `sha256sum` of the device files
+    of a download, the local files of an upload in the Hasher. Only the destinations are hashed once
+    a transfer is finished, device side (`sha256sum`, `md5sum` on old devices) while the local files are hashed
+    """
+
+    WORKERS = 2
+
+    __pool = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def paths(cls, transfer: Transfer) -> (str, str):
+        """
+        Local path and device path of the transferred file (or directory)
+        """
+        if transfer.type == TransferType.DOWNLOAD:
+            destination = transfer.destination or Settings.device_downloads_path(Adb.manager().get_device())
+            return os.path.join(destination, transfer.name), transfer.source
+        return transfer.source, posixpath.join(transfer.destination, transfer.name)
+
+    @classmethod
+    def files(cls, transfer: Transfer) -> (List[tuple], List[str]):
+        """
+        Pairs (local path, device path) of the files of the transfer and the files missing on one of the sides
+        """
+        local, device = cls.paths(transfer)
+        if not os.path.isdir(local):
+            return [(local, device)], []
+
+        device = posixpath.join(device, '')
+        remote, error = FileRepository.manifest(device)
+        if remote is None or error:
+            return [], [error or device]
+        files = cls.local_files(local)
+        pairs = [(os.path.join(local, *path.split('/')), device + path) for path in sorted(set(files) & set(remote))]
+        return pairs, sorted(set(files) ^ set(remote))
+
+    @classmethod
+    def local_files(cls, path: str) -> List[str]:
+        """
+        Relative paths (with '/') of the files of the local directory, parts of resumable downloads are skipped
+        """
+        return [
+            os.path.relpath(os.path.join(root, name), path).replace(os.sep, '/')
+            for root, _, names in os.walk(path) for name in names if not name.endswith(ResumableDownload.SUFFIX)
+        ]
+
+    @classmethod
+    def start(cls, transfer: Transfer):
+        """
+        Starts the checksums of the source files of the transfer, they are calculated while the transfer runs
+        (in the cancellation context of the transfer). 'verify' waits for them
+        """
+        token = CancellationToken.current()
+
+        def run() -> dict:
+            if not token:
+                return cls.sources(transfer)
+            with token.activate():
+                return cls.sources(transfer)
+
+        with cls.__lock:
+            if not cls.__pool:
+                cls.__pool = ThreadPoolExecutor(cls.WORKERS, thread_name_prefix='Verification')
+            transfer.checksums = cls.__pool.submit(run)
+
+    @classmethod
+    def sources(cls, transfer: Transfer) -> dict:
+        """
+        SHA-256 digests of the source files of the transfer: {path: digest}, paths are the ones of 'files'
+        """
+        local, device = cls.paths(transfer)
+        if transfer.type == TransferType.UPLOAD:
+            if not os.path.isdir(local):
+                return Hasher.digests([local], ALGORITHMS[0])
+            return Hasher.digests([os.path.join(local, *path.split('/')) for path in cls.local_files(local)])
+
+        file, error = FileRepository.file(device)
+        if file and file.isdir:
+            device = posixpath.join(device, '')
+            manifest, error = FileRepository.manifest(device)
+            paths = [device + path for path in manifest or {}]
+        else:
+            paths = [device]
+        digests, error = FileRepository.checksums(paths, ALGORITHMS[0]) if paths else ({}, error)
+        if error:
+            logging.error('Checksums of %s failed: %s' % (transfer.source, error))
+        return digests or {}
+
+    @classmethod
+    def known(cls, transfer: Transfer) -> dict:
+        """
+        Checksums of the sources calculated during the transfer, empty if they failed
+        """
+        if not transfer.checksums:
+            return {}
+        token = CancellationToken.current()
+        try:
+            return transfer.checksums.result(timeout=token.remaining() if token else None)
+        except Exception as error:
+            logging.error('Checksums of %s are not available: %s' % (transfer.source, error))
+            return {}
+
+    @classmethod
+    def checksums(cls, pairs: List[tuple], known: dict = None) -> (dict, dict):
+        """
+        Checksums of the local and device files: ({local path: digest}, {device path: digest}).
+        SHA-256 digests in 'known' (e.g. of the sources, calculated during the transfers) are not calculated again
+        """
+        known = known or {}
+        local = {path: known.get(path) or Hasher.submit(path, ALGORITHMS[0]) for path, _ in pairs}
+        remote = {path: known[path] for _, path in pairs if path in known}
+        paths = [path for _, path in pairs if path not in known]
+        algorithm = ALGORITHMS[0]
+        if paths:
+            for algorithm in ALGORITHMS:
+                if algorithm != ALGORITHMS[0]:
+                    # Devices without `sha256sum` are compared by md5, the known digests are not used then
+                    remote, paths = {}, [path for _, path in pairs]
+                digests, error = FileRepository.checksums(paths, algorithm)
+                if digests:
+                    break
+                logging.error('Device checksums (%s) failed: %s' % (algorithm, error))
+            else:
+                return {}, {}
+            remote.update(digests)
+        if algorithm != ALGORITHMS[0]:
+            local = {path: Hasher.submit(path, algorithm) for path, _ in pairs}
+
+        return Hasher.results(local), remote
+
+    @classmethod
+    def verify(cls, transfers: List[Transfer]) -> (dict, str):
+        """
+        Verifies finished transfers. Returns reasons of the failed ones: {transfer id: reason}
+        """
+        failures = {}
+        pairs = {}
+        known = {}
+        for transfer in transfers:
+            known.update(cls.known(transfer))
+            files, missing = cls.files(transfer)
+            pairs[transfer.id] = files
+            if missing:
+                failures[transfer.id] = "Missing after the transfer: %s" % ", ".join(missing[:5])
+
+        local, remote = cls.checksums([pair for files in pairs.values() for pair in files], known)
+        if not remote:
+            return failures, "Checksums are not available on the device"
+        for transfer in transfers:
+            for local_path, device_path in pairs[transfer.id]:
+                if not local.get(local_path) or local.get(local_path) != remote.get(device_path):
+                    failures.setdefault(transfer.id, "Checksum mismatch: %s" % device_path)
+                    break
+        return failures, None
+
+    @classmethod
+    def arrived(cls, transfers: List[Transfer], since: float = None) -> List[Transfer]:
+        """
+        Transfers of single files whose destination exists with the size of the source.
+        With 'since' (time.time() when the transfer started) a file found at the destination must also come from
+        this transfer: its progress reached 100%, or a downloaded file was modified since then (times of the device
+        are not compared with the local clock). Otherwise a copy of an earlier run would hide a failure
+        """
+        result = []
+        for transfer in transfers:
+            local, device = cls.paths(transfer)
+            if transfer.files != 1 or not os.path.isfile(local):
+                continue
+            if since is not None and transfer.progress < 100:
+                if transfer.type != TransferType.DOWNLOAD or os.path.getmtime(local) < since:
+                    continue
+            if transfer.type == TransferType.DOWNLOAD:
+                size = transfer.size
+            else:
+                file, _ = FileRepository.file(device)
+                size = file.raw_size if file and not file.isdir else None
+            if size == os.path.getsize(local):
+                result.append(transfer)
+        return result
+
+    @classmethod
+    def identical(cls, transfers: List[Transfer]) -> List[Transfer]:
+        """
+        Transfers of single files whose destination already exists with the same size and checksum.
+        Sizes are compared first, so only likely copies are hashed. Modification times are not required to match,
+        they differ whenever the timestamps are not preserved
+        """
+        candidates = [(transfer, *cls.paths(transfer)) for transfer in cls.arrived(transfers)]
+        if not candidates:
+            return []
+
+        local, remote = cls.checksums([(local, device) for _, local, device in candidates])
+        return [
+            transfer for transfer, local_path, device_path in candidates
+            if local.get(local_path) and local.get(local_path) == remote.get(device_path)
+        ]
@@ -2,6 +2,7 @@
 # Copyright (C) 2022  Azat Aldeshov
 import datetime
 import posixpath
+import sys
 
 size_types = (
     ('BYTE', 'B'),
@@ -20,6 +21,7 @@ file_types = (
     ('s', 'Socket'),
     ('p', 'FIFO')
 )
+types_by_code = dict(file_types)
 
 months = (
     ('NONE', 'None', 'None'),
@@ -48,17 +50,46 @@ days = (
 )
 
 
+def readable_size(size: int) -> str:
+    if not size:
+        return ''
+    count = 0
+    result = size
+    while result >= 1024 and count < len(size_types) - 1:
+        result /= 1024
+        count += 1
+
+    return '%s %s' % (round(result, 2), size_types[count][1])
+
+
+def interned(value):
+    """
+    Shared copy of the string (None stays None), repeated fields of the files are kept once
+    """
+    return None if value is None else sys.intern(str(value))
+
+
 class File:
+    """
+    File - entry of a device directory. Slots instead of an instance dictionary (millions of files are listed
+    and indexed), repeated fields (owner, group, permissions, types) are interned, missing fields are None
+    """
+
+    __slots__ = (
+        'name', 'owner', 'group', 'other', 'link', 'link_type', 'file_type', 'permissions', 'raw_size', 'raw_date',
+        '__directory', '__path',
+    )
+
     def __init__(self, **kwargs):
-        self.name = str(kwargs.get("name"))
-        self.owner = str(kwargs.get("owner"))
-        self.group = str(kwargs.get("group"))
-        self.other = str(kwargs.get("other"))
-        self.path = str(kwargs.get("path"))
-        self.link = str(kwargs.get("link"))
-        self.link_type = str(kwargs.get("link_type"))
-        self.file_type = str(kwargs.get("file_type"))
-        self.permissions = str(kwargs.get("permissions"))
+        self.name = kwargs.get("name")
+        self.owner = interned(kwargs.get("owner"))
+        self.group = interned(kwargs.get("group"))
+        self.other = interned(kwargs.get("other"))
+        self.path = kwargs.get("path")
+        self.link = kwargs.get("link")
+        self.link_type = interned(kwargs.get("link_type"))
+        self.file_type = interned(kwargs.get("file_type"))
+        self.permissions = interned(kwargs.get("permissions"))
 
         self.raw_size = kwargs.get("size") or 0
         self.raw_date = kwargs.get("date_time")
@@ -68,15 +99,7 @@ class File:
 
     @property
     def size(self):
-        if not self.raw_size:
-            return ''
-        count = 0
-        result = self.raw_size
-        while result >= 1024 and count < len(size_types):
-            result /= 1024
-            count += 1
-
-        return '%s %s' % (round(result, 2), size_types[count][1])
+        return readable_size(self.raw_size)
 
     @property
     def date(self):
@@ -98,16 +121,25 @@ class File:
         else:
             return str(created.time())[:-3]
 
+    @property
+    def path(self) -> str:
+        return self.__directory + self.name if self.__directory is not None else self.__path
+
+    @path.setter
+    def path(self, path: str):
+        # Files of a listing share the directory of their paths
+        if path and self.name and path.endswith('/' + self.name):
+            self.__directory, self.__path = interned(path[:len(path) - len(self.name)]), None
+        else:
+            self.__directory, self.__path = None, path
+
     @property
     def location(self):
         return posixpath.dirname(self.path or '') + '/'
 
     @property
     def type(self):
-        for ft in file_types:
-            if self.permissions and self.permissions[0] == ft[0]:
-                return ft[1]
-        return 'Unknown'
+        return types_by_code.get(self.permissions[0] if self.permissions else None, 'Unknown')
 
     @property
     def isdir(self):
@@ -149,3 +181,84 @@ class MessageData:
 class MessageType:
     MESSAGE = 1
     LOADING_MESSAGE = 2
+
+
+class TransferType:
+    DOWNLOAD = 'Download'
+    UPLOAD = 'Upload'
+
+
+class TransferMode:
+    SYNC = 'sync'  # File by file (adb pull/push, sync service)
+    TAR = 'tar'  # One tar stream (exec-out/exec-in), for directories with many small files
+    COMPRESSED = 'compressed'  # Tar stream compressed on the device (gzip/zstd), downloads over slow links
+    RESUMABLE = 'resumable'  # Large file by chunks (dd ranges), continues from the journal after a failure
+
+
+class TransferStatus:
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    VERIFYING = 'Verifying'
+    PAUSED = 'Paused'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
+
+
+class Transfer:
+    def __init__(self, **kwargs):
+        self.id = kwargs.get("id")
+        self.type = kwargs.get("type")
+        self.device = kwargs.get("device")
+        self.source = kwargs.get("source")
+        self.destination = kwargs.get("destination")
+        self.mode = kwargs.get("mode") or TransferMode.SYNC
+        self.status = kwargs.get("status") or TransferStatus.QUEUED
+        self.size = kwargs.get("size") or 0  # Bytes, 0 - unknown
+        self.files = kwargs.get("files") or 0  # Number of files, 0 - unknown
+        self.files_done = 0
+        self.progress = 0  # Progress of the current file (percent)
+        self.current = None  # Current file
+        self.attempts = 0
+        self.verified = False  # Checksums are compared (or the transfer is skipped as identical)
+        self.missing = False  # The file is not found complete at the destination after a failed batch
+        self.checksums = None  # Future of the checksums of the source files, calculated during the transfer
+        self.message = None
+        self.error = None
+
+    @property
+    def name(self):
+        return posixpath.basename(posixpath.normpath(self.source.replace('\\', '/')))
+
+    @property
+    def fraction(self) -> float:
+        if self.status == TransferStatus.DONE:
+            return 1.
+        # Progress of the source itself (e.g. tar stream) is the progress of the whole transfer
+        if self.files > 1 and self.current != self.source:
+            return min((self.files_done + self.progress / 100) / self.files, 1.)
+        return self.progress / 100
+
+    @property
+    def transferred(self) -> int:
+        return int(self.size * self.fraction)
+
+    @property
+    def active(self) -> bool:
+        return self.status in (TransferStatus.QUEUED, TransferStatus.RUNNING, TransferStatus.VERIFYING)
+
+    def update(self, path: str, progress: int):
+        # Repositories report the progress per file, a new path means the previous file is done
+        if self.current and path != self.current:
+            self.files_done += 1
+        self.current = path
+        self.progress = progress
+
+    def reset(self):
+        self.files_done = 0
+        self.progress = 0
+        self.current = None
+        self.verified = False
+        self.missing = False
+        self.checksums = None
+        self.error = None
@@ -1,10 +1,31 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
-from typing import List
+import asyncio
+import os
+import posixpath
+from contextlib import contextmanager
+from typing import List, Union
 
+from app.core.listings import ListingCache
 from app.core.main import Adb
-from app.data.models import Device, File
+from app.data.models import Device, File, TransferMode
 from app.data.repositories import android_adb, python_adb
+from app.helpers.tools import CancellationToken
+
+
+@contextmanager
+def _changing(*paths: (str, bool)):
+    # Listings changed by our own operations are listed again: (path, recursive) are invalidated before the change
+    # and after it, a listing made while the device was changed could be cached with the old files
+    device = Adb.manager().get_device()
+    paths = [(path, recursive) for path, recursive in paths if path] if device else []
+    for path, recursive in paths:
+        ListingCache.invalidate(device.id, path, recursive)
+    try:
+        yield
+    finally:
+        for path, recursive in paths:
+            ListingCache.invalidate(device.id, path, recursive)
 
 
 class FileRepository:
@@ -16,18 +37,19 @@ class FileRepository:
             return android_adb.FileRepository.file(path=path)
 
     @classmethod
-    def files(cls) -> (List[File], str):
+    def files(cls, path: str = None, batch_callback: callable = None) -> (List[File], str):
         if Adb.core == Adb.PYTHON_ADB_SHELL:
-            return python_adb.FileRepository.files()
+            return python_adb.FileRepository.files(path=path, batch_callback=batch_callback)
         elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
-            return android_adb.FileRepository.files()
+            return android_adb.FileRepository.files(path=path, batch_callback=batch_callback)
 
     @classmethod
     def rename(cls, file: File, name: str) -> (str, str):
-        if Adb.core == Adb.PYTHON_ADB_SHELL:
-            return python_adb.FileRepository.rename(file, name)
-        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
-            return android_adb.FileRepository.rename(file, name)
+        with _changing((file.location, False), (file.path, True)):
+            if Adb.core == Adb.PYTHON_ADB_SHELL:
+                return python_adb.FileRepository.rename(file, name)
+            elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+                return android_adb.FileRepository.rename(file, name)
 
     @classmethod
     def open_file(cls, file: File) -> (str, str):
@@ -38,45 +60,110 @@ class FileRepository:
 
     @classmethod
     def delete(cls, file: File) -> (str, str):
-        if Adb.core == Adb.PYTHON_ADB_SHELL:
-            return python_adb.FileRepository.delete(file)
-        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
-            return android_adb.FileRepository.delete(file)
+        with _changing((file.location, False), (file.path, True)):
+            if Adb.core == Adb.PYTHON_ADB_SHELL:
+                return python_adb.FileRepository.delete(file)
+            elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+                return android_adb.FileRepository.delete(file)
 
     @classmethod
-    def download(cls, progress_callback: callable, source: str, destination: str) -> (str, str):
+    def download(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
         if Adb.core == Adb.PYTHON_ADB_SHELL:
             return python_adb.FileRepository.download(
                 progress_callback=progress_callback,
                 source=source,
-                destination=destination
+                destination=destination,
+                mode=mode
             )
         elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
             return android_adb.FileRepository.download(
                 progress_callback=progress_callback,
                 source=source,
-                destination=destination
+                destination=destination,
+                mode=mode
             )
 
     @classmethod
     def new_folder(cls, name) -> (str, str):
+        with _changing((Adb.manager().path(), False)):
+            if Adb.core == Adb.PYTHON_ADB_SHELL:
+                return python_adb.FileRepository.new_folder(name=name)
+            elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+                return android_adb.FileRepository.new_folder(name=name)
+
+    @classmethod
+    def upload(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str = None,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
+        changed = [(destination or Adb.manager().path(), False)]
+        for path in [source] if isinstance(source, str) else source:
+            name = os.path.basename(os.path.normpath(path))
+            changed.append((posixpath.join(destination or Adb.manager().path(), name), True))
+        with _changing(*changed):
+            if Adb.core == Adb.PYTHON_ADB_SHELL:
+                return python_adb.FileRepository.upload(
+                    progress_callback=progress_callback,
+                    source=source,
+                    destination=destination,
+                    mode=mode
+                )
+            elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+                return android_adb.FileRepository.upload(
+                    progress_callback=progress_callback,
+                    source=source,
+                    destination=destination,
+                    mode=mode
+                )
+
+    @classmethod
+    def disk_usage(cls, path: str) -> ((int, int), str):
         if Adb.core == Adb.PYTHON_ADB_SHELL:
-            return python_adb.FileRepository.new_folder(name=name)
+            return python_adb.FileRepository.disk_usage(path)
         elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
-            return android_adb.FileRepository.new_folder(name=name)
+            return android_adb.FileRepository.disk_usage(path)
 
     @classmethod
-    def upload(cls, progress_callback: callable, source: str) -> (str, str):
+    def modified(cls, path: str) -> ((int, int), str):
         if Adb.core == Adb.PYTHON_ADB_SHELL:
-            return python_adb.FileRepository.upload(
-                progress_callback=progress_callback,
-                source=source
-            )
+            return python_adb.FileRepository.modified(path)
         elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
-            return android_adb.FileRepository.upload(
-                progress_callback=progress_callback,
-                source=source
-            )
+            return android_adb.FileRepository.modified(path)
+
+    @classmethod
+    def manifest(cls, path: str) -> (dict, str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return python_adb.FileRepository.manifest(path)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return android_adb.FileRepository.manifest(path)
+
+    @classmethod
+    def tree(
+            cls, paths: List[str], batch_callback: callable, children: bool = False, directories: bool = False
+    ) -> (int, str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return python_adb.FileRepository.tree(paths, batch_callback, children, directories)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return android_adb.FileRepository.tree(paths, batch_callback, children, directories)
+
+    @classmethod
+    def search(
+            cls, path: str, pattern: str, content: bool = False, batch_callback: callable = None
+    ) -> (List[File], str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return python_adb.FileRepository.search(path, pattern, content, batch_callback)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return android_adb.FileRepository.search(path, pattern, content, batch_callback)
+
+    @classmethod
+    def checksums(cls, paths: List[str], algorithm: str = 'sha256') -> (dict, str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return python_adb.FileRepository.checksums(paths, algorithm)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return android_adb.FileRepository.checksums(paths, algorithm)
 
 
 class DeviceRepository:
@@ -100,3 +187,71 @@ class DeviceRepository:
             return python_adb.DeviceRepository.disconnect()
         elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
             return android_adb.DeviceRepository.disconnect()
+
+
+async def _run_blocking(method: callable, *args, **kwargs):
+    # Blocking methods are run in the default executor of the loop with their own token,
+    # cancelling the coroutine (or its timeout) cancels the token and so stops the adb calls of the method
+    token = CancellationToken()
+
+    def run():
+        with token.activate():
+            return method(*args, **kwargs)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
+
+
+class AsyncFileRepository:
+    """
+    AsyncFileRepository - coroutine versions of the FileRepository methods. They run the blocking ones,
+    so listings are invalidated and transfer modes are applied the same way. Callbacks are called in the executor
+    """
+
+    @classmethod
+    async def file(cls, path: str) -> (File, str):
+        return await _run_blocking(FileRepository.file, path)
+
+    @classmethod
+    async def files(cls, path: str = None, batch_callback: callable = None) -> (List[File], str):
+        return await _run_blocking(FileRepository.files, path, batch_callback)
+
+    @classmethod
+    async def download(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
+        return await _run_blocking(FileRepository.download, progress_callback, source, destination, mode)
+
+    @classmethod
+    async def upload(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str = None,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
+        return await _run_blocking(FileRepository.upload, progress_callback, source, destination, mode)
+
+
+class AsyncDeviceRepository:
+    @classmethod
+    async def devices(cls) -> (List[Device], str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return await _run_blocking(python_adb.DeviceRepository.devices)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return await android_adb.AsyncDeviceRepository.devices()
+
+    @classmethod
+    async def connect(cls, device_id) -> (str, str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return await _run_blocking(python_adb.DeviceRepository.connect, device_id)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return await android_adb.AsyncDeviceRepository.connect(device_id=device_id)
+
+    @classmethod
+    async def disconnect(cls) -> (str, str):
+        if Adb.core == Adb.PYTHON_ADB_SHELL:
+            return await _run_blocking(python_adb.DeviceRepository.disconnect)
+        elif Adb.core == Adb.EXTERNAL_TOOL_ADB:
+            return await android_adb.AsyncDeviceRepository.disconnect()
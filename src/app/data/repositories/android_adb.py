@@ -1,12 +1,38 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
-from typing import List
+import logging
+import os
+import posixpath
+import shlex
+import tarfile
+import time
+from itertools import islice
+from typing import List, Union
 
 from app.core.configurations import Settings
+from app.core.journal import ResumableDownload
 from app.core.managers import ADBManager
-from app.data.models import FileType, Device, File
-from app.helpers.converters import convert_to_devices, convert_to_file, convert_to_file_list_a
-from app.services import adb
+from app.data.models import FileType, Device, File, TransferMode
+from app.helpers import archive, compression
+from app.helpers.converters import convert_to_devices, convert_to_file, iterate_file_list_a, \
+    iterate_file_list_sync, convert_to_file_sync, convert_to_disk_usage, convert_to_modified, \
+    convert_to_manifest, convert_to_checksums, iterate_tree, iterate_found_files
+from app.helpers.tools import collect, deliver
+from app.services import adb, adb_async, smart_socket
+
+
+_compressors = {}  # Device id: compressors available on the device
+
+
+def _convert_listing(lines, path: str, batch_callback: callable = None) -> List[File]:
+    # Names of the directory links come first, then the marker line and 'ls -a -l' output
+    lines = iter(lines)
+    dirs = set()
+    for line in lines:
+        if line.startswith(adb.ShellCommand.LS_ALL_LIST_LINK_DIRS_MARKER):
+            break
+        dirs.add(line.rstrip('\n'))
+    return collect(iterate_file_list_a(lines, dirs=dirs, path=path), batch_callback)
 
 
 class FileRepository:
@@ -16,7 +42,10 @@ class FileRepository:
             return None, "No device selected!"
 
         path = ADBManager.clear_path(path)
-        args = adb.ShellCommand.LS_LIST_DIRS + [path.replace(' ', r'\ ')]
+        if adb.SOCKET_TRANSPORT:
+            return cls.__file_sync(path)
+
+        args = adb.ShellCommand.LS_LIST_DIRS + [shlex.quote(path)]
         response = adb.shell(ADBManager.get_device().id, args)
         if not response.IsSuccessful:
             return None, response.ErrorData or response.OutputData
@@ -26,7 +55,7 @@ class FileRepository:
             return None, "Unexpected string:\n%s" % response.OutputData
 
         if file.type == FileType.LINK:
-            args = adb.ShellCommand.LS_LIST_DIRS + [path.replace(' ', r'\ ') + '/']
+            args = adb.ShellCommand.LS_LIST_DIRS + [shlex.quote(path + '/')]
             response = adb.shell(ADBManager.get_device().id, args)
             file.link_type = FileType.UNKNOWN
             if response.OutputData and response.OutputData.startswith('d'):
@@ -37,51 +66,70 @@ class FileRepository:
         return file, response.ErrorData
 
     @classmethod
-    def files(cls) -> (List[File], str):
+    def files(cls, path: str = None, batch_callback: callable = None) -> (List[File], str):
+        """
+        Files of the directory (the current one by default).
+        With 'batch_callback' they are also delivered in batches while they are read
+        """
         if not ADBManager.get_device():
             return None, "No device selected!"
 
-        path = ADBManager.path()
-        args = adb.ShellCommand.LS_ALL_LIST + [path.replace(' ', r'\ ')]
-        response = adb.shell(ADBManager.get_device().id, args)
-        if not response.IsSuccessful and response.ExitCode != 1:
-            return [], response.ErrorData or response.OutputData
+        path = path or ADBManager.path()
+        if adb.SOCKET_TRANSPORT:
+            return cls.__files_sync(path, batch_callback)
 
-        if not response.OutputData:
-            return [], response.ErrorData
+        quoted = shlex.quote(path)
+        args = [adb.ShellCommand.LS_ALL_LIST_LINK_DIRS % (quoted, quoted)]
+        response = adb.shell_stream(ADBManager.get_device().id, args)
+        files = _convert_listing(response, path, batch_callback)
+        if not response.IsSuccessful and response.ExitCode != 1:
+            return [], response.ErrorData or "Could not list the directory %s" % path
+        return files, response.ErrorData
 
-        args = adb.ShellCommand.LS_ALL_DIRS + [path.replace(' ', r'\ ') + "*/"]
-        response_dirs = adb.shell(ADBManager.get_device().id, args)
-        if not response_dirs.IsSuccessful and response_dirs.ExitCode != 1:
-            return [], response_dirs.ErrorData or response_dirs.OutputData
+    @classmethod
+    def __file_sync(cls, path: str) -> (File, str):
+        try:
+            entry = smart_socket.file(ADBManager.get_device().id, path)
+            return convert_to_file_sync(entry, path=path), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, str(error)
 
-        dirs = response_dirs.OutputData.split() if response_dirs.OutputData else []
-        files = convert_to_file_list_a(response.OutputData, dirs=dirs, path=path)
-        return files, response.ErrorData
+    @classmethod
+    def __files_sync(cls, path: str, batch_callback: callable = None) -> (List[File], str):
+        try:
+            entries = smart_socket.file_list(ADBManager.get_device().id, path)
+            return collect(iterate_file_list_sync(entries, path=path), batch_callback), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return [], str(error)
 
     @classmethod
     def rename(cls, file: File, name) -> (str, str):
         if name.__contains__('/') or name.__contains__('\\'):
             return None, "Invalid name"
-        args = [adb.ShellCommand.MV, file.path.replace(' ', r'\ '), (file.location + name).replace(' ', r'\ ')]
+        args = [adb.ShellCommand.MV, shlex.quote(file.path), shlex.quote(file.location + name)]
         response = adb.shell(ADBManager.get_device().id, args)
         return None, response.ErrorData or response.OutputData
 
     @classmethod
     def open_file(cls, file: File) -> (str, str):
-        args = [adb.ShellCommand.CAT, file.path.replace(' ', r'\ ')]
+        args = [adb.ShellCommand.CAT, shlex.quote(file.path)]
         if file.isdir:
             return None, "Can't open. %s is a directory" % file.path
-        response = adb.shell(ADBManager.get_device().id, args)
+        response = adb.shell_stream(ADBManager.get_device().id, args, lines=False)
+        data = response.read(adb.OPEN_FILE_LIMIT + 1)
+        if len(data) > adb.OPEN_FILE_LIMIT:
+            return data[:adb.OPEN_FILE_LIMIT] + adb.OPEN_FILE_TRUNCATED, None
         if not response.IsSuccessful:
-            return None, response.ErrorData or response.OutputData
-        return response.OutputData, response.ErrorData
+            return None, response.ErrorData or data
+        return data, response.ErrorData
 
     @classmethod
     def delete(cls, file: File) -> (str, str):
-        args = [adb.ShellCommand.RM, file.path.replace(' ', r'\ ')]
+        args = [adb.ShellCommand.RM, shlex.quote(file.path)]
         if file.isdir:
-            args = adb.ShellCommand.RM_DIR_FORCE + [file.path.replace(' ', r'\ ')]
+            args = adb.ShellCommand.RM_DIR_FORCE + [shlex.quote(file.path)]
         response = adb.shell(ADBManager.get_device().id, args)
         if not response.IsSuccessful or response.OutputData:
             return None, response.ErrorData or response.OutputData
@@ -93,17 +141,31 @@ class FileRepository:
             self.callback = callback
 
         def call(self, data: str):
+            # Output of many sources is one stream, every progress line contains the path of its file
             if data.startswith('['):
                 progress = data[1:4].strip()
                 if progress.isdigit():
-                    self.callback(data[7:], int(progress))
+                    self.callback(data[7:].rstrip('\r\n'), int(progress))
             elif data:
                 self.messages.append(data)
 
     @classmethod
-    def download(cls, progress_callback: callable, source: str, destination: str) -> (str, str):
+    def download(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
         if not destination:
             destination = Settings.device_downloads_path(ADBManager.get_device())
+        if mode == TransferMode.RESUMABLE and ADBManager.get_device() and isinstance(source, str) and destination:
+            return cls.__download_resumable(progress_callback, source, destination)
+        compressor = None
+        if mode == TransferMode.COMPRESSED and ADBManager.get_device():
+            # Without a compressor on the device the files are pulled as they are
+            compressor = compression.select(cls.compressors())
+            mode = TransferMode.TAR if compressor else TransferMode.SYNC
+        if mode == TransferMode.TAR and ADBManager.get_device() and source and destination:
+            sources = [source] if isinstance(source, str) else source
+            return cls.__download_tar(progress_callback, sources, destination, compressor)
         if ADBManager.get_device() and source and destination:
             helper = cls.UpDownHelper(progress_callback)
             response = adb.pull(ADBManager.get_device().id, source, destination, helper.call)
@@ -118,23 +180,264 @@ class FileRepository:
         if not ADBManager.get_device():
             return None, "No device selected!"
 
-        args = [adb.ShellCommand.MKDIR, (ADBManager.path() + name).replace(' ', r"\ ")]
+        args = [adb.ShellCommand.MKDIR, shlex.quote(ADBManager.path() + name)]
         response = adb.shell(ADBManager.get_device().id, args)
         if not response.IsSuccessful:
             return None, response.ErrorData or response.OutputData
         return response.OutputData, response.ErrorData
 
     @classmethod
-    def upload(cls, progress_callback: callable, source: str) -> (str, str):
-        if ADBManager.get_device() and ADBManager.path() and source:
+    def upload(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str = None,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
+        destination = destination or ADBManager.path()
+        if mode == TransferMode.TAR and ADBManager.get_device() and destination and source:
+            return cls.__upload_tar(progress_callback, [source] if isinstance(source, str) else source, destination)
+        if ADBManager.get_device() and destination and source:
             helper = cls.UpDownHelper(progress_callback)
-            response = adb.push(ADBManager.get_device().id, source, ADBManager.path(), helper.call)
+            response = adb.push(ADBManager.get_device().id, source, destination, helper.call)
             if not response.IsSuccessful:
                 return None, response.ErrorData or "\n".join(helper.messages)
 
             return "\n".join(helper.messages), response.ErrorData
         return None, None
 
+    @classmethod
+    def __download_tar(
+            cls, progress_callback: callable, sources: List[str], destination: str, compressor: str = None
+    ) -> (str, str):
+        # Device side `tar -c` (and the compressor) is streamed by `exec-out` straight into the local extractor
+        messages = []
+        for source in sources:
+            usage, _ = cls.disk_usage(source)
+            path = posixpath.normpath(source)
+            args = [adb.ShellCommand.TAR_CREATE % (
+                shlex.quote(posixpath.dirname(path)), shlex.quote(posixpath.basename(path))
+            )]
+            if compressor:
+                args += ['|', compression.COMMANDS[compressor]]
+            started = time.time()
+            response = adb.exec_out(ADBManager.get_device().id, args)
+            received = [0]
+            chunks = response.chunks()
+            if compressor:
+                chunks = compression.decompress(compressor, chunks, lambda size: received.__setitem__(0, size))
+            reader = archive.progress(progress_callback, source, usage[0] if usage else 0)
+            transferred = [0]
+
+            def callback(size: int):
+                transferred[0] = size
+                reader(size)
+
+            try:
+                files = archive.extract(chunks, destination, callback, posixpath.basename(path))
+            except (tarfile.TarError, OSError) as error:
+                logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+                return "\n".join(messages) or None, response.ErrorData or str(error)
+            finally:
+                chunks.close()
+            if not response.IsSuccessful:
+                return "\n".join(messages) or None, response.ErrorData or "Could not download %s" % source
+            progress_callback(source, 100)
+            method = 'tar'
+            if compressor:
+                method = 'tar+%s, %d bytes received' % (compressor, received[0])
+            messages.append(archive.summary(source, files, transferred[0], started, 'pulled', method))
+        return "\n".join(messages), None
+
+    @classmethod
+    def __download_resumable(cls, progress_callback: callable, source: str, destination: str) -> (str, str):
+        file, error = cls.file(source)
+        if not file:
+            return None, error
+        device = ADBManager.get_device().id
+        download = ResumableDownload(
+            device, source, os.path.join(destination, file.name), file.raw_size, str(file.raw_date), progress_callback
+        )
+        block = ResumableDownload.BLOCK_SIZE
+
+        def read(skip: int, count: int):
+            args = [adb.ShellCommand.DD_RANGE % (shlex.quote(source), block, skip, count)]
+            chunks = adb.exec_out(device, args).chunks()
+            try:
+                yield from chunks
+            finally:
+                chunks.close()
+
+        def checksum():
+            response = adb.shell(device, [adb.ShellCommand.SHA256SUM % shlex.quote(source)])
+            if response.IsSuccessful and response.OutputData and response.OutputData.split():
+                return response.OutputData.split()[0]
+            return None
+
+        try:
+            return download.run(read, checksum, Settings.transfer_streams())
+        except OSError as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, str(error)
+
+    @classmethod
+    def compressors(cls) -> List[str]:
+        """
+        Compressors available on the device (`zstd`, `gzip`), the result is kept for every device
+        """
+        device = ADBManager.get_device().id
+        if device not in _compressors:
+            response = adb.shell(device, [adb.ShellCommand.COMPRESSORS])
+            if not response.IsSuccessful and not response.OutputData:
+                return []
+            _compressors[device] = (response.OutputData or '').split()
+        return _compressors[device]
+
+    @classmethod
+    def __upload_tar(cls, progress_callback: callable, sources: List[str], destination: str) -> (str, str):
+        # Locally built tar stream is the input of `tar -x` on the device
+        messages = []
+        for source in sources:
+            started = time.time()
+            files = []
+            writer = archive.progress(progress_callback, source, archive.size(source))
+            response = adb.exec_in(
+                ADBManager.get_device().id,
+                [adb.ShellCommand.TAR_EXTRACT % shlex.quote(destination)],
+                lambda write: files.append(archive.create(source, write, writer))
+            )
+            if not response.IsSuccessful or not files:
+                return "\n".join(messages) or None, response.ErrorData or response.OutputData or \
+                    "Could not upload %s" % source
+            progress_callback(source, 100)
+            messages.append(archive.summary(source, files[0], archive.size(source), started, 'pushed'))
+        return "\n".join(messages), None
+
+    @classmethod
+    def disk_usage(cls, path: str) -> ((int, int), str):
+        """
+        Size in bytes and number of files of the directory
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        response = adb.shell(ADBManager.get_device().id, [adb.ShellCommand.DISK_USAGE % shlex.quote(path)])
+        return convert_to_disk_usage(response.OutputData), response.ErrorData
+
+    @classmethod
+    def modified(cls, path: str) -> ((int, int), str):
+        """
+        Modification time of the path and the time of the device, in seconds (`ls` shows only minutes)
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        response = adb.shell(ADBManager.get_device().id, [adb.ShellCommand.MODIFIED % shlex.quote(path)])
+        return convert_to_modified(response.OutputData), response.ErrorData
+
+    @classmethod
+    def manifest(cls, path: str) -> (dict, str):
+        """
+        Size and modification time of every file of the directory: {relative path: (size, mtime)}.
+        A listing with errors (e.g. unreadable subdirectories) returns the listed files and the error
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        # Output of large directories is streamed, it's parsed line by line
+        response = adb.shell_stream(ADBManager.get_device().id, [adb.ShellCommand.MANIFEST % shlex.quote(path)])
+        manifest = convert_to_manifest(response)
+        if not response.IsSuccessful:
+            return manifest or None, response.ErrorData or "Could not list %s" % path
+        return manifest, None
+
+    @classmethod
+    def tree(
+            cls, paths: List[str], batch_callback: callable, children: bool = False, directories: bool = False
+    ) -> (int, str):
+        """
+        Entries (path, size, mtime, permissions) of the trees of the directories, delivered in batches.
+        With 'children' - only the entries in the directories, with 'directories' - only the directories.
+        Returns the number of the entries
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        count = 0
+        for command in adb.tree_commands(paths, children, directories):
+            # Trees of a whole device are streamed, the entries are not kept
+            response = adb.shell_stream(ADBManager.get_device().id, [command])
+            count += deliver(iterate_tree(response), batch_callback)
+            if not count and response.ErrorData:
+                return None, response.ErrorData
+        return count, None
+
+    @classmethod
+    def search(
+            cls, path: str, pattern: str, content: bool = False, batch_callback: callable = None
+    ) -> (List[File], str):
+        """
+        Files of the tree of 'path' whose names match the pattern (or which contain the text with 'content'),
+        found by the device itself. Files are delivered in batches while they are found, at most SEARCH_LIMIT
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        response = adb.shell_stream(ADBManager.get_device().id, [adb.search_command(path, pattern, content)])
+        files = collect(islice(iterate_found_files(response), adb.SEARCH_LIMIT), batch_callback)
+        if not files and response.ErrorData:
+            return None, response.ErrorData
+        return files, None
+
+    @classmethod
+    def checksums(cls, paths: List[str], algorithm: str = 'sha256') -> (dict, str):
+        """
+        Checksums ('sha256' or 'md5') of the device files: {path: hex digest}, files which can't be read are missing
+        """
+        if not ADBManager.get_device():
+            return None, "No device selected!"
+
+        checksums, errors = {}, []
+        batch, length = [], 0
+        for path in paths + [None]:
+            if batch and (path is None or length + len(path) + 3 > adb.ARGUMENTS_LIMIT):
+                command = adb.ShellCommand.CHECKSUMS[algorithm] % ' '.join(batch)
+                response = adb.shell(ADBManager.get_device().id, [command])
+                checksums.update(convert_to_checksums(response.OutputData))
+                if response.ErrorData:
+                    errors.append(response.ErrorData)
+                batch, length = [], 0
+            if path is not None:
+                batch.append(shlex.quote(path))
+                length += len(batch[-1]) + 1
+        return checksums, "\n".join(errors) or None
+
+
+class AsyncDeviceRepository:
+    @classmethod
+    async def devices(cls) -> (List[Device], str):
+        response = await adb_async.devices()
+        if not response.IsSuccessful:
+            return [], response.ErrorData or response.OutputData
+
+        devices = convert_to_devices(response.OutputData)
+        return devices, response.ErrorData
+
+    @classmethod
+    async def connect(cls, device_id) -> (str, str):
+        if not device_id:
+            return None, None
+
+        response = await adb_async.connect(device_id)
+        if not response.IsSuccessful:
+            return None, response.ErrorData or response.OutputData
+        return response.OutputData, response.ErrorData
+
+    @classmethod
+    async def disconnect(cls) -> (str, str):
+        response = await adb_async.disconnect()
+        if not response.IsSuccessful:
+            return None, response.ErrorData or response.OutputData
+
+        return response.OutputData, response.ErrorData
+
 
 class DeviceRepository:
     @classmethod
@@ -3,16 +3,72 @@
 import datetime
 import logging
 import os
+import posixpath
 import shlex
-from typing import List
+import stat
+import tempfile
+import time
+import uuid
+from itertools import islice
+from typing import List, Union
 
 from usb1 import USBContext
 
 from app.core.configurations import Settings
+from app.core.journal import ResumableDownload
 from app.core.managers import PythonADBManager
-from app.data.models import Device, File, FileType
-from app.helpers.converters import __converter_to_permissions_default__
-from app.services.adb import ShellCommand
+from app.data.models import Device, File, FileType, TransferMode
+from app.helpers import archive, compression
+from app.helpers.converters import __convert_mode_to_permissions__, convert_to_disk_usage, convert_to_manifest, \
+    convert_to_modified, convert_to_checksums, iterate_tree, iterate_found_files
+from app.helpers.tools import CancellationToken, CommonResponse, collect, decode_stream, deliver
+from app.services.adb import ShellCommand, ARGUMENTS_LIMIT, OPEN_FILE_LIMIT, OPEN_FILE_TRUNCATED, TAR_TEMP_DIRECTORY, \
+    SEARCH_LIMIT, SHELL_TIMEOUT, search_command, status_command, strip_status, tree_commands
+
+_compressors = {}  # Device id: compressors available on the device
+
+SILENT_READ_TIMEOUT = 3600  # Seconds, without a deadline, of the commands silent until they're done (checksums)
+
+
+def _timeouts() -> dict:
+    """
+    Timeouts of an `adb-shell` call: the rest of the deadline of the current operation (the shell deadline
+    outside of workers). A cancelled or expired operation fails before the call
+    """
+    token = CancellationToken.current()
+    if token:
+        token.check()
+    remaining = token.remaining() if token else SHELL_TIMEOUT or None
+    if remaining is None:
+        return {}  # No deadline, defaults of `adb-shell`
+    remaining = max(remaining, 0.1)
+    transport = min(remaining, PythonADBManager.transport_timeout or remaining)
+    return {'read_timeout_s': remaining, 'transport_timeout_s': transport}
+
+
+def _shell(command: str, decode: bool = True, silent: bool = False):
+    # `sha256sum` of a large file prints nothing for longer than the default read timeout (10 s) of `adb-shell`
+    timeouts = _timeouts()
+    if silent and not timeouts:
+        timeouts = {'read_timeout_s': SILENT_READ_TIMEOUT}
+    return PythonADBManager.device.shell(command, timeout_s=timeouts.get('read_timeout_s'), decode=decode, **timeouts)
+
+
+def _streaming_shell(command: str, decode: bool = True):
+    # Reads of the device are limited by the deadline, the token is checked between the chunks
+    token = CancellationToken.current()
+    for chunk in PythonADBManager.device.streaming_shell(command, decode=decode, **_timeouts()):
+        if token:
+            token.check()
+        yield chunk
+
+
+def _list(path: str):
+    return PythonADBManager.device.list(path, **_timeouts())
+
+
+def _stat(path: str):
+    return PythonADBManager.device.stat(path, **_timeouts())
 
 
 class FileRepository:
@@ -24,17 +80,17 @@ class FileRepository:
             return None, "Device not available!"
         try:
             path = PythonADBManager.clear_path(path)
-            mode, size, mtime = PythonADBManager.device.stat(path)
+            mode, size, mtime = _stat(path)
             file = File(
                 name=os.path.basename(os.path.normpath(path)),
                 size=size,
-                date_time=datetime.datetime.utcfromtimestamp(mtime),
-                permissions=__converter_to_permissions_default__(list(oct(mode)[2:]))
+                date_time=datetime.datetime.fromtimestamp(mtime),
+                permissions=__convert_mode_to_permissions__(mode)
             )
 
             if file.type == FileType.LINK:
-                args = ShellCommand.LS_LIST_DIRS + [path.replace(' ', r'\ ') + '/']
-                response = PythonADBManager.device.shell(shlex.join(args))
+                args = ShellCommand.LS_LIST_DIRS + [path + '/']
+                response = _shell(shlex.join(args))
                 file.link_type = FileType.UNKNOWN
                 if response and response.startswith('d'):
                     file.link_type = FileType.DIRECTORY
@@ -48,7 +104,11 @@ class FileRepository:
             return None, error
 
     @classmethod
-    def files(cls) -> (List[File], str):
+    def files(cls, path: str = None, batch_callback: callable = None) -> (List[File], str):
+        """
+        Files of the directory (the current one by default).
+        With 'batch_callback' they are also delivered in batches while they are converted
+        """
         if not PythonADBManager.device:
             return None, "No device selected!"
         if not PythonADBManager.device.available:
@@ -56,40 +116,40 @@ class FileRepository:
 
         files = []
         try:
-            path = PythonADBManager.path()
-            response = PythonADBManager.device.list(path)
-
-            args = ShellCommand.LS_ALL_DIRS + [path.replace(' ', r'\ ') + "*/"]
-            dirs = PythonADBManager.device.shell(" ".join(args)).split()
-
-            for file in response:
-                if file.filename.decode() == '.' or file.filename.decode() == '..':
-                    continue
-
-                permissions = __converter_to_permissions_default__(list(oct(file.mode)[2:]))
-                link_type = None
-                if permissions[0] == 'l':
-                    link_type = FileType.FILE
-                    if dirs.__contains__(path + file.filename.decode() + "/"):
-                        link_type = FileType.DIRECTORY
-
-                files.append(
-                    File(
-                        name=file.filename.decode(),
-                        size=file.size,
-                        path=(path + file.filename.decode()),
-                        link_type=link_type,
-                        date_time=datetime.datetime.utcfromtimestamp(file.mtime),
-                        permissions=permissions,
-                    )
-                )
+            path = path or PythonADBManager.path()
+            response = [file for file in _list(path) if file.filename not in (b'.', b'..')]
+
+            # One more call only if the directory has links, names of directory links are kept in a set
+            dirs = set()
+            if any(stat.S_ISLNK(file.mode) for file in response):
+                args = ShellCommand.LS_LINK_DIRS % shlex.quote(path)
+                dirs = set(_shell(args).split('\n'))
 
+            files = collect((cls.__convert_entry(file, path, dirs) for file in response), batch_callback)
             return files, None
 
         except BaseException as error:
             logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
             return files, error
 
+    @staticmethod
+    def __convert_entry(file, path: str, dirs: set) -> File:
+        permissions = __convert_mode_to_permissions__(file.mode)
+        link_type = None
+        if permissions[0] == 'l':
+            link_type = FileType.FILE
+            if file.filename.decode() in dirs:
+                link_type = FileType.DIRECTORY
+
+        return File(
+            name=file.filename.decode(),
+            size=file.size,
+            path=(path + file.filename.decode()),
+            link_type=link_type,
+            date_time=datetime.datetime.fromtimestamp(file.mtime),
+            permissions=permissions,
+        )
+
     @classmethod
     def rename(cls, file: File, name: str) -> (str, str):
         if not PythonADBManager.device:
@@ -101,7 +161,7 @@ class FileRepository:
 
         try:
             args = [ShellCommand.MV, file.path, file.location + name]
-            response = PythonADBManager.device.shell(shlex.join(args))
+            response = _shell(shlex.join(args))
             if response:
                 return None, response
             return None, None
@@ -116,11 +176,17 @@ class FileRepository:
         if not PythonADBManager.device.available:
             return None, "Device not available!"
         try:
-            args = [ShellCommand.CAT, file.path.replace(' ', r'\ ')]
+            args = [ShellCommand.CAT, file.path]
             if file.isdir:
                 return None, "Can't open. %s is a directory" % file.path
-            response = PythonADBManager.device.shell(shlex.join(args))
-            return response, None
+            data = []
+            size = 0
+            for chunk in _streaming_shell(shlex.join(args)):
+                data.append(chunk)
+                size += len(chunk)
+                if size > OPEN_FILE_LIMIT:
+                    return "".join(data)[:OPEN_FILE_LIMIT] + OPEN_FILE_TRUNCATED, None
+            return "".join(data), None
         except BaseException as error:
             logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
             return None, error
@@ -135,7 +201,7 @@ class FileRepository:
             args = [ShellCommand.RM, file.path]
             if file.isdir:
                 args = ShellCommand.RM_DIR_FORCE + [file.path]
-            response = PythonADBManager.device.shell(shlex.join(args))
+            response = _shell(shlex.join(args))
             if response:
                 return None, response
             return "%s '%s' has been deleted" % ('Folder' if file.isdir else 'File', file.path), None
@@ -150,6 +216,9 @@ class FileRepository:
             self.total = 0
 
         def call(self, path: str, written: int, total: int):
+            # Stops the transfer when the operation is cancelled (or timed out)
+            if CancellationToken.current():
+                CancellationToken.current().check()
             if self.total != total:
                 self.total = total
                 self.written = 0
@@ -158,25 +227,264 @@ class FileRepository:
             self.callback(path, int(self.written / self.total * 100))
 
     @classmethod
-    def download(cls, progress_callback: callable, source: str, destination: str = None) -> (str, str):
+    def download(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str = None,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
         if not destination:
             destination = Settings.device_downloads_path(PythonADBManager.get_device())
 
+        # Many sources are pulled by one connection of the device
         helper = cls.UpDownHelper(progress_callback)
-        destination = os.path.join(destination, os.path.basename(os.path.normpath(source)))
-        if PythonADBManager.device and PythonADBManager.device.available and source:
+        sources = [source] if isinstance(source, str) else source
+        if mode == TransferMode.RESUMABLE and PythonADBManager.device and PythonADBManager.device.available and \
+                isinstance(source, str):
+            return cls.__download_resumable(progress_callback, source, destination)
+        compressor = None
+        if mode == TransferMode.COMPRESSED and PythonADBManager.device and PythonADBManager.device.available:
+            # Without a compressor on the device the files are pulled as they are
+            compressor = compression.select(cls.compressors())
+            mode = TransferMode.TAR if compressor else TransferMode.SYNC
+        if mode == TransferMode.TAR and PythonADBManager.device and PythonADBManager.device.available and sources:
+            return cls.__download_tar(progress_callback, sources, destination, compressor)
+        if PythonADBManager.device and PythonADBManager.device.available and sources:
+            messages = []
             try:
-                PythonADBManager.device.pull(
-                    device_path=source,
-                    local_path=destination,
-                    progress_callback=helper.call
-                )
-                return "Download successful!\nDest: %s" % destination, None
+                for source in sources:
+                    local_path = os.path.join(destination, os.path.basename(os.path.normpath(source)))
+                    PythonADBManager.device.pull(
+                        device_path=source,
+                        local_path=local_path,
+                        progress_callback=helper.call
+                    )
+                    messages.append("Download successful!\nDest: %s" % local_path)
+                return "\n".join(messages), None
             except BaseException as error:
                 logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
-                return None, error
+                return "\n".join(messages) or None, error
         return None, None
 
+    @classmethod
+    def __download_tar(
+            cls, progress_callback: callable, sources: List[str], destination: str, compressor: str = None
+    ) -> (str, str):
+        messages = []
+        try:
+            for source in sources:
+                usage, _ = cls.disk_usage(source)
+                path = posixpath.normpath(source)
+                command = ShellCommand.TAR_CREATE % (
+                    shlex.quote(posixpath.dirname(path)), shlex.quote(posixpath.basename(path))
+                )
+                if compressor:
+                    command += ' | ' + compression.COMMANDS[compressor]
+                started = time.time()
+                reader = archive.progress(progress_callback, source, usage[0] if usage else 0)
+                transferred = [0]
+
+                def callback(size: int):
+                    if CancellationToken.current():
+                        CancellationToken.current().check()
+                    transferred[0] = size
+                    reader(size)
+
+                # `adb-shell` has no public streaming `exec` service, `exec_out` collects the whole output
+                command, marker = status_command(command)
+                status = CommonResponse()
+                chunks = strip_status(
+                    PythonADBManager.device._streaming_service(b'exec', command.encode(), decode=False), marker, status
+                )
+                received = [0]
+                if compressor:
+                    chunks = compression.decompress(compressor, chunks, lambda size: received.__setitem__(0, size))
+                files = archive.extract(chunks, destination, callback, posixpath.basename(path))
+                if not status.IsSuccessful:
+                    return "\n".join(messages) or None, status.ErrorData or "Could not download %s" % source
+                progress_callback(source, 100)
+                method = 'tar'
+                if compressor:
+                    method = 'tar+%s, %d bytes received' % (compressor, received[0])
+                messages.append(archive.summary(source, files, transferred[0], started, 'pulled', method))
+            return "\n".join(messages), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return "\n".join(messages) or None, error
+
+    @classmethod
+    def __download_resumable(cls, progress_callback: callable, source: str, destination: str) -> (str, str):
+        file, error = cls.file(source)
+        if not file:
+            return None, error
+        download = ResumableDownload(
+            PythonADBManager.get_device().id, source, os.path.join(destination, file.name), file.raw_size,
+            str(file.raw_date), progress_callback
+        )
+        block = ResumableDownload.BLOCK_SIZE
+
+        def read(skip: int, count: int):
+            command = ShellCommand.DD_RANGE % (shlex.quote(source), block, skip, count)
+            return PythonADBManager.device._streaming_service(b'exec', command.encode(), decode=False)
+
+        def checksum():
+            response = _shell(ShellCommand.SHA256SUM % shlex.quote(source), silent=True)
+            return response.split()[0] if response and response.split() else None
+
+        # Streams of `adb-shell` share one connection of the device: chunks are read one by one,
+        # the checksum of the device file is calculated beside them on a stream of its own
+        try:
+            return download.run(read, checksum)
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def compressors(cls) -> List[str]:
+        """
+        Compressors available on the device (`zstd`, `gzip`), the result is kept for every device
+        """
+        device = PythonADBManager.get_device().id
+        if device not in _compressors:
+            _compressors[device] = _shell(ShellCommand.COMPRESSORS).split()
+        return _compressors[device]
+
+    @classmethod
+    def __upload_tar(cls, progress_callback: callable, sources: List[str], destination: str) -> (str, str):
+        # `adb-shell` can't write to stdin of a device process, so the archive is pushed as a file and extracted there
+        helper = cls.UpDownHelper(progress_callback)
+        messages = []
+        try:
+            for source in sources:
+                started = time.time()
+                # Concurrent uploads ('device_concurrency') have their own archives
+                remote = posixpath.join(TAR_TEMP_DIRECTORY, 'adb-explorer-%s.tar' % uuid.uuid4().hex)
+                handle, temp = tempfile.mkstemp(suffix='.tar')
+                try:
+                    with os.fdopen(handle, 'wb') as stream:
+                        files = archive.create(source, stream.write)
+                    PythonADBManager.device.push(
+                        local_path=temp,
+                        device_path=remote,
+                        progress_callback=lambda _, written, total: helper.call(source, written, total)
+                    )
+                    # `tar -x` prints nothing on success, its errors (and the exit code) are the failure
+                    response = _shell(
+                        '%s < %s 2>&1 || echo "Exit code $?"' % (
+                            ShellCommand.TAR_EXTRACT % shlex.quote(destination), shlex.quote(remote)
+                        )
+                    )
+                finally:
+                    os.remove(temp)
+                    _shell('rm -f %s' % shlex.quote(remote))
+                if response:
+                    return "\n".join(messages) or None, response
+                progress_callback(source, 100)
+                messages.append(archive.summary(source, files, archive.size(source), started, 'pushed'))
+            return "\n".join(messages), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return "\n".join(messages) or None, error
+
+    @classmethod
+    def disk_usage(cls, path: str) -> ((int, int), str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        try:
+            response = _shell(ShellCommand.DISK_USAGE % shlex.quote(path))
+            return convert_to_disk_usage(response), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def modified(cls, path: str) -> ((int, int), str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        try:
+            response = _shell(ShellCommand.MODIFIED % shlex.quote(path))
+            return convert_to_modified(response), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def manifest(cls, path: str) -> (dict, str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        try:
+            # `adb-shell` streams have no exit code, the command prints it (and its errors) after the output
+            command, marker = status_command(ShellCommand.MANIFEST % shlex.quote(path))
+            status = CommonResponse()
+            chunks = strip_status(_streaming_shell(command, decode=False), marker, status)
+            manifest = convert_to_manifest(decode_stream(chunks))
+            if not status.IsSuccessful:
+                return manifest or None, status.ErrorData or "Could not list %s" % path
+            return manifest, None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def tree(
+            cls, paths: List[str], batch_callback: callable, children: bool = False, directories: bool = False
+    ) -> (int, str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        try:
+            count = 0
+            for command in tree_commands(paths, children, directories):
+                chunks = _streaming_shell(command, decode=False)
+                count += deliver(iterate_tree(decode_stream(chunks)), batch_callback)
+            return count, None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def search(
+            cls, path: str, pattern: str, content: bool = False, batch_callback: callable = None
+    ) -> (List[File], str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        try:
+            chunks = _streaming_shell(search_command(path, pattern, content), decode=False)
+            found = iterate_found_files(decode_stream(chunks))
+            return collect(islice(found, SEARCH_LIMIT), batch_callback), None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return None, error
+
+    @classmethod
+    def checksums(cls, paths: List[str], algorithm: str = 'sha256') -> (dict, str):
+        if not PythonADBManager.device:
+            return None, "No device selected!"
+        if not PythonADBManager.device.available:
+            return None, "Device not available!"
+        checksums = {}
+        try:
+            batch, length = [], 0
+            for path in paths + [None]:
+                if batch and (path is None or length + len(path) + 3 > ARGUMENTS_LIMIT):
+                    response = _shell(ShellCommand.CHECKSUMS[algorithm] % ' '.join(batch), silent=True)
+                    checksums.update(convert_to_checksums(response))
+                    batch, length = [], 0
+                if path is not None:
+                    batch.append(shlex.quote(path))
+                    length += len(batch[-1]) + 1
+            return checksums, None
+        except BaseException as error:
+            logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            return checksums, error
+
     @classmethod
     def new_folder(cls, name) -> (str, str):
         if not PythonADBManager.device:
@@ -186,7 +494,7 @@ class FileRepository:
 
         try:
             args = [ShellCommand.MKDIR, (PythonADBManager.path() + name)]
-            response = PythonADBManager.device.shell(shlex.join(args))
+            response = _shell(shlex.join(args))
             return None, response
 
         except BaseException as error:
@@ -194,20 +502,30 @@ class FileRepository:
             return None, error
 
     @classmethod
-    def upload(cls, progress_callback: callable, source: str) -> (str, str):
+    def upload(
+            cls, progress_callback: callable, source: Union[str, List[str]], destination: str = None,
+            mode: str = TransferMode.SYNC
+    ) -> (str, str):
         helper = cls.UpDownHelper(progress_callback)
-        destination = PythonADBManager.path() + os.path.basename(os.path.normpath(source))
-        if PythonADBManager.device and PythonADBManager.device.available and PythonADBManager.path() and source:
+        location = destination or PythonADBManager.path()
+        sources = [source] if isinstance(source, str) else source
+        if mode == TransferMode.TAR and PythonADBManager.device and PythonADBManager.device.available and sources:
+            return cls.__upload_tar(progress_callback, sources, location)
+        if PythonADBManager.device and PythonADBManager.device.available and location and sources:
+            messages = []
             try:
-                PythonADBManager.device.push(
-                    local_path=source,
-                    device_path=destination,
-                    progress_callback=helper.call
-                )
-                return "Upload successful!\nDest: %s" % destination, None
+                for source in sources:
+                    device_path = location + os.path.basename(os.path.normpath(source))
+                    PythonADBManager.device.push(
+                        local_path=source,
+                        device_path=device_path,
+                        progress_callback=helper.call
+                    )
+                    messages.append("Upload successful!\nDest: %s" % device_path)
+                return "\n".join(messages), None
             except BaseException as error:
                 logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
-                return None, error
+                return "\n".join(messages) or None, error
         return None, None
 
 
@@ -226,7 +544,7 @@ class DeviceRepository:
                         device_id = device.getSerialNumber()
                         PythonADBManager.connect(device_id)
                         device_name = " ".join(
-                            PythonADBManager.device.shell(" ".join(ShellCommand.GETPROP_PRODUCT_MODEL)).split()
+                            _shell(" ".join(ShellCommand.GETPROP_PRODUCT_MODEL)).split()
                         )
                         device_type = "device" if PythonADBManager.device.available else "unknown"
                         devices.append(Device(id=device_id, name=device_name, type=device_type))
@@ -245,7 +563,7 @@ class DeviceRepository:
             serial = PythonADBManager.connect(device_id)
             if PythonADBManager.device.available:
                 device_name = " ".join(
-                    PythonADBManager.device.shell(" ".join(ShellCommand.GETPROP_PRODUCT_MODEL)).split()
+                    _shell(" ".join(ShellCommand.GETPROP_PRODUCT_MODEL)).split()
                 )
                 PythonADBManager.set_device(Device(id=serial, name=device_name, type="device"))
                 return "Connection established", None
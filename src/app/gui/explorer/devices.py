@@ -8,12 +8,12 @@ from PyQt5.QtGui import QPalette, QPixmap, QMovie
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QStyledItemDelegate, QStyleOptionViewItem, QApplication, \
     QStyle, QListView
 
-from app.core.configurations import Resources
+from app.core.configurations import Resources, Settings
 from app.core.main import Adb
 from app.core.managers import Global
 from app.data.models import DeviceType, MessageData
-from app.data.repositories import DeviceRepository
-from app.helpers.tools import AsyncRepositoryWorker, read_string_from_file
+from app.data.repositories import AsyncDeviceRepository
+from app.helpers.tools import AsyncioBridge, read_string_from_file
 
 
 class DeviceItemDelegate(QStyledItemDelegate):
@@ -83,10 +83,10 @@ class DeviceListModel(QAbstractListModel):
 
 
 class DeviceExplorerWidget(QWidget):
-    DEVICES_WORKER_ID = 200
-
     def __init__(self, parent=None):
         super(DeviceExplorerWidget, self).__init__(parent)
+        self.closed = False
+        self.future = None  # Devices are listed by a coroutine on the AsyncioBridge loop
         self.main_layout = QVBoxLayout(self)
 
         self.header = QLabel('Connected devices', self)
@@ -122,23 +122,29 @@ class DeviceExplorerWidget(QWidget):
 
     def update(self):
         super(DeviceExplorerWidget, self).update()
-        worker = AsyncRepositoryWorker(
-            name="Devices",
-            worker_id=self.DEVICES_WORKER_ID,
-            repository_method=DeviceRepository.devices,
-            arguments=(),
-            response_callback=self._async_response
+        if self.future and not self.future.done():
+            return
+
+        # First Setup loading view
+        self.model.clear()
+        self.list.setHidden(True)
+        self.loading.setHidden(False)
+        self.empty_label.setHidden(True)
+        self.loading_movie.start()
+
+        # Then start the coroutine
+        self.future = AsyncioBridge.instance().submit(
+            AsyncDeviceRepository.devices(),
+            response_callback=self._async_response,
+            timeout=Settings.operation_timeout('devices')
         )
-        if Adb.worker().work(worker):
-            # First Setup loading view
-            self.model.clear()
-            self.list.setHidden(True)
-            self.loading.setHidden(False)
-            self.empty_label.setHidden(True)
-            self.loading_movie.start()
 
-            # Then start async worker
-            worker.start()
+    def close(self) -> bool:
+        # Listing is stopped (the `adb devices` process is killed), its response is ignored
+        self.closed = True
+        if self.future:
+            self.future.cancel()
+        return super(DeviceExplorerWidget, self).close()
 
     @property
     def device(self):
@@ -146,6 +152,8 @@ class DeviceExplorerWidget(QWidget):
             return self.model.items[self.list.currentIndex().row()]
 
     def _async_response(self, devices, error):
+        if self.closed:
+            return
         self.loading_movie.stop()
         self.loading.setHidden(True)
 
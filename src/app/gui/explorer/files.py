@@ -1,6 +1,10 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
+import pickle
 import sys
+import zlib
+from collections import OrderedDict
+from functools import partial
 from typing import Any
 
 from PyQt5 import QtCore, QtGui
@@ -8,15 +12,20 @@ from PyQt5.QtCore import Qt, QPoint, QModelIndex, QAbstractListModel, QVariant,
 from PyQt5.QtGui import QPixmap, QColor, QPalette, QMovie, QKeySequence
 from PyQt5.QtWidgets import QMenu, QAction, QMessageBox, QFileDialog, QStyle, QWidget, QStyledItemDelegate, \
     QStyleOptionViewItem, QApplication, QListView, QVBoxLayout, QLabel, QSizePolicy, QHBoxLayout, QTextEdit, \
-    QMainWindow
+    QMainWindow, QCheckBox
 
-from app.core.configurations import Resources
+from app.core.configurations import Resources, Settings
+from app.core.index import ListingIndex
+from app.core.listings import ListingCache
 from app.core.main import Adb
 from app.core.managers import Global
-from app.data.models import FileType, MessageData, MessageType
+from app.core.prefetch import ListingPrefetcher
+from app.core.sync import DirectorySync, SyncPlan
+from app.core.transfers import TransferQueue
+from app.data.models import File, FileType, MessageData, MessageType, TransferType
 from app.data.repositories import FileRepository
 from app.gui.explorer.toolbar import ParentButton, UploadTools, PathBar
-from app.helpers.tools import AsyncRepositoryWorker, ProgressCallbackHelper, read_string_from_file
+from app.helpers.tools import AsyncRepositoryWorker, BatchCallbackHelper, JobScheduler, read_string_from_file
 
 
 class FileHeaderWidget(QWidget):
@@ -148,35 +157,128 @@ class FileItemDelegate(QStyledItemDelegate):
 
 
 class FileListModel(QAbstractListModel):
+    """
+    FileListModel - files of the current directory, rows are shown by pages while the view is scrolled
+    (canFetchMore / fetchMore). At most MAX_PAGES pages are kept as File objects, the least recently used
+    ones (the last pages first, for the pages not shown yet) are packed: fields of the files, pickled and compressed
+    """
+
+    PAGE_SIZE = 500  # Rows
+    MAX_PAGES = 64  # Pages kept as File objects, about 9 MB
+
+    __icons = {}  # Path of the icon: scaled pixmap
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.items = []
+        self.pages = []  # Files of each page, or the packed page
+        self.loaded = OrderedDict()  # Pages kept as File objects, least recently used first
+        self.count = 0  # All the files
+        self.fetched = 0  # Rows shown by the view
+
+    @property
+    def size(self) -> int:
+        return self.count
 
     def clear(self):
         self.beginResetModel()
-        self.items.clear()
+        self.pages = []
+        self.loaded.clear()
+        self.count = 0
+        self.fetched = 0
         self.endResetModel()
 
-    def populate(self, files: list):
+    def populate(self, files: list, fetched: int = 0):
         self.beginResetModel()
-        self.items.clear()
-        self.items = files
+        self.pages = []
+        self.loaded.clear()
+        self.count = 0
+        self.__extend(files)
+        self.fetched = min(self.count, max(fetched, self.PAGE_SIZE))
         self.endResetModel()
 
+    def append(self, files: list):
+        self.__extend(files)
+        if self.fetched < self.PAGE_SIZE:
+            self.fetchMore(QModelIndex())
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return self.fetched < self.count
+
+    def fetchMore(self, parent: QModelIndex):
+        count = min(self.count - self.fetched, self.PAGE_SIZE)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + count - 1)
+        self.fetched += count
+        self.endInsertRows()
+
     def rowCount(self, parent: QModelIndex = ...) -> int:
-        return len(self.items)
+        return self.fetched
+
+    def file(self, row: int) -> File:
+        page = row // self.PAGE_SIZE
+        files = self.__load(page)
+        self.loaded.move_to_end(page)
+        self.__evict()
+        return files[row % self.PAGE_SIZE]
+
+    def __extend(self, files: list):
+        start = 0
+        if self.count % self.PAGE_SIZE:
+            start = self.PAGE_SIZE - self.count % self.PAGE_SIZE
+            self.__load(len(self.pages) - 1).extend(files[:start])
+        for index in range(start, len(files), self.PAGE_SIZE):
+            self.pages.append(files[index:index + self.PAGE_SIZE])
+            # Pages not shown yet are evicted before the ones in use
+            self.loaded[len(self.pages) - 1] = None
+            self.loaded.move_to_end(len(self.pages) - 1, last=False)
+        self.count += len(files)
+        self.__evict()
+
+    def __load(self, page: int) -> list:
+        if page not in self.loaded:
+            self.pages[page] = [self.__unpack(values) for values in pickle.loads(zlib.decompress(self.pages[page]))]
+            self.loaded[page] = None
+            self.loaded.move_to_end(page, last=False)
+        return self.pages[page]
+
+    def __evict(self):
+        while len(self.loaded) > self.MAX_PAGES:
+            page, _ = self.loaded.popitem(last=False)
+            values = [self.__pack(file) for file in self.pages[page]]
+            self.pages[page] = zlib.compress(pickle.dumps(values, pickle.HIGHEST_PROTOCOL), 1)
+
+    @staticmethod
+    def __pack(file: File) -> tuple:
+        return (
+            file.name, file.path, file.raw_size, file.raw_date, file.permissions, file.link, file.link_type,
+            file.owner, file.group, file.other, file.file_type
+        )
+
+    @staticmethod
+    def __unpack(values: tuple) -> File:
+        name, path, size, date, permissions, link, link_type, owner, group, other, file_type = values
+        return File(
+            name=name, path=path, size=size, date_time=date, permissions=permissions, link=link, link_type=link_type,
+            owner=owner, group=group, other=other, file_type=file_type
+        )
+
+    def icon(self, index: QModelIndex = ...) -> QPixmap:
+        path = self.icon_path(index)
+        if path not in self.__icons:
+            self.__icons[path] = QPixmap(path).scaled(32, 32, Qt.KeepAspectRatio)
+        return self.__icons[path]
 
     def icon_path(self, index: QModelIndex = ...):
-        file_type = self.items[index.row()].type
-        if file_type == FileType.DIRECTORY:
+        file = self.file(index.row())
+        if file.type == FileType.DIRECTORY:
             return Resources.icon_folder
-        elif file_type == FileType.FILE:
+        elif file.type == FileType.FILE:
             return Resources.icon_file
-        elif file_type == FileType.LINK:
-            link_type = self.items[index.row()].link_type
-            if link_type == FileType.DIRECTORY:
+        elif file.type == FileType.LINK:
+            if file.link_type == FileType.DIRECTORY:
                 return Resources.icon_link_folder
-            elif link_type == FileType.FILE:
+            elif file.link_type == FileType.FILE:
                 return Resources.icon_link_file
             return Resources.icon_link_file_unknown
         return Resources.icon_file_unknown
@@ -189,7 +291,7 @@ class FileListModel(QAbstractListModel):
 
     def setData(self, index: QModelIndex, value: Any, role: int = ...) -> bool:
         if role == Qt.EditRole and value:
-            data, error = FileRepository.rename(self.items[index.row()], value)
+            data, error = FileRepository.rename(self.file(index.row()), value)
             if error:
                 Global().communicate.notification.emit(
                     MessageData(
@@ -206,17 +308,19 @@ class FileListModel(QAbstractListModel):
             return QVariant()
 
         if role == Qt.DisplayRole:
-            return self.items[index.row()]
+            return self.file(index.row())
         elif role == Qt.EditRole:
-            return self.items[index.row()].name
+            return self.file(index.row()).name
         elif role == Qt.DecorationRole:
-            return QPixmap(self.icon_path(index)).scaled(32, 32, Qt.KeepAspectRatio)
+            return self.icon(index)
         return QVariant()
 
 
 class FileExplorerWidget(QWidget):
     FILES_WORKER_ID = 300
-    DOWNLOAD_WORKER_ID = 399
+    SYNC_WORKER_ID = 301
+    SYNC_DELETE_WORKER_ID = 302
+    PREFETCH_WORKER_ID = 303
 
     def __init__(self, parent=None):
         super(FileExplorerWidget, self).__init__(parent)
@@ -233,6 +337,9 @@ class FileExplorerWidget(QWidget):
 
         self.list.setSpacing(1)
         self.list.setModel(self.model)
+        # Rows have the same height, large listings are laid out in batches
+        self.list.setUniformItemSizes(True)
+        self.list.setLayoutMode(QListView.Batched)
         self.list.installEventFilter(self)
         self.list.doubleClicked.connect(self.open)
         self.list.setItemDelegate(FileItemDelegate(self.list))
@@ -265,39 +372,131 @@ class FileExplorerWidget(QWidget):
     @property
     def file(self):
         if self.list and self.list.currentIndex():
-            return self.model.items[self.list.currentIndex().row()]
+            return self.model.file(self.list.currentIndex().row())
 
     @property
     def files(self):
         if self.list and len(self.list.selectedIndexes()) > 0:
-            return map(lambda index: self.model.items[index.row()], self.list.selectedIndexes())
+            return map(lambda index: self.model.file(index.row()), self.list.selectedIndexes())
 
     def update(self):
         super(FileExplorerWidget, self).update()
+        device, path = Adb.manager().get_device(), Adb.manager().path()
+        device = device.id if device else None
+        generation = ListingCache.generation()
+        files, fresh = ListingCache.get(device, path)
+        indexed = False
+        if files is None and device:
+            # Last known listing (e.g. of the previous session) is valid while the directory is not modified
+            files, mtime = ListingIndex.get(device, path)
+            indexed = files is not None
+        Adb.worker().cancel(self.PREFETCH_WORKER_ID)
+        cached = files is not None and (fresh or indexed or Settings.listing_cache_stale())
+        if cached:
+            # Cached listing is shown at once, an expired one is listed again in the background
+            Adb.worker().cancel(self.FILES_WORKER_ID)
+            self.__show(files)
+            Global().communicate.path_toolbar__refresh.emit()
+            if fresh:
+                self.__prefetch(device, path, files)
+                return
+
+        # Files are shown in batches while the listing is read, the response completes it
+        helper = BatchCallbackHelper()
+        if indexed:
+            method, arguments = ListingPrefetcher.revalidate, (device, path, mtime)
+        elif cached:
+            method, arguments = FileRepository.files, (path,)
+        else:
+            method, arguments = FileRepository.files, (path, helper.batch_callback.emit)
         worker = AsyncRepositoryWorker(
             name="Files",
             worker_id=self.FILES_WORKER_ID,
-            repository_method=FileRepository.files,
-            response_callback=self._async_response,
-            arguments=()
+            repository_method=method,
+            response_callback=partial(self._async_response, device, path, generation, cached),
+            arguments=arguments,
+            timeout=Settings.operation_timeout('files'),
+            priority=JobScheduler.INTERACTIVE
         )
+        helper.setup(worker, partial(self._async_batch, worker))
+        Adb.worker().cancel(self.FILES_WORKER_ID)
         if Adb.worker().work(worker):
-            # First Setup loading view
-            self.model.clear()
-            self.list.setHidden(True)
-            self.loading.setHidden(False)
-            self.empty_label.setHidden(True)
-            self.loading_movie.start()
+            if not cached:
+                # First Setup loading view
+                self.model.clear()
+                self.list.setHidden(True)
+                self.loading.setHidden(False)
+                self.empty_label.setHidden(True)
+                self.loading_movie.start()
 
             # Then start async worker
             worker.start()
-            Global().communicate.path_toolbar__refresh.emit()
+            if not cached:
+                Global().communicate.path_toolbar__refresh.emit()
 
     def close(self) -> bool:
         Global().communicate.files__refresh.disconnect()
         return super(FileExplorerWidget, self).close()
 
-    def _async_response(self, files: list, error: str):
+    def _async_batch(self, worker: AsyncRepositoryWorker, files: list):
+        if worker.silent:
+            return  # Batch of a replaced listing
+        if self.list.isHidden():
+            # The first batch replaces the loading view, the rest of the listing is appended
+            self.loading_movie.stop()
+            self.loading.setHidden(True)
+            self.list.setHidden(False)
+            self.list.setFocus()
+        self.model.append(files)
+        # The view fetches more rows when it's scrolled, it's already at the end of the shown ones
+        scroll = self.list.verticalScrollBar()
+        if scroll.value() == scroll.maximum() and self.model.canFetchMore(QModelIndex()):
+            self.model.fetchMore(QModelIndex())
+        Global().communicate.status_bar.emit('Operation: Files... %d loaded.' % self.model.size, 1000)
+
+    def __prefetch(self, device: str, path: str, files: list):
+        # Likely next directories are listed while the user looks at this one
+        paths = ListingPrefetcher.targets(device, path, files)
+        if not paths:
+            return
+        worker = AsyncRepositoryWorker(
+            name="Prefetch",
+            worker_id=self.PREFETCH_WORKER_ID,
+            repository_method=ListingPrefetcher.prefetch,
+            response_callback=self._async_prefetch,
+            arguments=(device, paths),
+            timeout=Settings.operation_timeout('files'),
+            priority=JobScheduler.BACKGROUND
+        )
+        if Adb.worker().work(worker):
+            worker.start()
+
+    @staticmethod
+    def _async_prefetch(count: int, error: str):
+        if error:
+            print('Prefetch: %s' % error, file=sys.stderr)
+
+    def __show(self, files: list, fetched: int = 0):
+        self.loading_movie.stop()
+        self.loading.setHidden(True)
+        self.list.setHidden(not files)
+        self.empty_label.setHidden(bool(files))
+        self.model.populate(files, fetched)
+
+    def _async_response(self, device: str, path: str, generation: int, cached: bool, files: list, error: str):
+        if not error:
+            ListingCache.put(device, path, files, generation)
+            self.__prefetch(device, path, files)
+        if cached:
+            # Listing of the shown cached files, rows and the scroll position are kept
+            if error:
+                print(error, file=sys.stderr)
+                return
+            scroll = self.list.verticalScrollBar().value()
+            self.__show(files, self.model.fetched)
+            self.list.verticalScrollBar().setValue(scroll)
+            return
+
         self.loading_movie.stop()
         self.loading.setHidden(True)
 
@@ -312,7 +511,11 @@ class FileExplorerWidget(QWidget):
                     )
                 )
         if not files:
+            self.model.clear()
+            self.list.setHidden(True)
             self.empty_label.setHidden(False)
+        elif self.model.size:
+            self.model.append(files[self.model.size:])
         else:
             self.list.setHidden(False)
             self.model.populate(files)
@@ -327,7 +530,7 @@ class FileExplorerWidget(QWidget):
         return super(FileExplorerWidget, self).eventFilter(obj, event)
 
     def open(self, index: QModelIndex = ...):
-        if Adb.manager().open(self.model.items[index.row()]):
+        if Adb.manager().open(self.model.file(index.row())):
             Global().communicate.files__refresh.emit()
 
     def context_menu(self, pos: QPoint):
@@ -362,6 +565,15 @@ class FileExplorerWidget(QWidget):
         action_download_to.triggered.connect(self.download_to)
         menu.addAction(action_download_to)
 
+        if self.list.currentIndex().isValid() and self.file.isdir:
+            action_sync_to = QAction('Sync to computer...', self)
+            action_sync_to.triggered.connect(lambda: self.sync(TransferType.DOWNLOAD))
+            menu.addAction(action_sync_to)
+
+            action_sync_from = QAction('Sync from computer...', self)
+            action_sync_from.triggered.connect(lambda: self.sync(TransferType.UPLOAD))
+            menu.addAction(action_sync_from)
+
         menu.addSeparator()
 
         action_properties = QAction('Properties', self)
@@ -444,28 +656,94 @@ class FileExplorerWidget(QWidget):
             self.download_files(dir_name)
 
     def download_files(self, destination: str = None):
-        for file in self.files:
-            helper = ProgressCallbackHelper()
-            worker = AsyncRepositoryWorker(
-                worker_id=self.DOWNLOAD_WORKER_ID,
-                name="Download",
-                repository_method=FileRepository.download,
-                response_callback=self.default_response,
-                arguments=(
-                    helper.progress_callback.emit, file.path, destination
+        files = list(self.files or [])
+        if files:
+            TransferQueue.instance().download(files, destination)
+            Global().communicate.status_bar.emit('Operation: Downloading %d item(s)...' % len(files), 3000)
+            Global().communicate.transfers.emit()
+
+    def sync(self, direction: str):
+        title = 'Sync to' if direction == TransferType.DOWNLOAD else 'Sync from'
+        directory = QFileDialog.getExistingDirectory(self, title, '~')
+        if not directory:
+            return
+
+        worker = AsyncRepositoryWorker(
+            worker_id=self.SYNC_WORKER_ID,
+            name="Sync",
+            repository_method=DirectorySync.plan,
+            arguments=(direction, self.file.path, directory, Settings.sync_checksums()),
+            response_callback=self.__async_response_sync,
+            timeout=Settings.operation_timeout('files'),
+            priority=JobScheduler.NORMAL
+        )
+        if Adb.worker().work(worker):
+            Global().communicate.notification.emit(
+                MessageData(
+                    title='Sync',
+                    body="Comparing '%s' and '%s', please wait" % (self.file.path, directory),
+                    message_type=MessageType.LOADING_MESSAGE,
+                    message_catcher=worker.set_loading_widget
                 )
             )
-            if Adb.worker().work(worker):
-                Global().communicate.notification.emit(
-                    MessageData(
-                        title="Downloading to",
-                        message_type=MessageType.LOADING_MESSAGE,
-                        message_catcher=worker.set_loading_widget
-                    )
+            worker.start()
+
+    def __async_response_sync(self, plan: SyncPlan, error: str):
+        if error or not plan:
+            Global().communicate.notification.emit(
+                MessageData(
+                    title='Sync',
+                    timeout=15000,
+                    body="<span style='color: red; font-weight: 600'> %s </span>" % (error or 'Sync failed')
                 )
-                helper.setup(worker, worker.update_loading_widget)
+            )
+            return
+        if plan.empty:
+            Global().communicate.notification.emit(
+                MessageData(title='Sync', timeout=15000, body="Up to date: %d file(s) unchanged" % plan.unchanged)
+            )
+            return
+
+        # Dry run report, nothing is changed until the sync is confirmed
+        dialog = QMessageBox(self)
+        dialog.setWindowTitle('Sync')
+        dialog.setText(plan.summary)
+        dialog.setDetailedText(plan.report())
+        delete = QCheckBox('Delete %d file(s) missing on the source' % len(plan.delete), dialog)
+        if plan.delete:
+            dialog.setCheckBox(delete)
+        sync = dialog.addButton('Sync', QMessageBox.AcceptRole)
+        dialog.addButton(QMessageBox.Cancel)
+        dialog.exec_()
+        if dialog.clickedButton() is not sync:
+            return
+
+        if plan.copy or plan.update:
+            DirectorySync.transfer(plan)
+            Global().communicate.transfers.emit()
+        if plan.delete and delete.isChecked():
+            worker = AsyncRepositoryWorker(
+                worker_id=self.SYNC_DELETE_WORKER_ID,
+                name="Sync",
+                repository_method=DirectorySync.delete,
+                arguments=(plan,),
+                response_callback=self.__async_response_sync_delete,
+                priority=JobScheduler.NORMAL
+            )
+            if Adb.worker().work(worker):
                 worker.start()
 
+    @staticmethod
+    def __async_response_sync_delete(data, error):
+        Global().communicate.notification.emit(
+            MessageData(
+                title='Sync',
+                timeout=15000,
+                body=data + ("<br/><span style='color: red; font-weight: 600'> %s </span>" % error if error else '')
+            )
+        )
+        Global().communicate.files__refresh.emit()
+
     def file_properties(self):
         file, error = FileRepository.file(self.file.path)
         file = file if file else self.file
@@ -480,16 +758,16 @@ class FileExplorerWidget(QWidget):
             )
 
         info = "<br/><u><b>%s</b></u><br/>" % str(file)
-        info += "<pre>Name:        %s</pre>" % file.name or '-'
-        info += "<pre>Owner:       %s</pre>" % file.owner or '-'
-        info += "<pre>Group:       %s</pre>" % file.group or '-'
-        info += "<pre>Size:        %s</pre>" % file.raw_size or '-'
-        info += "<pre>Permissions: %s</pre>" % file.permissions or '-'
-        info += "<pre>Date:        %s</pre>" % file.raw_date or '-'
-        info += "<pre>Type:        %s</pre>" % file.type or '-'
+        info += "<pre>Name:        %s</pre>" % (file.name or '-')
+        info += "<pre>Owner:       %s</pre>" % (file.owner or '-')
+        info += "<pre>Group:       %s</pre>" % (file.group or '-')
+        info += "<pre>Size:        %s</pre>" % (file.raw_size or '-')
+        info += "<pre>Permissions: %s</pre>" % (file.permissions or '-')
+        info += "<pre>Date:        %s</pre>" % (file.raw_date or '-')
+        info += "<pre>Type:        %s</pre>" % (file.type or '-')
 
         if file.type == FileType.LINK:
-            info += "<pre>Links to:    %s</pre>" % file.link or '-'
+            info += "<pre>Links to:    %s</pre>" % (file.link or '-')
 
         properties = QMessageBox(self)
         properties.setStyleSheet("background-color: #DDDDDD")
@@ -7,9 +7,9 @@ from PyQt5.QtWidgets import QToolButton, QMenu, QWidget, QAction, QFileDialog, Q
 from app.core.configurations import Resources
 from app.core.main import Adb
 from app.core.managers import Global
-from app.data.models import MessageData, MessageType
+from app.core.transfers import TransferQueue
+from app.data.models import MessageData
 from app.data.repositories import FileRepository
-from app.helpers.tools import AsyncRepositoryWorker, ProgressCallbackHelper
 
 
 class UploadTools(QToolButton):
@@ -73,53 +73,18 @@ class UploadTools(QToolButton):
             Global().communicate.files__refresh.emit()
 
     class FilesUploader:
-        UPLOAD_WORKER_ID = 398
-
         def __init__(self):
             self.files = []
 
         def setup(self, files: list):
             self.files = files
 
-        def upload(self, data=None, error=None):
+        def upload(self):
             if self.files:
-                helper = ProgressCallbackHelper()
-                worker = AsyncRepositoryWorker(
-                    worker_id=self.UPLOAD_WORKER_ID,
-                    name="Upload",
-                    repository_method=FileRepository.upload,
-                    response_callback=self.upload,
-                    arguments=(helper.progress_callback.emit, self.files.pop())
-                )
-                if Adb.worker().work(worker):
-                    Global().communicate.notification.emit(
-                        MessageData(
-                            title="Uploading",
-                            message_type=MessageType.LOADING_MESSAGE,
-                            message_catcher=worker.set_loading_widget
-                        )
-                    )
-                    helper.setup(worker, worker.update_loading_widget)
-                    worker.start()
-            else:
-                Global().communicate.files__refresh.emit()
-
-            if error:
-                Global().communicate.notification.emit(
-                    MessageData(
-                        timeout=15000,
-                        title='Upload error',
-                        body="<span style='color: red; font-weight: 600'> %s </span>" % error,
-                    )
-                )
-            if data:
-                Global().communicate.notification.emit(
-                    MessageData(
-                        title='Uploaded',
-                        timeout=15000,
-                        body=data,
-                    )
-                )
+                TransferQueue.instance().upload(self.files)
+                Global().communicate.status_bar.emit('Operation: Uploading %d item(s)...' % len(self.files), 3000)
+                Global().communicate.transfers.emit()
+                self.files = []
 
 
 class ParentButton(QToolButton):
@@ -131,6 +131,17 @@ class LoadingMessage(BaseMessage):
         elif isinstance(body, str):
             self.layout().addWidget(self.default_body_message(body))
 
+    def set_cancel_callback(self, callback: callable):
+        button = QPushButton(self)
+        button.setObjectName("close")
+        button.setToolTip("Cancel")
+        button.setIcon(QIcon(Resources.icon_close))
+        button.setFixedSize(32, 32)
+        button.setIconSize(QSize(10, 10))
+        button.setStyleSheet(read_string_from_file(Resources.style_notification_button))
+        button.clicked.connect(lambda: callback() or button.setDisabled(True))
+        self.header.addWidget(button)
+
     def update_progress(self, title: str, progress: int):
         if self.label:
             self.label.setText(title)
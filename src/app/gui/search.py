@@ -0,0 +1,250 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import datetime
+import posixpath
+from functools import partial
+from typing import Any
+
+from PyQt5.QtCore import Qt, QTimer, QModelIndex
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QLabel, QListView, \
+    QApplication, QCheckBox
+
+from app.core.configurations import Resources, Settings
+from app.core.index import DeviceIndex
+from app.core.main import Adb
+from app.core.managers import Global
+from app.core.search import DeviceIndexer
+from app.data.models import File, MessageData
+from app.data.repositories import FileRepository
+from app.gui.explorer.files import FileHeaderWidget, FileItemDelegate, FileListModel
+from app.helpers.tools import AsyncRepositoryWorker, BatchCallbackHelper, JobScheduler
+from app.services.adb import SEARCH_LIMIT
+
+
+class SearchResultModel(FileListModel):
+    """
+    SearchResultModel - files found on the device, shown like the files of a directory. Paths are in the tooltips
+    """
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index: QModelIndex, role: int = ...) -> Any:
+        if index.isValid() and role == Qt.ToolTipRole:
+            return self.file(index.row()).path
+        return super(SearchResultModel, self).data(index, role)
+
+
+class SearchWindow(QWidget):
+    """
+    SearchWindow - searches the files by name in the DeviceIndex while typing.
+    The search on device (Enter) runs `find` (or `grep` for contents) in the tree of the path on the device,
+    found files are shown while they arrive
+    """
+
+    INDEX_WORKER_ID = 500
+    DEVICE_SEARCH_WORKER_ID = 501
+    QUERY_DELAY = 200  # Milliseconds, the index is searched when typing pauses
+
+    def __init__(self):
+        super(SearchWindow, self).__init__()
+        self.query = QLineEdit(self)
+        self.query.setPlaceholderText('Name or a part of it')
+        self.query.textChanged.connect(self.typed)
+        self.query.returnPressed.connect(self.search_device)
+
+        self.index_button = QPushButton('Update index', self)
+        self.index_button.clicked.connect(self.index)
+
+        self.path = QLineEdit(self)
+        self.path.setPlaceholderText('Path on the device')
+        self.path.returnPressed.connect(self.search_device)
+
+        self.content = QCheckBox('File contents', self)
+        self.content.setToolTip('Search files containing the text instead of names')
+
+        self.device_button = QPushButton('Search on device', self)
+        self.device_button.clicked.connect(self.search_device)
+
+        top = QHBoxLayout()
+        top.addWidget(self.query)
+        top.addWidget(self.index_button)
+
+        device = QHBoxLayout()
+        device.addWidget(self.path)
+        device.addWidget(self.content)
+        device.addWidget(self.device_button)
+        self.device_worker = None
+
+        self.list = QListView(self)
+        self.model = SearchResultModel(self.list)
+        self.list.setSpacing(1)
+        self.list.setModel(self.model)
+        self.list.setUniformItemSizes(True)
+        self.list.setItemDelegate(FileItemDelegate(self.list))
+        self.list.doubleClicked.connect(self.open)
+
+        self.status = QLabel(self)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(top)
+        layout.addLayout(device)
+        layout.addWidget(FileHeaderWidget(self))
+        layout.addWidget(self.list)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.search)
+
+        self.setAttribute(Qt.WA_QuitOnClose, False)
+        self.setWindowIcon(QIcon(Resources.icon_logo))
+        self.setWindowTitle('Search')
+        self.resize(720, 480)
+
+        center = QApplication.desktop().availableGeometry(self).center()
+        self.move(int(center.x() - self.width() * 0.5), int(center.y() - self.height() * 0.5))
+
+    @property
+    def device(self) -> str:
+        device = Adb.manager().get_device()
+        return device.id if device else None
+
+    def showEvent(self, event):
+        if self.device_button.text() != 'Cancel':
+            self.path.setText(Adb.manager().path())
+            self.refresh()
+        self.query.setFocus()
+        return super(SearchWindow, self).showEvent(event)
+
+    def refresh(self):
+        if not self.device:
+            self.status.setText('No device selected')
+            return
+        if not self.index_button.isEnabled():
+            self.status.setText('Indexing %s...' % Settings.device_index_root())
+            return
+        root, indexed, entries = DeviceIndex.status(self.device)
+        if not indexed:
+            self.status.setText('The device is not indexed yet, press "Update index"')
+            return
+        self.status.setText('%d entries of %s, indexed %s' % (
+            entries, root, datetime.datetime.fromtimestamp(indexed).strftime('%Y-%m-%d %H:%M')
+        ))
+
+    def typed(self):
+        # Results of the index replace the ones of the search on device
+        self.stop_device_search()
+        self.timer.start(self.QUERY_DELAY)
+
+    def search(self):
+        files = DeviceIndex.search(self.device, self.query.text()) if self.device else []
+        self.model.populate(files)
+        if self.query.text().strip():
+            self.refresh()
+            if len(files) >= DeviceIndex.LIMIT:
+                self.status.setText('First %d results. %s' % (len(files), self.status.text()))
+
+    def index(self):
+        if not self.device:
+            return
+        worker = AsyncRepositoryWorker(
+            name="Index",
+            worker_id=self.INDEX_WORKER_ID,
+            repository_method=DeviceIndexer.index,
+            response_callback=self._async_response,
+            arguments=(self.device, Settings.device_index_root()),
+            priority=JobScheduler.BACKGROUND
+        )
+        if Adb.worker().check(self.INDEX_WORKER_ID) and Adb.worker().work(worker):
+            self.index_button.setDisabled(True)
+            worker.start()
+            self.refresh()
+
+    def _async_response(self, data: str, error: str):
+        self.index_button.setDisabled(False)
+        self.refresh()
+        if error:
+            Global().communicate.notification.emit(
+                MessageData(
+                    title='Index',
+                    timeout=15000,
+                    body="<span style='color: red; font-weight: 600'> %s </span>" % error
+                )
+            )
+        elif data:
+            Global().communicate.status_bar.emit('Index: %s' % data, 5000)
+            self.search()
+
+    def open(self, index: QModelIndex = ...):
+        # Directory of the found file is opened in the explorer
+        file = self.model.file(index.row())
+        path = file.path if file.isdir else posixpath.dirname(file.path)
+        if Adb.manager().go(File(name=posixpath.basename(path), path=path, permissions='drwxrwx---')):
+            Global().communicate.files.emit()
+
+    def search_device(self):
+        if self.device_button.text() == 'Cancel':
+            # Cancelled search responds with the files found so far
+            self.device_worker.cancel()
+            return
+        pattern, path = self.query.text().strip(), self.path.text().strip() or '/'
+        if not self.device or not pattern:
+            return
+
+        self.timer.stop()
+        helper = BatchCallbackHelper()
+        worker = AsyncRepositoryWorker(
+            name="Search",
+            worker_id=self.DEVICE_SEARCH_WORKER_ID,
+            repository_method=FileRepository.search,
+            response_callback=partial(self._async_search, path),
+            arguments=(path, pattern, self.content.isChecked(), helper.batch_callback.emit),
+            priority=JobScheduler.NORMAL
+        )
+        helper.setup(worker, partial(self._async_batch, worker, path))
+        Adb.worker().cancel(self.DEVICE_SEARCH_WORKER_ID)
+        if Adb.worker().work(worker):
+            self.device_worker = worker
+            self.model.clear()
+            self.device_button.setText('Cancel')
+            self.status.setText('Searching in %s...' % path)
+            worker.start()
+
+    def stop_device_search(self):
+        if self.device_button.text() == 'Cancel':
+            Adb.worker().cancel(self.DEVICE_SEARCH_WORKER_ID)
+            self.device_button.setText('Search on device')
+            self.device_worker = None
+
+    def _async_batch(self, worker: AsyncRepositoryWorker, path: str, files: list):
+        if worker.silent:
+            return  # Batch of a stopped search
+        self.model.append(files)
+        self.status.setText('Searching in %s... %d found' % (path, self.model.size))
+
+    def _async_search(self, path: str, files: list, error: str):
+        cancelled = self.device_worker.token.cancelled if self.device_worker else False
+        self.device_button.setText('Search on device')
+        self.device_worker = None
+        if files:
+            self.model.append(files[self.model.size:])
+        found = self.model.size
+        if error:
+            self.status.setText('%s, %d found in %s' % (error, found, path))
+            if not found and not cancelled:
+                Global().communicate.notification.emit(
+                    MessageData(
+                        title='Search',
+                        timeout=15000,
+                        body="<span style='color: red; font-weight: 600'> %s </span>" % error
+                    )
+                )
+        elif found >= SEARCH_LIMIT:
+            self.status.setText('First %d files found in %s' % (found, path))
+        else:
+            self.status.setText('%d found in %s' % (found, path))
@@ -0,0 +1,114 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QProgressBar, \
+    QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QApplication
+
+from app.core.configurations import Resources
+from app.core.transfers import TransferQueue
+from app.data.models import readable_size
+
+
+class TransfersWindow(QWidget):
+    COLUMNS = ('Name', 'Type', 'Status', 'Progress', 'Size')
+    REFRESH_INTERVAL = 500  # Milliseconds
+
+    def __init__(self):
+        super(TransfersWindow, self).__init__()
+        self.queue = TransferQueue.instance()
+        self.transfers = []
+
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+
+        buttons = QHBoxLayout()
+        for name, action in (
+                ('Pause', self.queue.pause),
+                ('Resume', self.queue.resume),
+                ('Cancel', self.queue.cancel),
+                ('Retry', self.queue.retry)
+        ):
+            button = QPushButton(name, self)
+            button.clicked.connect(lambda _, method=action: self.__apply(method))
+            buttons.addWidget(button)
+        buttons.addStretch(1)
+        clear = QPushButton('Clear finished', self)
+        clear.clicked.connect(self.queue.clear)
+        buttons.addWidget(clear)
+
+        self.progress = QProgressBar(self)
+        self.progress.setRange(0, 1000)
+        self.progress.setTextVisible(False)
+        self.statistics = QLabel(self)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        layout.addWidget(self.progress)
+        layout.addWidget(self.statistics)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.queue.changed.connect(self.populate)
+
+        self.setAttribute(Qt.WA_QuitOnClose, False)
+        self.setWindowIcon(QIcon(Resources.icon_logo))
+        self.setWindowTitle('Transfers')
+        self.resize(560, 360)
+
+        center = QApplication.desktop().availableGeometry(self).center()
+        self.move(int(center.x() - self.width() * 0.5), int(center.y() - self.height() * 0.5))
+
+    def showEvent(self, event):
+        self.populate()
+        self.timer.start(self.REFRESH_INTERVAL)
+        return super(TransfersWindow, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        return super(TransfersWindow, self).hideEvent(event)
+
+    def __apply(self, method: callable):
+        rows = {index.row() for index in self.table.selectionModel().selectedRows()}
+        for row in sorted(rows):
+            if row < len(self.transfers):
+                method(self.transfers[row])
+
+    def populate(self):
+        if not self.isVisible():
+            return
+        self.transfers = list(self.queue.transfers)
+        self.table.setRowCount(len(self.transfers))
+        for row, transfer in enumerate(self.transfers):
+            for column, text in enumerate((transfer.name, transfer.type, transfer.status, '', '')):
+                item = self.table.item(row, column)
+                if not item:
+                    item = QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(text)
+            self.table.item(row, 0).setToolTip(transfer.source)
+            self.table.item(row, 2).setToolTip(str(transfer.error or transfer.message or ''))
+        self.refresh()
+
+    def refresh(self):
+        for row, transfer in enumerate(self.transfers):
+            self.table.item(row, 2).setText(transfer.status)
+            self.table.item(row, 3).setText('%d%%' % (transfer.fraction * 100))
+            self.table.item(row, 4).setText(readable_size(transfer.size))
+
+        transferred, size, files_done, files, throughput, eta = self.queue.statistics()
+        self.progress.setValue(int(transferred / size * 1000) if size else 0)
+        text = '%s of %s, %d of %d files' % (
+            readable_size(transferred) or '0 B', readable_size(size) or '?', files_done, files
+        )
+        if throughput:
+            text += ', %s/s' % readable_size(int(throughput))
+        if eta is not None:
+            text += ', %d:%02d left' % divmod(int(eta), 60)
+        self.statistics.setText(text)
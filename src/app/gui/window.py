@@ -1,17 +1,25 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
+import os
+
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QMainWindow, QAction, qApp, QInputDialog, QMenuBar, QMessageBox
 
 from app.core.configurations import Resources, Settings
+from app.core.index import ListingIndex
+from app.core.journal import TransferJournal
 from app.core.main import Adb
 from app.core.managers import Global
+from app.core.transfers import TransferQueue
 from app.data.models import MessageData, MessageType
 from app.data.repositories import DeviceRepository
 from app.gui.explorer import MainExplorer
 from app.gui.help import About
 from app.gui.notification import NotificationCenter
-from app.helpers.tools import AsyncRepositoryWorker
+from app.gui.search import SearchWindow
+from app.gui.transfers import TransfersWindow
+from app.helpers.checksum import Hasher
+from app.helpers.tools import AsyncRepositoryWorker, JobScheduler
 
 
 class MenuBar(QMenuBar):
@@ -40,6 +48,19 @@ class MenuBar(QMenuBar):
         devices_action.triggered.connect(Global().communicate.devices.emit)
         self.file_menu.addAction(devices_action)
 
+        self.transfers = TransfersWindow()
+        transfers_action = QAction('&Transfers', self)
+        transfers_action.setShortcut('Alt+T')
+        transfers_action.triggered.connect(self.show_transfers)
+        self.file_menu.addAction(transfers_action)
+        Global().communicate.transfers.connect(self.show_transfers)
+
+        self.search = SearchWindow()
+        search_action = QAction('&Search', self)
+        search_action.setShortcut('Ctrl+F')
+        search_action.triggered.connect(self.show_search)
+        self.file_menu.addAction(search_action)
+
         exit_action = QAction('&Exit', self)
         exit_action.setShortcut('Alt+Q')
         exit_action.triggered.connect(qApp.quit)
@@ -49,13 +70,23 @@ class MenuBar(QMenuBar):
         about_action.triggered.connect(self.about.show)
         self.help_menu.addAction(about_action)
 
+    def show_transfers(self):
+        self.transfers.show()
+        self.transfers.raise_()
+
+    def show_search(self):
+        self.search.show()
+        self.search.raise_()
+
     def disconnect(self):
         worker = AsyncRepositoryWorker(
             worker_id=self.DISCONNECT_WORKER_ID,
             name="Disconnecting",
             repository_method=DeviceRepository.disconnect,
             response_callback=self.__async_response_disconnect,
-            arguments=()
+            arguments=(),
+            timeout=Settings.operation_timeout('devices'),
+            priority=JobScheduler.INTERACTIVE
         )
         if Adb.worker().work(worker):
             Global().communicate.notification.emit(
@@ -79,7 +110,9 @@ class MenuBar(QMenuBar):
                 name="Connecting to device",
                 repository_method=DeviceRepository.connect,
                 arguments=(str(text),),
-                response_callback=self.__async_response_connect
+                response_callback=self.__async_response_connect,
+                timeout=Settings.operation_timeout('devices'),
+                priority=JobScheduler.INTERACTIVE
             )
             if Adb.worker().work(worker):
                 Global().communicate.notification.emit(
@@ -166,6 +199,39 @@ class MainWindow(QMainWindow):
         Global().communicate.status_bar.emit('Ready', 5000)
         Global().communicate.notification.emit(MessageData(title=welcome_title, body=welcome_body, timeout=30000))
 
+        # Unfinished downloads of the previous sessions are offered once per device
+        self.restored_devices = set()
+        Global().communicate.files.connect(self.restore_transfers)
+
+    def restore_transfers(self):
+        device = Adb.manager().get_device()
+        if not device or device.id in self.restored_devices:
+            return
+        self.restored_devices.add(device.id)
+
+        queued = {
+            (transfer.source, transfer.destination) for transfer in TransferQueue.instance().transfers
+        }
+        entries = [
+            entry for entry in TransferJournal.pending(device.id)
+            if (entry['source'], os.path.dirname(entry['path'])) not in queued
+        ]
+        if not entries:
+            return
+        reply = QMessageBox.question(
+            self, 'Unfinished downloads',
+            "%d download(s) from %s were not finished:\n\n%s\n\nDo you want to resume them?" % (
+                len(entries), device.name, "\n".join(entry['source'] for entry in entries[:10])
+            ),
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+        )
+        if reply == QMessageBox.Yes:
+            TransferQueue.instance().restore(entries)
+            Global().communicate.transfers.emit()
+        else:
+            for entry in entries:
+                TransferJournal.discard(entry['path'])
+
     def notify(self, data: MessageData):
         message = self.notification_center.append_notification(
             title=data.title,
@@ -189,6 +255,8 @@ class MainWindow(QMainWindow):
         elif Adb.core == Adb.PYTHON_ADB_SHELL:
             Adb.stop()
 
+        Hasher.shutdown()
+        ListingIndex.shutdown()
         event.accept()
 
     # This helps the "notification_center" maintain the place after window get resized
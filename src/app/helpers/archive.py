@@ -0,0 +1,168 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import io
+import os
+import tarfile
+import time
+
+from app.helpers.tools import STREAM_BUFFER_SIZE
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    ChunksReader - readable file object over an iterable of bytes chunks (e.g. `exec-out` output).
+    'callback' is called with the number of bytes read so far
+    """
+
+    def __init__(self, chunks, callback: callable = None):
+        self.chunks = iter(chunks)
+        self.callback = callback
+        self.buffer = b''
+        self.bytes = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, data) -> int:
+        while not self.buffer:
+            self.buffer = next(self.chunks, None)
+            if self.buffer is None:
+                self.buffer = b''
+                return 0
+        size = min(len(data), len(self.buffer))
+        data[:size], self.buffer = self.buffer[:size], self.buffer[size:]
+        self.bytes += size
+        if self.callback:
+            self.callback(self.bytes)
+        return size
+
+
+class CountingWriter(io.RawIOBase):
+    """
+    CountingWriter - writes to 'write' function, 'callback' is called with the number of bytes written so far
+    """
+
+    def __init__(self, write: callable, callback: callable = None):
+        self.__write = write
+        self.callback = callback
+        self.bytes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.__write(bytes(data))
+        self.bytes += len(data)
+        if self.callback:
+            self.callback(self.bytes)
+        return len(data)
+
+
+def _check_member(member: tarfile.TarInfo, destination: str):
+    # Same rules as the 'data' extraction filter of newer Python versions
+    path = os.path.realpath(os.path.join(destination, member.name))
+    if os.path.isabs(member.name) or os.path.commonpath([path, destination]) != destination:
+        raise tarfile.ExtractError("'%s' would be extracted outside of the destination" % member.name)
+    if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+        raise tarfile.ExtractError("'%s' is a special file" % member.name)
+    if member.issym() or member.islnk():
+        base = os.path.dirname(path) if member.issym() else destination
+        target = os.path.realpath(os.path.join(base, member.linkname))
+        if os.path.isabs(member.linkname) or os.path.commonpath([target, destination]) != destination:
+            raise tarfile.ExtractError("Link '%s' points outside of the destination" % member.name)
+
+
+def extract(chunks, destination: str, callback: callable = None, name: str = None) -> int:
+    """
+    Extracts tar stream (iterable of bytes chunks) into 'destination' member by member, without seeking.
+    Members with absolute paths, paths or links outside of 'destination' and special files are rejected.
+    Returns the number of extracted files
+
+    Keyword arguments:
+    chunks -- iterable of bytes
+    destination -- local directory
+    callback -- called with the number of bytes read from the stream (default None)
+    name -- directory for the members of a directory archived from the inside ('.', './...') (default None)
+    """
+    destination = os.path.realpath(destination)
+    os.makedirs(destination, exist_ok=True)
+    files = 0
+    reader = io.BufferedReader(ChunksReader(chunks, callback), STREAM_BUFFER_SIZE)
+    with tarfile.open(fileobj=reader, mode='r|') as tar:
+        for member in tar:
+            if name and (member.name == '.' or member.name.startswith('./')):
+                member.name = name + member.name[1:]
+            if name and member.islnk() and member.linkname.startswith('./'):
+                member.linkname = name + member.linkname[1:]
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, destination, filter='data')
+            else:
+                _check_member(member, destination)
+                tar.extract(member, destination)
+            files += member.isfile()
+    # Padding after the end of archive is read too, so the command is finished with the stream
+    while reader.read(STREAM_BUFFER_SIZE):
+        pass
+    return files
+
+
+def create(source: str, write: callable, callback: callable = None) -> int:
+    """
+    Writes tar stream of 'source' (file or directory, stored under its base name) to the 'write' function.
+    Returns the number of archived files
+
+    Keyword arguments:
+    source -- local file or directory
+    write -- called with bytes of the stream
+    callback -- called with the number of bytes written to the stream (default None)
+    """
+    files = 0
+    writer = io.BufferedWriter(CountingWriter(write, callback), STREAM_BUFFER_SIZE)
+    with tarfile.open(fileobj=writer, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+        source = os.path.normpath(source)
+        name = os.path.basename(source)
+        tar.add(source, arcname=name, recursive=False)
+        for root, dirs, names in os.walk(source):
+            for entry in sorted(dirs) + sorted(names):
+                path = os.path.join(root, entry)
+                tar.add(path, arcname=os.path.join(name, os.path.relpath(path, source)).replace(os.sep, '/'),
+                        recursive=False)
+                files += os.path.isfile(path)
+    writer.flush()
+    return files
+
+
+def size(source: str) -> int:
+    """
+    Size of a local file or directory (bytes of the files)
+    """
+    if not os.path.isdir(source):
+        return os.path.getsize(source)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(source) for name in names
+    )
+
+
+def progress(callback: callable, path: str, total: int) -> callable:
+    """
+    Converts the number of transferred bytes to the '(path, percent)' progress callback of the repositories.
+    Stream has headers, so the percent stays below 100 until the transfer is finished
+    """
+    last = [-1]
+
+    def call(transferred: int):
+        percent = min(int(transferred * 100 / total), 99) if total else 0
+        if percent != last[0]:
+            last[0] = percent
+            callback(path, percent)
+
+    return call
+
+
+def summary(path: str, files: int, transferred: int, started: float, action: str, method: str = 'tar') -> str:
+    duration = max(time.time() - started, 0.001)
+    return '%s: %d file%s %s (%s). %.1f MB/s (%d bytes in %.3fs)' % (
+        path, files, '' if files == 1 else 's', action, method,
+        transferred / duration / 1024 / 1024, transferred, duration
+    )
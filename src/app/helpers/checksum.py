@@ -0,0 +1,75 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List
+
+# Algorithms of the device side checksums (`sha256sum`, `md5sum` of old toolboxes), in order of preference
+ALGORITHMS = ('sha256', 'md5')
+
+BUFFER_SIZE = 1024 * 1024  # Bytes
+
+
+def file_digest(path: str, algorithm: str = 'sha256') -> str:
+    """
+    Hex digest of the local file
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Hasher:
+    """
+    Hasher - hashes local files in a thread pool of its own, so hashing doesn't take the threads of the transfers.
+    `hashlib` releases the GIL while it hashes, so the threads hash in parallel. Processes are not used: forking
+    the multi-threaded Qt application is unsafe and a frozen application would start again in them
+    """
+
+    WORKERS = min(4, os.cpu_count() or 1)
+
+    __pool = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def pool(cls):
+        with cls.__lock:
+            if not cls.__pool:
+                cls.__pool = ThreadPoolExecutor(cls.WORKERS, thread_name_prefix='Hasher')
+            return cls.__pool
+
+    @classmethod
+    def submit(cls, path: str, algorithm: str = 'sha256') -> Future:
+        return cls.pool().submit(file_digest, path, algorithm)
+
+    @classmethod
+    def digests(cls, paths: List[str], algorithm: str = 'sha256') -> dict:
+        """
+        Hex digests of the local files: {path: digest}, files which can't be read are missing
+        """
+        return cls.results({path: cls.submit(path, algorithm) for path in paths})
+
+    @classmethod
+    def results(cls, futures: dict) -> dict:
+        """
+        Hex digests of the submitted files: {path: digest}, failed ones are missing. Known digests can be mixed in
+        """
+        digests = {}
+        for path, future in futures.items():
+            try:
+                digests[path] = future.result() if isinstance(future, Future) else future
+            except OSError as error:
+                logging.error(error)
+        return digests
+
+    @classmethod
+    def shutdown(cls):
+        with cls.__lock:
+            if cls.__pool:
+                cls.__pool.shutdown(wait=False)
+                cls.__pool = None
@@ -0,0 +1,76 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import posixpath
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # Optional, only gzip streams are used without it
+
+# Device side compressors (fast levels, the link is the bottleneck), in order of preference
+COMMANDS = {
+    'zstd': 'zstd -c -q -1',
+    'gzip': 'gzip -c -1',
+}
+
+# Already compressed formats, compressing them again only costs CPU time of the device
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.apks', '.avi', '.br', '.bz2', '.flac', '.gif', '.gz', '.heic', '.heif', '.jar',
+    '.jpeg', '.jpg', '.lz4', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4', '.obb', '.ogg', '.opus', '.png',
+    '.rar', '.tgz', '.webm', '.webp', '.xz', '.zip', '.zst',
+}
+
+
+def compressible(path: str) -> bool:
+    """
+    Whether the file (by its extension) is worth compressing. Directories are considered compressible
+    """
+    return posixpath.splitext(posixpath.normpath(path.replace('\\', '/')))[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+def select(names: list) -> str:
+    """
+    Preferred compressor of the ones available on the device that can be decompressed here. None - no compressor
+    """
+    for name in COMMANDS:
+        if name in names and (name != 'zstd' or zstandard):
+            return name
+    return None
+
+
+def decompress(name: str, chunks, callback: callable = None):
+    """
+    Decompresses the stream (iterable of bytes chunks) of the compressor 'name', yields decompressed chunks.
+    Corrupted stream raises OSError. Closing the generator closes 'chunks' too
+
+    Keyword arguments:
+    name -- compressor, key of COMMANDS
+    chunks -- iterable of compressed bytes
+    callback -- called with the number of compressed bytes read so far (default None)
+    """
+    if name == 'zstd':
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)  # gzip header and trailer
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if callback:
+                callback(size)
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+    except zlib.error as error:
+        raise OSError('Corrupted %s stream: %s' % (name, error))
+    except Exception as error:
+        if zstandard and isinstance(error, zstandard.ZstdError):
+            raise OSError('Corrupted %s stream: %s' % (name, error))
+        raise
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
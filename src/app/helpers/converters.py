@@ -1,8 +1,12 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
+import calendar
 import datetime
+import functools
+import posixpath
 import re
-from typing import List
+import stat
+from typing import List, Union, Iterable, Iterator
 
 from app.data.models import Device, File, FileType
 
@@ -33,12 +37,20 @@ def convert_to_devices(data: str) -> List[Device]:
     return devices
 
 
+LS_FILE_PATTERN = re.compile(
+    r'[-dlcbsp][-rwxst]{9}\s+\d+\s+\S+\s+\S+\s*\d*,?\s+\d+\s+\d{4}-\d{2}-\d{2} \d{2}:\d{2} .+'
+)
+LS_FILE_LEGACY_PATTERN = re.compile(
+    r'[-dlcbsp][-rwxst]{9}\s+\S+\s+\S+\s*\d*,?\s*\d*\s+\d{4}-\d{2}-\d{2} \d{2}:\d{2} .*'
+)
+
+
 # Converter to File object
 # command: adb -s <device_id> shell ls -l -d <path>
 # <permissions> <type?> <owner> <group> <other,?> <size?> <date&time> <filename>
 def convert_to_file(data: str) -> File:
     date_pattern = '%Y-%m-%d %H:%M'
-    if re.fullmatch(r'[-dlcbsp][-rwxst]{9}\s+\d+\s+\S+\s+\S+\s*\d*,?\s+\d+\s+\d{4}-\d{2}-\d{2} \d{2}:\d{2} .+', data):
+    if LS_FILE_PATTERN.fullmatch(data):
         fields = data.split()
 
         size = 0
@@ -80,7 +92,7 @@ def convert_to_file(data: str) -> File:
             file_type=file_type,
             permissions=permission,
         )
-    elif re.fullmatch(r'[-dlcbsp][-rwxst]{9}\s+\S+\s+\S+\s*\d*,?\s*\d*\s+\d{4}-\d{2}-\d{2} \d{2}:\d{2} .*', data):
+    elif LS_FILE_LEGACY_PATTERN.fullmatch(data):
         fields = data.split()
 
         size = 0
@@ -126,56 +138,74 @@ def convert_to_file(data: str) -> File:
         )
 
 
+# One line of 'ls -l' output: <permissions> ... <size?> <date&time> <filename>
+# toybox:  -rw-rw---- 1 u0_a123 media_rw 1024 2022-01-31 12:00 name
+# toolbox: -rw-rw---- root sdcard_r 1024 2014-01-31 12:00 name (no size for directories and links)
+# busybox: -rw-rw----    1 root sdcard_r 1024 Jan 31 12:00 name (or 'Jan 31  2019' for older files)
+# Devices show '<major>, <minor>' instead of the size, the minor is taken as the size
+LS_LINE_PATTERN = re.compile(
+    r'([-dlcbsp][-rwxsStT]{9})[^ ]* +(?:[^ ]+ +){1,5}?(?:(\d+) +)?'
+    r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}|[A-Z][a-z]{2} [ \d]\d (?: \d{4}|\d{2}:\d{2})) (.+)'
+)
+MONTHS = {month: index for index, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1
+)}
+
+
 # Converter to File list (a)
 # command: adb -s <device_id> shell ls -a -l <path>
 # <permissions> <type?> <owner> <group> <other,?> <size?> <date&time> <filename>
-def convert_to_file_list_a(data: str, **kwargs) -> List[File]:
-    lines = convert_to_lines(data)
-    dirs = kwargs.get('dirs')
+def convert_to_file_list_a(data: Union[str, Iterable[str]], **kwargs) -> List[File]:
+    return list(iterate_file_list_a(data, **kwargs))
+
+
+# Generator of convert_to_file_list_a, files are yielded while the lines are read
+def iterate_file_list_a(data: Union[str, Iterable[str]], **kwargs) -> Iterator[File]:
+    dirs = kwargs.get('dirs') or set()  # Names of links to directories
     path = kwargs.get('path')
+    year = datetime.date.today().year
+    match = LS_LINE_PATTERN.match
 
-    if lines[0].startswith('total'):
-        lines = lines[1:]  # Skip first line: total x
+    for line in convert_to_lines(data):
+        fields = match(line)
+        if not fields:
+            continue  # 'total x' and error lines
+        permission, size, date_time, name = fields.groups()
+        if name == '.' or name == '..':
+            continue
 
-    files = []
-    for line in lines:
-        re__permission = re.search(r'[-dlcbsp][-rwxst]{9}', line)
-        re__size_datetime_name = re.search(r'\d* \d{4}-\d{2}-\d{2} \d{2}:\d{2} .+', line)
-        if re__permission and re__size_datetime_name:
-            size_date_name = re__size_datetime_name[0].split(' ')
-            if len(size_date_name) == 4 and size_date_name[3] == '.':
-                continue
-            elif len(size_date_name) == 4 and size_date_name[3] == '..':
-                continue
+        link = None
+        link_type = None
+        if permission[0] == 'l':
+            name, _, link = name.partition(' -> ')
+            link_type = FileType.DIRECTORY if name in dirs else FileType.FILE
+        yield File(
+            name=name,
+            size=int(size) if size else 0,
+            link=link,
+            path=(path + name),
+            link_type=link_type,
+            date_time=__convert_to_date__(date_time, year),
+            permissions=permission,
+        )
 
-            permission = re__permission[0]
-            size = int(size_date_name[0] or 0)
-            date_time = datetime.datetime.strptime(
-                "%s %s" % (size_date_name[1], size_date_name[2]), '%Y-%m-%d %H:%M'
-            )
-            names = size_date_name[3:]
-
-            link = None
-            link_type = None
-            name = " ".join(names)
-            if permission[0] == 'l':
-                name = " ".join(names[:names.index('->')])
-                link = " ".join(names[names.index('->') + 1:])
-                link_type = FileType.FILE
-                if dirs.__contains__(path + name + '/'):
-                    link_type = FileType.DIRECTORY
-            files.append(
-                File(
-                    name=name,
-                    size=size,
-                    link=link,
-                    path=(path + name),
-                    link_type=link_type,
-                    date_time=date_time,
-                    permissions=permission,
-                )
-            )
-    return files
+
+# Dates of a listing repeat a lot (files copied or taken at once), parsed ones are cached
+@functools.lru_cache(maxsize=4096)
+def __convert_to_date__(data: str, year: int) -> datetime.datetime:
+    if data[0].isdigit():
+        return datetime.datetime.fromisoformat(data)  # 2022-01-31 12:00
+
+    # Jan 31 12:00 (recent, the current year unless it's in the future) or Jan 31  2019
+    month, day = MONTHS[data[:3]], int(data[4:6])
+    if data[9] != ':':
+        return datetime.datetime(int(data[7:]), month, day)
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        year = year - year % 4  # Recent Feb 29 is of the last leap year
+    date = datetime.datetime(year, month, day, int(data[7:9]), int(data[10:12]))
+    if date > datetime.datetime.now() + datetime.timedelta(days=1):
+        date = date.replace(year=year - 1) if not (month == 2 and day == 29) else date.replace(year=year - 4)
+    return date
 
 
 # Converter to File list
@@ -192,7 +222,7 @@ def convert_to_file_list_b(data: str) -> List[File]:
         size = int(fields[1], 16)
         name = " ".join(fields[3:])
         permission = __converter_to_permissions_default__(list(octal))
-        date_time = datetime.datetime.utcfromtimestamp(int(fields[2], 16))
+        date_time = datetime.datetime.fromtimestamp(int(fields[2], 16))
 
         files.append(
             File(
@@ -205,17 +235,55 @@ def convert_to_file_list_b(data: str) -> List[File]:
     return files
 
 
-# Get lines from raw data
-def convert_to_lines(data: str) -> List[str]:
+# Converter to File list (sync)
+# service: sync: LIST / LIS2 <path>
+# (<mode>, <size>, <mtime>, <filename>, <uid?>, <gid?>, <link target mode?>)
+def convert_to_file_list_sync(entries: list, **kwargs) -> List[File]:
+    return list(iterate_file_list_sync(entries, **kwargs))
+
+
+# Generator of convert_to_file_list_sync
+def iterate_file_list_sync(entries: list, **kwargs) -> Iterator[File]:
+    path = kwargs.get('path')
+    return (convert_to_file_sync(entry, path=path + entry.name) for entry in sorted(entries, key=lambda e: e.name))
+
+
+# Converter to File object (sync)
+# service: sync: STAT / LST2 <path>
+def convert_to_file_sync(entry, **kwargs) -> File:
+    link_type = None
+    permissions = __convert_mode_to_permissions__(entry.mode)
+    if permissions[0] == 'l':
+        link_type = FileType.UNKNOWN
+        if entry.target_mode is not None:
+            link_type = FileType.DIRECTORY if stat.S_ISDIR(entry.target_mode) else FileType.FILE
+
+    return File(
+        name=entry.name,
+        size=entry.size,
+        path=kwargs.get('path'),
+        owner=entry.uid,
+        group=entry.gid,
+        link_type=link_type,
+        date_time=datetime.datetime.fromtimestamp(entry.mtime),
+        permissions=permissions,
+    )
+
+
+# Get lines from raw data (or from a stream of lines)
+def convert_to_lines(data: Union[str, Iterable[str]]) -> Iterable[str]:
     if not data:
         return list()
+    if not isinstance(data, str):
+        return filter(bool, map(lambda line: line.replace('\r', '').replace('\t', '').replace('\n', ''), data))
+    return list(filter(bool, data.replace('\r', '').replace('\t', '').split('\n')))
+
 
-    lines = re.split(r'\n', data)
-    for index, line in enumerate(lines):
-        regex = re.compile(r'[\r\t]')
-        lines[index] = regex.sub('', lines[index])
-    filtered = filter(bool, lines)
-    return list(filtered)
+# Modes of a listing repeat a lot, converted ones are cached
+# 0o100660 (int)   --->    '-rw-rw----' (str)
+@functools.lru_cache(maxsize=1024)
+def __convert_mode_to_permissions__(mode: int) -> str:
+    return __converter_to_permissions_default__(list(oct(mode)[2:]))
 
 
 # Converting octal data to normal permissions' field
@@ -269,3 +337,75 @@ def __converter_to_permissions_default__(octal_data: list) -> str:
 
     permissions = [file_type] + owner + group + others
     return "".join(permissions)
+
+
+def convert_to_disk_usage(data: str) -> (int, int):
+    """
+    Output of ShellCommand.DISK_USAGE ('<kilobytes> <path>' and '<files>' lines) to (bytes, files)
+    """
+    values = (data or '').split()
+    if len(values) < 3 or not values[0].isdigit() or not values[-1].isdigit():
+        return None
+    return int(values[0]) * 1024, int(values[-1])
+
+
+def convert_to_modified(data: str) -> (int, int):
+    """
+    Output of ShellCommand.MODIFIED ('<mtime>' and '<now>' lines) to (mtime, now) in seconds
+    """
+    values = (data or '').split()
+    if len(values) != 2 or not all(value.isdigit() for value in values):
+        return None
+    return int(values[0]), int(values[1])
+
+
+# Converter to manifest of a directory
+# command: cd <path> && find . -type f -exec stat -c '%s %Y %n' {} +
+# <size> <mtime> ./<relative path>
+def convert_to_manifest(data: Union[str, Iterable[str]]) -> dict:
+    manifest = {}
+    for line in convert_to_lines(data):
+        values = line.split(' ', 2)
+        if len(values) == 3 and values[0].isdigit() and values[1].isdigit() and values[2].startswith('./'):
+            manifest[values[2][2:]] = (int(values[0]), int(values[1]))
+    return manifest
+
+
+# Converter to entries of device trees (path, size, mtime, permissions), lines are converted while they are read
+# command: find <path>... -exec stat -c '%s %Y %f %n' {} +
+# <size> <mtime> <raw mode (hex)> <path>
+def iterate_tree(data: Union[str, Iterable[str]]) -> Iterator[tuple]:
+    for line in convert_to_lines(data):
+        values = line.split(' ', 3)
+        if len(values) == 4 and values[0].isdigit() and values[1].isdigit() and values[3].startswith('/'):
+            try:
+                mode = int(values[2], 16)
+            except ValueError:
+                continue
+            yield values[3], int(values[0]), int(values[1]), __convert_mode_to_permissions__(mode)
+
+
+# Converter to files of the search results, lines are converted while they are read
+# command: find <path> -iname <pattern> -exec stat -c '%s %Y %f %n' {} \;
+# <size> <mtime> <raw mode (hex)> <path>
+def iterate_found_files(data: Union[str, Iterable[str]]) -> Iterator[File]:
+    for path, size, mtime, permissions in iterate_tree(data):
+        yield File(
+            name=posixpath.basename(path),
+            path=path,
+            size=size,
+            permissions=permissions,
+            date_time=datetime.datetime.fromtimestamp(mtime)
+        )
+
+
+# Converter to checksums of files
+# command: sha256sum <path>... (or md5sum)
+# <hex digest>  <path>
+def convert_to_checksums(data: Union[str, Iterable[str]]) -> dict:
+    checksums = {}
+    for line in convert_to_lines(data):
+        values = line.split('  ', 1)
+        if len(values) == 2 and len(values[0]) in (32, 64):
+            checksums[values[1]] = values[0]
+    return checksums
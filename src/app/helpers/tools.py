@@ -1,24 +1,167 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
+import asyncio
+import codecs
+import concurrent.futures
 import json
 import logging
 import os
 import shutil
 import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
 
 from PyQt5 import QtCore
-from PyQt5.QtCore import QThread, QObject, QFile, QIODevice, QTextStream
+from PyQt5.QtCore import QObject, QFile, QIODevice, QTextStream
 from PyQt5.QtWidgets import QWidget
 from adb_shell.auth.keygen import keygen
 from adb_shell.auth.sign_pythonrsa import PythonRSASigner
 
 from app.data.models import MessageData
 
+STREAM_BUFFER_SIZE = 64 * 1024
+
+BATCH_SIZE = 2000  # Items, batches of the listings delivered while they are read
+FIRST_BATCH_SIZE = 100  # Items, the first screen is shown at once
+BATCH_INTERVAL = 0.1  # Seconds, slow streams deliver what they have after it
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """
+    CancellationToken - cancels a running operation.
+    Subprocesses, sockets and sessions of the operation register their 'stop' callbacks in the token,
+    they are called when the token is cancelled or when its deadline is reached.
+    The token is activated in a thread (see 'activate'), adb calls of the thread use it via 'current'
+
+    Keyword arguments:
+    timeout -- deadline of the operation in seconds, 0 or None - no deadline (default None)
+    """
+
+    __local = threading.local()
+
+    def __init__(self, timeout: float = None):
+        self.cancelled = False
+        self.timed_out = False
+        self.__lock = threading.Lock()
+        self.__callbacks = []
+        self.__timer = None
+        self.__deadline = None
+        self.set_deadline(timeout)
+
+    @property
+    def reason(self) -> str:
+        return 'Operation timed out' if self.timed_out else 'Operation cancelled'
+
+    def set_deadline(self, timeout: float = None):
+        """
+        Starts the deadline timer (e.g. when a queued operation starts running)
+        """
+        self.dispose()
+        self.__timer = None
+        self.__deadline = None
+        if timeout:
+            self.__deadline = time.monotonic() + timeout
+            self.__timer = threading.Timer(timeout, self.__expire)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def remaining(self) -> float:
+        """
+        Seconds left until the deadline, None - no deadline
+        """
+        if self.__deadline is None:
+            return None
+        return max(self.__deadline - time.monotonic(), 0.)
+
+    def __expire(self):
+        self.timed_out = not self.cancelled
+        self.cancel()
+
+    def cancel(self):
+        with self.__lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except BaseException as error:
+                logging.error(error)
+
+    def dispose(self):
+        if self.__timer:
+            self.__timer.cancel()
+
+    def register(self, callback: callable) -> callable:
+        """
+        Registers 'callback' to stop the operation. Returns function that unregisters the callback
+        """
+        with self.__lock:
+            if not self.cancelled:
+                self.__callbacks.append(callback)
+                return lambda: self.__unregister(callback)
+        callback()
+        return lambda: None
+
+    def __unregister(self, callback: callable):
+        with self.__lock:
+            if callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+
+    def check(self):
+        if self.cancelled:
+            raise OperationCancelled(self.reason)
+
+    @contextmanager
+    def activate(self):
+        previous = getattr(self.__local, 'token', None)
+        self.__local.token = self
+        try:
+            yield self
+        finally:
+            self.__local.token = previous
+
+    @classmethod
+    def current(cls):
+        return getattr(cls.__local, 'token', None)
+
+    @classmethod
+    @contextmanager
+    def ensure(cls, timeout: float = None):
+        """
+        Keeps the token of the current thread, otherwise activates a new token with the 'timeout'
+        """
+        if cls.current():
+            yield cls.current()
+            return
+        token = cls(timeout)
+        try:
+            with token.activate():
+                yield token
+        finally:
+            token.dispose()
+
+    @classmethod
+    def on_cancel(cls, callback: callable) -> callable:
+        """
+        Registers 'callback' in the token of the current thread (if exists). Returns the unregister function
+        """
+        token = cls.current()
+        return token.register(callback) if token else lambda: None
+
 
 class CommonProcess:
     """
     CommonProcess - executes subprocess then saves output data and exit code.
     If 'stdout_callback' is defined then every output data line will call this function
+    The process is killed when the CancellationToken of the current thread is cancelled
 
     Keyword arguments:
     arguments -- array list of arguments
@@ -27,20 +170,28 @@ class CommonProcess:
     """
 
     def __init__(self, arguments: list, stdout=subprocess.PIPE, stdout_callback: callable = None):
+        self.ExitCode = None
         self.ErrorData = None
         self.OutputData = None
         self.IsSuccessful = False
         if arguments:
             try:
                 process = subprocess.Popen(arguments, stdout=stdout, stderr=subprocess.PIPE)
-                if stdout == subprocess.PIPE and stdout_callback:
-                    for line in iter(process.stdout.readline, b''):
-                        stdout_callback(line.decode(encoding='utf-8'))
-                data, error = process.communicate()
+                unregister = CancellationToken.on_cancel(process.kill)
+                try:
+                    if stdout == subprocess.PIPE and stdout_callback:
+                        for line in iter(process.stdout.readline, b''):
+                            stdout_callback(line.decode(encoding='utf-8'))
+                    data, error = process.communicate()
+                finally:
+                    unregister()
                 self.ExitCode = process.poll()
                 self.IsSuccessful = self.ExitCode == 0
                 self.ErrorData = error.decode(encoding='utf-8') if error else None
                 self.OutputData = data.decode(encoding='utf-8') if data else None
+                if CancellationToken.current() and CancellationToken.current().cancelled:
+                    self.IsSuccessful = False
+                    self.ErrorData = CancellationToken.current().reason
             except FileNotFoundError:
                 self.ErrorData = "Command '%s' failed! File (command) '%s' not found!" % \
                                  (' '.join(arguments), arguments[0])
@@ -49,13 +200,273 @@ class CommonProcess:
                 self.ErrorData = str(error)
 
 
-class AsyncRepositoryWorker(QThread):
+class CommonResponse:
+    """
+    CommonResponse - result of an adb operation that was executed without a subprocess.
+    Has the same fields as CommonProcess, so repositories can handle both in the same way
+
+    Keyword arguments:
+    output -- output data (default None)
+    error -- error data (default None)
+    exit_code -- exit code, 0 means success (default None)
+    """
+
+    def __init__(self, output: str = None, error: str = None, exit_code: int = None):
+        self.ExitCode = exit_code
+        self.IsSuccessful = exit_code == 0
+        self.OutputData = output or None
+        self.ErrorData = error or None
+
+
+class CommonStream(CommonResponse):
+    """
+    CommonStream - output of an adb operation that is yielded while the operation is running.
+    Iterating over the object yields decoded lines (or chunks), fields of CommonResponse are filled after iteration.
+    The output is read once: the operation runs when the iteration starts, a second iteration raises RuntimeError
+
+    Keyword arguments:
+    producer -- generator function, params: (stream: CommonStream) -> yields bytes, fills the stream fields
+    lines -- yield lines instead of chunks (default True)
+    buffer_size -- maximum size of a yielded line or chunk in bytes (default 64 KB)
+    """
+
+    def __init__(self, producer: callable, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+        super(CommonStream, self).__init__()
+        self.lines = lines
+        self.buffer_size = buffer_size
+        self.__producer = producer
+        self.__started = False
+
+    def __produce(self):
+        if self.__started:
+            raise RuntimeError('Output of the stream is already read')
+        self.__started = True
+        return self.__producer(self)
+
+    def __iter__(self):
+        return decode_stream(self.__produce(), self.lines, self.buffer_size)
+
+    def chunks(self):
+        """
+        Yields raw (binary) output chunks instead of decoded text
+        """
+        return self.__produce()
+
+    def read(self, limit: int = None) -> str:
+        """
+        Reads the whole output (at most 'limit' characters), the rest of the output is skipped
+        """
+        data = []
+        size = 0
+        for text in self:
+            if limit is not None and size + len(text) > limit:
+                data.append(text[:limit - size])
+                break
+            data.append(text)
+            size += len(text)
+        return ''.join(data)
+
+
+class StreamingProcess(CommonStream):
+    """
+    StreamingProcess - executes subprocess and yields its output while it is running.
+    Memory usage does not depend on the output size: stdout is read by 'buffer_size' bytes,
+    stderr is kept up to 'buffer_size' bytes. The process is killed if iteration is stopped early
+
+    Keyword arguments:
+    arguments -- array list of arguments
+    lines -- yield lines instead of chunks (default True)
+    buffer_size -- maximum size of a yielded line or chunk in bytes (default 64 KB)
+    """
+
+    def __init__(self, arguments: list, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+        super(StreamingProcess, self).__init__(self.__run, lines, buffer_size)
+        self.arguments = arguments
+
+    def __run(self, stream: CommonStream):
+        try:
+            process = subprocess.Popen(self.arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            self.ErrorData = "Command '%s' failed! File (command) '%s' not found!" % \
+                             (' '.join(self.arguments), self.arguments[0])
+            return
+
+        error = bytearray()
+
+        def read_error():
+            for data in iter(lambda: process.stderr.read1(stream.buffer_size), b''):
+                error.extend(data[:stream.buffer_size - len(error)])
+
+        reader = threading.Thread(target=read_error, daemon=True)
+        reader.start()
+        unregister = CancellationToken.on_cancel(process.kill)
+        completed = False
+        try:
+            yield from iter(lambda: process.stdout.read1(stream.buffer_size), b'')
+            completed = True
+        finally:
+            unregister()
+            # The output is closed before the process exits, only a stopped iteration (or an error) kills it
+            if completed:
+                self.ExitCode = process.wait()
+                reader.join()
+            else:
+                if process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                self.ExitCode = process.wait()
+            self.IsSuccessful = self.ExitCode == 0
+            self.ErrorData = error.decode(encoding='utf-8', errors='replace') or None
+            if CancellationToken.current() and CancellationToken.current().cancelled:
+                self.IsSuccessful = False
+                self.ErrorData = CancellationToken.current().reason
+
+
+class Job:
+    """
+    Job - handle of a function scheduled in the JobScheduler
+
+    Keyword arguments:
+    function -- called in a thread of the pool
+    priority -- JobScheduler.INTERACTIVE, NORMAL, BULK or BACKGROUND
+    device -- id of the device the job works with, None - not limited per device (default None)
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, function: callable, priority: int, device: str = None):
+        self.function = function
+        self.priority = priority
+        self.device = device
+        self.state = self.QUEUED
+        self.error = None
+        self.__done = threading.Event()
+
+    def cancel(self) -> bool:
+        """
+        Removes the queued job from the scheduler, returns False if the job has already started
+        """
+        return JobScheduler.instance().remove(self)
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.__done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self.__done.is_set()
+
+    def finish(self, state: str):
+        self.state = state
+        self.__done.set()
+
+
+class JobScheduler:
+    """
+    JobScheduler - fixed-size pool of threads for the repository operations.
+    Queued jobs are started by priority (FIFO within a priority), non-interactive jobs of one device are limited by
+    'device_limit', bulk and background jobs never take the last thread, so listings are not stuck behind transfers
+
+    Keyword arguments:
+    threads -- number of threads in the pool
+    device_limit -- maximum number of running jobs per device, 0 - no limit
+    """
+
+    INTERACTIVE = 0  # Listings, devices, connection
+    NORMAL = 1  # Rename, delete, new folder, properties
+    BULK = 2  # Downloads and uploads
+    BACKGROUND = 3  # Prefetch, indexing
+
+    __instance = None
+
+    def __init__(self, threads: int, device_limit: int = 0):
+        self.threads = max(threads, 2)
+        self.device_limit = device_limit
+        self.__lock = threading.Condition()
+        self.__queue = {priority: [] for priority in range(self.INTERACTIVE, self.BACKGROUND + 1)}
+        self.__running = {}
+        self.__running_bulk = 0
+        for index in range(self.threads):
+            threading.Thread(target=self.__loop, name='JobScheduler-%d' % index, daemon=True).start()
+
+    @classmethod
+    def instance(cls, threads: int = 4, device_limit: int = 0):
+        """
+        Scheduler of the application, 'threads' and 'device_limit' are used for the first call only
+        """
+        if not cls.__instance:
+            cls.__instance = JobScheduler(threads, device_limit)
+        return cls.__instance
+
+    def submit(self, function: callable, priority: int = NORMAL, device: str = None) -> Job:
+        job = Job(function, priority, device)
+        with self.__lock:
+            self.__queue[priority].append(job)
+            self.__lock.notify()
+        return job
+
+    def remove(self, job: Job) -> bool:
+        with self.__lock:
+            if job.state != Job.QUEUED:
+                return False
+            self.__queue[job.priority].remove(job)
+        job.finish(Job.CANCELLED)
+        return True
+
+    def __next(self):
+        for priority, jobs in self.__queue.items():
+            if priority >= self.BULK and self.__running_bulk >= self.threads - 1:
+                continue
+            for job in jobs:
+                if priority == self.INTERACTIVE or not job.device or not self.device_limit or \
+                        self.__running.get(job.device, 0) < self.device_limit:
+                    jobs.remove(job)
+                    return job
+        return None
+
+    def __loop(self):
+        while True:
+            with self.__lock:
+                job = self.__next()
+                while not job:
+                    self.__lock.wait()
+                    job = self.__next()
+                job.state = Job.RUNNING
+                self.__running[job.device] = self.__running.get(job.device, 0) + 1
+                self.__running_bulk += job.priority >= self.BULK
+
+            try:
+                job.function()
+            except BaseException as error:
+                logging.exception("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+                job.error = error
+            finally:
+                with self.__lock:
+                    self.__running[job.device] -= 1
+                    self.__running_bulk -= job.priority >= self.BULK
+                    # Finished job may unblock jobs of its device or bulk jobs, each thread checks the queue again
+                    self.__lock.notify_all()
+                job.finish(Job.DONE)
+
+
+class AsyncRepositoryWorker(QObject):
+    """
+    AsyncRepositoryWorker - repository method running as a job of the JobScheduler.
+    The response is delivered to the GUI thread by the 'on_response' signal, then the worker is closed
+    """
+
     on_response = QtCore.pyqtSignal(object, object)  # Response : data, error
+    finished = QtCore.pyqtSignal()
 
     def __init__(
             self, worker_id: int, name: str,
             repository_method: callable,
-            arguments: tuple, response_callback: callable
+            arguments: tuple, response_callback: callable,
+            timeout: float = None,
+            priority: int = JobScheduler.NORMAL,
+            device: str = None
     ):
         super(AsyncRepositoryWorker, self).__init__()
         self.on_response.connect(response_callback)
@@ -63,16 +474,54 @@ class AsyncRepositoryWorker(QThread):
 
         self.__repository_method = repository_method
         self.__arguments = arguments
+        self.__timeout = timeout
+        self.token = CancellationToken()
+        self.job = None
+        self.silent = False
         self.loading_widget = None
         self.closed = False
+        self.priority = priority
+        self.device = device
         self.id = worker_id
         self.name = name
 
+    def start(self) -> Job:
+        self.job = JobScheduler.instance().submit(self.run, self.priority, self.device)
+        return self.job
+
     def run(self):
-        data, error = self.__repository_method(*self.__arguments)
-        self.on_response.emit(data, error)
+        data, error = None, None
+        try:
+            # Deadline starts when the job starts running, not when it is queued
+            self.token.set_deadline(self.__timeout)
+            with self.token.activate():
+                self.token.check()
+                data, error = self.__repository_method(*self.__arguments)
+        except OperationCancelled as cancelled:
+            data, error = None, str(cancelled)
+        finally:
+            self.token.dispose()
+        self.__respond(data, error)
+
+    def __respond(self, data, error):
+        if self.token.cancelled and not error:
+            error = self.token.reason
+        if not self.silent:
+            self.on_response.emit(data, error)
+        self.finished.emit()
+
+    def cancel(self, silent: bool = False):
+        """
+        Cancels the operation, 'silent' - the response is not delivered (e.g. the worker is replaced by a new one)
+        """
+        self.silent = silent
+        self.token.cancel()
+        if self.job and self.job.cancel():
+            self.__respond(None, None)
 
     def close(self):
+        if self.closed:
+            return
         if self.loading_widget:
             self.loading_widget.close()
         self.deleteLater()
@@ -80,12 +529,71 @@ class AsyncRepositoryWorker(QThread):
 
     def set_loading_widget(self, widget: QWidget):
         self.loading_widget = widget
+        if hasattr(widget, 'set_cancel_callback'):
+            widget.set_cancel_callback(self.cancel)
 
     def update_loading_widget(self, path, progress):
         if self.loading_widget and not self.closed:
             self.loading_widget.update_progress('SOURCE: %s' % path, progress)
 
 
+class AsyncioBridge(QObject):
+    """
+    AsyncioBridge - one asyncio event loop in a background thread for the coroutine repositories
+    (AsyncFileRepository, AsyncDeviceRepository used by the devices view). Many operations are multiplexed
+    on the loop instead of a QThread per operation, responses are delivered to the Qt (GUI) thread
+    by the 'on_response' signal.
+    Must be created in the GUI thread, use 'instance'
+    """
+
+    on_response = QtCore.pyqtSignal(object, object, object)  # Response : callback, data, error
+
+    __instance = None
+
+    def __init__(self):
+        super(AsyncioBridge, self).__init__()
+        self.loop = asyncio.new_event_loop()
+        self.on_response.connect(lambda callback, data, error: callback(data, error))
+        threading.Thread(target=self.loop.run_forever, name='AsyncioBridge', daemon=True).start()
+
+    @classmethod
+    def instance(cls):
+        if not cls.__instance:
+            cls.__instance = AsyncioBridge()
+        return cls.__instance
+
+    def submit(self, coroutine, response_callback: callable = None,
+               timeout: float = None) -> concurrent.futures.Future:
+        """
+        Schedules the coroutine on the loop, the returned future can be cancelled from any thread
+
+        Keyword arguments:
+        coroutine -- coroutine of a repository method, it returns (data, error)
+        response_callback -- called in the GUI thread with (data, error) (default None)
+        timeout -- deadline of the operation in seconds, 0 or None - no deadline (default None)
+        """
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coroutine, timeout or None), self.loop)
+        if response_callback:
+            future.add_done_callback(partial(self.__deliver, response_callback))
+        return future
+
+    def __deliver(self, callback: callable, future: concurrent.futures.Future):
+        if future.cancelled():
+            data, error = None, 'Operation cancelled'
+        elif isinstance(future.exception(), (asyncio.TimeoutError, concurrent.futures.TimeoutError)):
+            data, error = None, 'Operation timed out'
+        elif future.exception():
+            error = future.exception()
+            logging.error("Unexpected error=%s, type(error)=%s" % (error, type(error)))
+            data, error = None, str(error)
+        else:
+            data, error = future.result()
+        self.on_response.emit(callback, data, error)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
 class ProgressCallbackHelper(QObject):
     progress_callback = QtCore.pyqtSignal(str, int)
 
@@ -94,9 +602,18 @@ class ProgressCallbackHelper(QObject):
         self.progress_callback.connect(callback)
 
 
+class BatchCallbackHelper(QObject):
+    batch_callback = QtCore.pyqtSignal(object)  # List of items
+
+    def setup(self, parent: QObject, callback: callable):
+        self.setParent(parent)
+        self.batch_callback.connect(callback)
+
+
 class Communicate(QObject):
     files = QtCore.pyqtSignal()
     devices = QtCore.pyqtSignal()
+    transfers = QtCore.pyqtSignal()
 
     up = QtCore.pyqtSignal()
     files__refresh = QtCore.pyqtSignal()
@@ -138,6 +655,81 @@ def get_python_rsa_keys_signer(rerun=True) -> PythonRSASigner:
             return get_python_rsa_keys_signer(False)
 
 
+def decode_stream(chunks, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+    """
+    Decodes a stream of bytes (utf-8), yields lines (or chunks) of at most 'buffer_size' bytes
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        start = 0
+        while len(buffer) - start >= buffer_size or (lines and buffer.find(b'\n', start) >= 0):
+            end = buffer.find(b'\n', start, start + buffer_size) + 1 if lines else 0
+            end = end or start + buffer_size
+            text = decoder.decode(bytes(buffer[start:end]))
+            if text:
+                yield text
+            start = end
+        if not lines and start < len(buffer):
+            text = decoder.decode(bytes(buffer[start:]))
+            if text:
+                yield text
+            start = len(buffer)
+        del buffer[:start]
+    text = decoder.decode(bytes(buffer), final=True)
+    if text:
+        yield text
+
+
+def deliver(items, batch_callback: callable) -> int:
+    """
+    Delivers the items (iterable) in batches of BATCH_SIZE without keeping them, for streams too large to be listed
+    (e.g. all files of a device). Returns the number of the items
+    """
+    token = CancellationToken.current()
+    count = 0
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            if token:
+                token.check()
+            batch_callback(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        batch_callback(batch)
+    return count + len(batch)
+
+
+def collect(items, batch_callback: callable = None) -> list:
+    """
+    List of the items (iterable). With 'batch_callback' the items are also delivered in batches while they
+    are produced: FIRST_BATCH_SIZE items first, then BATCH_SIZE items or what is produced in BATCH_INTERVAL
+    """
+    if not batch_callback:
+        return list(items)
+
+    result = []
+    token = CancellationToken.current()
+    start = 0
+    size = FIRST_BATCH_SIZE
+    deadline = time.monotonic() + BATCH_INTERVAL
+    for item in items:
+        result.append(item)
+        if len(result) - start >= size or time.monotonic() >= deadline:
+            if token:
+                token.check()
+            batch_callback(result[start:])
+            start = len(result)
+            size = BATCH_SIZE
+            deadline = time.monotonic() + BATCH_INTERVAL
+    if start < len(result):
+        batch_callback(result[start:])
+    return result
+
+
 def read_string_from_file(path: str):
     file = QFile(path)
     if file.open(QIODevice.ReadOnly | QIODevice.Text):
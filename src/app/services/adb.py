@@ -1,11 +1,34 @@
 # ADB File Explorer
 # Copyright (C) 2022  Azat Aldeshov
+import logging
+import shlex
+import subprocess
+import uuid
+from typing import List, Union
+
 from app.core.configurations import Settings
-from app.helpers.tools import CommonProcess
+from app.helpers.tools import CommonProcess, CommonResponse, CommonStream, StreamingProcess, CancellationToken, \
+    STREAM_BUFFER_SIZE
+from app.services import smart_socket
+from app.services.sessions import ShellSessionPool
 
 ADB_PATH = Settings.adb_path()
 RUN_AS_ROOT = Settings.adb_run_as_root()
 PRESERVE_TIMESTAMP = Settings.preserve_timestamp()
+SHELL_SESSIONS = Settings.adb_shell_sessions()
+SOCKET_TRANSPORT = Settings.adb_transport() == 'socket'
+SHELL_TIMEOUT = Settings.operation_timeout('shell')
+
+# Characters of the sources per `adb pull/push` process (command line limit of Windows is 32767)
+ARGUMENTS_LIMIT = 24 * 1024
+
+# Device directory for archives of the tar transfers, when the archive can't be streamed
+TAR_TEMP_DIRECTORY = '/data/local/tmp'
+
+OPEN_FILE_LIMIT = 8 * 1024 * 1024  # Characters
+OPEN_FILE_TRUNCATED = '\n\n[...] File is too large, only the first %d MB are shown' % (OPEN_FILE_LIMIT // 1024 // 1024)
+
+SEARCH_LIMIT = 10000  # Files, a search on the device stops after it
 
 
 class Parameter:
@@ -14,6 +37,8 @@ class Parameter:
     PULL = 'pull'
     PUSH = 'push'
     SHELL = 'shell'
+    EXEC_IN = 'exec-in'
+    EXEC_OUT = 'exec-out'
     CONNECT = 'connect'
     HELP = '--help'
     VERSION = '--version'
@@ -36,6 +61,12 @@ class ShellCommand:
     LS_ALL_LIST_DIRS = [LS, '-a', '-l', '-d']
     LS_VERSION = [LS, '--version']
 
+    # Names of links (in the directory) which point to directories, only shell builtins are used
+    LS_LINK_DIRS = 'cd %s && for f in .* *; do [ -L "$f" ] && [ -d "$f" ] && echo "$f"; done'
+    # Names of directory links, the marker line, then output of 'ls -a -l <path>' (exit code is the code of 'ls')
+    LS_ALL_LIST_LINK_DIRS_MARKER = '__LINK_DIRS__'
+    LS_ALL_LIST_LINK_DIRS = LS_LINK_DIRS + '; echo "' + LS_ALL_LIST_LINK_DIRS_MARKER + '"; cd /; ls -a -l %s'
+
     CP = 'cp'
     MV = 'mv'
     RM = 'rm'
@@ -49,6 +80,78 @@ class ShellCommand:
 
     CAT = 'cat'
 
+    # Tar stream of a file or directory (source: parent directory, name) and extraction of a stream into a directory.
+    # A link is archived as its target: a linked directory from the inside (members '.', './...'), a linked file
+    # by 'tar -h'. Links inside of a directory stay links
+    TAR_CREATE = '(cd %s && n=%s && if [ ! -L "$n" ]; then tar -c -f - "$n"; ' \
+                 'elif [ -d "$n" ]; then cd "$n" && tar -c -f - .; else tar -c -h -f - "$n"; fi)'
+    TAR_EXTRACT = 'tar -x -f - -C %s'
+
+    # `exec` has neither exit code nor error output: both are printed after the output of the command (pipeline)
+    # and a unique marker. Error output is kept up to the end of the command, 3 is the original output
+    STATUS = '{ __error=$( (set -o pipefail) 2>/dev/null && set -o pipefail; { %s; } 2>&1 >&3 3>&-); __code=$?; } ' \
+             '3>&1; printf "%%s%%s\\n%%d" %s "$__error" $__code'
+
+    # Size in kilobytes and number of files of a directory (a link to a directory is followed)
+    DISK_USAGE = 'p=%s; [ -d "$p" ] && p="$p/"; du -s -k "$p"; find "$p" -type f | wc -l'
+    # Modification time of a path (links followed) and the time of the device, in seconds
+    MODIFIED = 'stat -L -c %%Y %s && date +%%s'
+    COMPRESSORS = 'for name in zstd gzip; do command -v $name > /dev/null && echo $name; done'
+
+    # Range of a file (path, block size, offset and count in blocks) and its checksum
+    DD_RANGE = 'dd if=%s bs=%d skip=%d count=%d 2>/dev/null'
+    SHA256SUM = 'sha256sum %s'
+    MD5SUM = 'md5sum %s'
+    CHECKSUMS = {'sha256': SHA256SUM, 'md5': MD5SUM}
+
+    # Size, modification time and relative path of every file of a directory
+    MANIFEST = "cd %s && find . -type f -exec stat -c '%%s %%Y %%n' {} +"
+
+    # Size, modification time, raw mode (hex) and path of every entry of the trees, virtual file systems are skipped
+    TREE = "find %s %s\\( -path /proc -o -path /sys -o -path /dev \\) -prune -o %s" \
+           "-exec stat -c '%%s %%Y %%f %%n' {} + 2>/dev/null"
+    TREE_CHILDREN = '-mindepth 1 -maxdepth 1 '
+    TREE_DIRECTORIES = '-type d '
+
+    # Files of a tree whose names match the pattern (or which contain the text), in the format of TREE.
+    # Every file is printed as soon as it's found
+    FIND_NAME = "find %s \\( -path /proc -o -path /sys -o -path /dev \\) -prune -o -iname %s " \
+                "-exec stat -c '%%s %%Y %%f %%n' {} \\; 2>/dev/null"
+    FIND_CONTENT = "find %s \\( -path /proc -o -path /sys -o -path /dev \\) -prune -o -type f " \
+                   "-exec grep -l -i -F -e %s {} + 2>/dev/null | " \
+                   "while IFS= read -r path; do stat -c '%%s %%Y %%f %%n' \"$path\"; done"
+
+
+def tree_commands(paths: List[str], children: bool = False, directories: bool = False) -> List[str]:
+    """
+    Commands listing the trees of the paths (ShellCommand.TREE), paths are split by ARGUMENTS_LIMIT.
+    With 'children' - only the entries in the directories, with 'directories' - only the directories
+    """
+    options = ShellCommand.TREE_CHILDREN if children else ''
+    test = ShellCommand.TREE_DIRECTORIES if directories else ''
+    commands = []
+    batch, length = [], 0
+    for path in paths + [None]:
+        if batch and (path is None or length + len(path) + 3 > ARGUMENTS_LIMIT):
+            commands.append(ShellCommand.TREE % (' '.join(batch), options, test))
+            batch, length = [], 0
+        if path is not None:
+            batch.append(shlex.quote(path))
+            length += len(batch[-1]) + 1
+    return commands
+
+
+def search_command(path: str, pattern: str, content: bool = False) -> str:
+    """
+    Command finding the files of the tree of 'path': files which contain the text ('content', case insensitive)
+    or whose names match the pattern. A pattern without wildcards matches any part of the names
+    """
+    if content:
+        return ShellCommand.FIND_CONTENT % (shlex.quote(path), shlex.quote(pattern))
+    if not any(char in pattern for char in '*?['):
+        pattern = '*%s*' % pattern
+    return ShellCommand.FIND_NAME % (shlex.quote(path), shlex.quote(pattern))
+
 
 def validate():
     return version().IsSuccessful
@@ -59,6 +162,8 @@ def version():
 
 
 def devices():
+    if SOCKET_TRANSPORT:
+        return smart_socket.devices()
     return CommonProcess([ADB_PATH, Parameter.DEVICES, Parameter.DEVICES_LONG])
 
 
@@ -67,34 +172,242 @@ def start_server():
 
 
 def kill_server():
+    ShellSessionPool.close()
+    if SOCKET_TRANSPORT:
+        return smart_socket.kill_server()
     return CommonProcess([ADB_PATH, Parameter.KILL_SERVER])
 
 
 def connect(device_id: str):
+    if SOCKET_TRANSPORT:
+        return smart_socket.connect(device_id)
     return CommonProcess([ADB_PATH, Parameter.CONNECT, device_id])
 
 
 def disconnect():
+    if SOCKET_TRANSPORT:
+        return smart_socket.disconnect()
     return CommonProcess([ADB_PATH, Parameter.DISCONNECT])
 
 
-def pull(device_id: str, source_path: str, destination_path: str, stdout_callback: callable):
+def pull(device_id: str, source_path: Union[str, list], destination_path: str, stdout_callback: callable):
+    """
+    Pulls one or many sources, many sources are pulled by as few `adb pull` processes (sync sessions) as possible
+    """
+    sources = [source_path] if isinstance(source_path, str) else source_path
+    if SOCKET_TRANSPORT:
+        return smart_socket.pull(device_id, sources, destination_path, stdout_callback, PRESERVE_TIMESTAMP)
     pull_options = [Parameter.PULL, Parameter.PRESERVE_TIMESTAMP] if PRESERVE_TIMESTAMP else [Parameter.PULL]
-    args = [ADB_PATH, Parameter.DEVICE, device_id, *pull_options, source_path, destination_path]
-    return CommonProcess(arguments=args, stdout_callback=stdout_callback)
+    return _batched(
+        [ADB_PATH, Parameter.DEVICE, device_id, *pull_options], sources, destination_path, stdout_callback
+    )
+
+
+def push(device_id: str, source_path: Union[str, list], destination_path: str, stdout_callback: callable):
+    """
+    Pushes one or many sources, many sources are pushed by as few `adb push` processes (sync sessions) as possible
+    """
+    sources = [source_path] if isinstance(source_path, str) else source_path
+    if SOCKET_TRANSPORT:
+        return smart_socket.push(device_id, sources, destination_path, stdout_callback)
+    return _batched(
+        [ADB_PATH, Parameter.DEVICE, device_id, Parameter.PUSH], sources, destination_path, stdout_callback
+    )
+
+
+def _batched(arguments: list, sources: list, destination_path: str, stdout_callback: callable):
+    responses = []
+    batch, length = [], 0
+    for source in sources + [None]:
+        if batch and (source is None or length + len(source) + 1 > ARGUMENTS_LIMIT):
+            responses.append(CommonProcess(arguments + batch + [destination_path], stdout_callback=stdout_callback))
+            token = CancellationToken.current()
+            if token and token.cancelled:
+                break
+            batch, length = [], 0
+        if source is not None:
+            batch.append(source)
+            length += len(source) + 1
+
+    if len(responses) == 1:
+        return responses[0]
+    return CommonResponse(
+        output='\n'.join(response.OutputData for response in responses if response.OutputData),
+        error='\n'.join(response.ErrorData for response in responses if response.ErrorData),
+        exit_code=0 if all(response.IsSuccessful for response in responses) else 1
+    )
 
 
-def push(device_id: str, source_path: str, destination_path: str, stdout_callback: callable):
-    args = [ADB_PATH, Parameter.DEVICE, device_id, Parameter.PUSH, source_path, destination_path]
-    return CommonProcess(arguments=args, stdout_callback=stdout_callback)
+def shell(device_id: str, args: list):
+    # Shell commands called outside of workers (without cancellation token) get the default deadline
+    with CancellationToken.ensure(SHELL_TIMEOUT):
+        return _shell(device_id, args)
 
 
-def shell(device_id: str, args: list):
+def _shell(device_id: str, args: list):
     if RUN_AS_ROOT:
         return CommonProcess([ADB_PATH, Parameter.DEVICE, device_id, Parameter.ROOT] + args)
+    if SOCKET_TRANSPORT:
+        return smart_socket.shell(device_id, args)
+    if SHELL_SESSIONS:
+        return ShellSessionPool.execute(ADB_PATH, device_id, args, SHELL_SESSIONS, timeout=SHELL_TIMEOUT)
     return CommonProcess([ADB_PATH, Parameter.DEVICE, device_id, Parameter.SHELL] + args)
 
 
+def shell_stream(device_id: str, args: list, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+    if CancellationToken.current():
+        return _shell_stream(device_id, args, lines, buffer_size)
+
+    # Streams read outside of workers (without cancellation token) get the default deadline, from the first read
+    def producer(stream: CommonStream):
+        with CancellationToken.ensure(SHELL_TIMEOUT):
+            inner = _shell_stream(device_id, args, lines, buffer_size)
+            yield from inner.chunks()
+        stream.ExitCode, stream.IsSuccessful, stream.ErrorData = inner.ExitCode, inner.IsSuccessful, inner.ErrorData
+
+    return CommonStream(producer, lines, buffer_size)
+
+
+def _shell_stream(device_id: str, args: list, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+    if RUN_AS_ROOT:
+        return StreamingProcess([ADB_PATH, Parameter.DEVICE, device_id, Parameter.ROOT] + args, lines, buffer_size)
+    if SOCKET_TRANSPORT:
+        return smart_socket.shell_stream(device_id, args, lines, buffer_size)
+    if SHELL_SESSIONS:
+        return ShellSessionPool.stream(
+            ADB_PATH, device_id, args, SHELL_SESSIONS, lines, buffer_size, timeout=SHELL_TIMEOUT
+        )
+    return StreamingProcess([ADB_PATH, Parameter.DEVICE, device_id, Parameter.SHELL] + args, lines, buffer_size)
+
+
+def status_command(command: str) -> (str, bytes):
+    """
+    Command of `exec` which prints its exit code and error output after its output (ShellCommand.STATUS).
+    Returns the command and the marker of the status
+    """
+    marker = '__status_%s__' % uuid.uuid4().hex
+    return ShellCommand.STATUS % (command, marker), marker.encode()
+
+
+def strip_status(chunks, marker: bytes, response: CommonResponse):
+    """
+    Yields output chunks of a 'status_command' without the status, the status fills the fields of 'response'.
+    Output without the status (the command or the connection was interrupted) is not successful
+    """
+    response.ExitCode, response.IsSuccessful = None, False
+    keep = len(marker) - 1  # Beginning of the marker at the end of a chunk
+    buffer = b''
+    status = None
+    for chunk in chunks:
+        if status is not None:
+            status += chunk
+            continue
+        buffer += chunk
+        index = buffer.find(marker)
+        if index >= 0:
+            status = buffer[index + len(marker):]
+            buffer = buffer[:index]
+        size = len(buffer) if status is not None else len(buffer) - keep
+        if size > 0:
+            yield buffer[:size]
+            buffer = buffer[size:]
+    if status is None:
+        if buffer:
+            yield buffer
+        response.ErrorData = "Command was interrupted, its exit code is unknown"
+        return
+    error, _, code = status.decode(encoding='utf-8', errors='replace').rpartition('\n')
+    response.ErrorData = error or None
+    response.ExitCode = int(code) if code.strip().isdigit() else None
+    response.IsSuccessful = response.ExitCode == 0
+
+
+def exec_out(device_id: str, args: list) -> CommonStream:
+    """
+    Binary safe output of the command (no pty), use 'chunks()' of the stream to get raw bytes.
+    Exit code and error output are the ones of the command on the device
+    """
+    command, marker = status_command(' '.join(args))
+    output = _exec_out(device_id, [command])
+
+    def producer(stream: CommonStream):
+        chunks = output.chunks()
+        try:
+            yield from strip_status(chunks, marker, stream)
+        finally:
+            chunks.close()
+        if not output.IsSuccessful:
+            # Failed connection (or cancellation) is the error, whatever the device printed
+            stream.ExitCode, stream.IsSuccessful = output.ExitCode, False
+            stream.ErrorData = output.ErrorData or stream.ErrorData
+
+    return CommonStream(producer, lines=False)
+
+
+def _exec_out(device_id: str, args: list) -> CommonStream:
+    if SOCKET_TRANSPORT:
+        def producer(stream: CommonStream):
+            try:
+                yield from smart_socket.exec_out(device_id, args)
+                stream.ExitCode = 0
+                stream.IsSuccessful = True
+            except GeneratorExit:
+                raise
+            except BaseException as error:
+                logging.error(error)
+                token = CancellationToken.current()
+                stream.ErrorData = token.reason if token and token.cancelled else str(error)
+
+        return CommonStream(producer, lines=False)
+    return StreamingProcess([ADB_PATH, Parameter.DEVICE, device_id, Parameter.EXEC_OUT] + args, lines=False)
+
+
+def exec_in(device_id: str, args: list, producer: callable) -> CommonResponse:
+    """
+    Runs the command with the data of 'producer' as its input, 'producer' is called with a 'write(data)' function.
+    Exit code and error output are the ones of the command on the device
+    """
+    command, marker = status_command(' '.join(args))
+    response = _exec_in(device_id, [command], producer)
+    if not response.IsSuccessful:
+        return response
+    result = CommonResponse()
+    output = b''.join(strip_status([(response.OutputData or '').encode()], marker, result))
+    result.OutputData = output.decode(encoding='utf-8', errors='replace')
+    return result
+
+
+def _exec_in(device_id: str, args: list, producer: callable) -> CommonResponse:
+    if SOCKET_TRANSPORT:
+        return smart_socket.exec_in(device_id, args, producer)
+    arguments = [ADB_PATH, Parameter.DEVICE, device_id, Parameter.EXEC_IN] + args
+    try:
+        process = subprocess.Popen(arguments, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return CommonResponse(error="Command '%s' failed! File (command) '%s' not found!" % (
+            ' '.join(arguments), arguments[0]
+        ))
+
+    unregister = CancellationToken.on_cancel(process.kill)
+    try:
+        try:
+            producer(process.stdin.write)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass  # The process exited, its error is read below
+        data, error = process.communicate()
+    finally:
+        unregister()
+    token = CancellationToken.current()
+    if token and token.cancelled:
+        return CommonResponse(error=token.reason, exit_code=process.returncode)
+    return CommonResponse(
+        output=data.decode(encoding='utf-8', errors='replace'),
+        error=error.decode(encoding='utf-8', errors='replace'),
+        exit_code=process.returncode
+    )
+
+
 def file_list(device_id: str, path: str):
     return CommonProcess([ADB_PATH, Parameter.DEVICE, device_id, ShellCommand.LS, path])
 
@@ -0,0 +1,119 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import asyncio
+import logging
+
+from app.helpers.tools import CommonResponse
+from app.services import smart_socket
+from app.services.adb import ADB_PATH, SOCKET_TRANSPORT, Parameter
+
+
+async def run(arguments: list, stdout_callback: callable = None, timeout: float = None) -> CommonResponse:
+    """
+    Async version of CommonProcess, the process is killed when the task is cancelled or timed out
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *arguments, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        return CommonResponse(error="Command '%s' failed! File (command) '%s' not found!" %
+                                    (' '.join(arguments), arguments[0]))
+
+    async def communicate():
+        if stdout_callback:
+            lines = []
+            async for line in process.stdout:
+                stdout_callback(line.decode(encoding='utf-8'))
+                lines.append(line)
+            return b''.join(lines), await process.stderr.read()
+        return await process.communicate()
+
+    try:
+        data, error = await asyncio.wait_for(communicate(), timeout or None)
+        await process.wait()
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return CommonResponse(error='Operation timed out', exit_code=process.returncode)
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    return CommonResponse(
+        output=data.decode(encoding='utf-8') if data else None,
+        error=error.decode(encoding='utf-8') if error else None,
+        exit_code=process.returncode
+    )
+
+
+class AsyncAdbConnection:
+    """
+    Async version of smart_socket.AdbConnection (asyncio streams)
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+
+    async def __aenter__(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            smart_socket.ADB_SERVER_HOST, smart_socket.ADB_SERVER_PORT
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError as error:
+            logging.error(error)
+
+    async def send(self, request: str):
+        data = request.encode(encoding='utf-8')
+        self.writer.write(b'%04x' % len(data) + data)
+        await self.writer.drain()
+        status = await self.reader.readexactly(4)
+        if status == b'FAIL':
+            raise smart_socket.AdbServerError(await self.read_string())
+        if status != b'OKAY':
+            raise smart_socket.AdbServerError('Unexpected response from ADB server: %s' % status)
+
+    async def transport(self, serial: str):
+        await self.send('host:transport:%s' % serial)
+
+    async def read(self, size: int) -> bytes:
+        return await self.reader.readexactly(size)
+
+    async def read_string(self) -> str:
+        length = int(await self.read(4), 16)
+        return (await self.read(length)).decode(encoding='utf-8')
+
+
+async def _host(request: str, prefix: str = '') -> CommonResponse:
+    try:
+        async with AsyncAdbConnection() as connection:
+            await connection.send(request)
+            return CommonResponse(output=prefix + await connection.read_string(), exit_code=0)
+    except (OSError, asyncio.IncompleteReadError, smart_socket.AdbServerError) as error:
+        logging.error(error)
+        return CommonResponse(error=str(error), exit_code=1)
+
+
+async def devices() -> CommonResponse:
+    if SOCKET_TRANSPORT:
+        return await _host('host:devices-l', prefix='List of devices attached\n')
+    return await run([ADB_PATH, Parameter.DEVICES, Parameter.DEVICES_LONG])
+
+
+async def connect(device_id: str) -> CommonResponse:
+    if SOCKET_TRANSPORT:
+        return await _host('host:connect:%s' % device_id)
+    return await run([ADB_PATH, Parameter.CONNECT, device_id])
+
+
+async def disconnect() -> CommonResponse:
+    if SOCKET_TRANSPORT:
+        return await _host('host:disconnect:')
+    return await run([ADB_PATH, Parameter.DISCONNECT])
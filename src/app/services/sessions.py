@@ -0,0 +1,223 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import logging
+import queue
+import shlex
+import subprocess
+import threading
+import uuid
+
+from app.helpers.tools import CommonResponse, CommonStream, CancellationToken, STREAM_BUFFER_SIZE
+
+
+class ShellSession:
+    """
+    ShellSession - long-lived `adb -s <device_id> shell` process.
+    Commands are written to stdin, both output streams of a command are terminated with sentinel lines:
+    stderr -- '<sentinel>:ERR'
+    stdout -- '<sentinel>:OUT <exit code>'
+    Old devices (without shell protocol) merge stderr into stdout, then stderr is a part of the output.
+    Commands are run by 'command eval', so a command with a syntax error (e.g. an unbalanced quote) fails alone
+    and doesn't leave the shell waiting for the rest of it. Every command runs in a subshell: its 'cd', variables,
+    'set', 'trap' or 'exit' don't reach the next commands, as with a separate `adb shell`
+    """
+
+    def __init__(self, adb_path: str, device_id: str, generation: int = 0):
+        self.merged = False
+        self.timeout = None
+        self.error = None
+        self.exit_code = None
+        self.device_id = device_id
+        self.generation = generation
+        self.sentinel = '__ADB_FILE_EXPLORER_%s__' % uuid.uuid4().hex
+        self.process = subprocess.Popen(
+            [adb_path, '-s', device_id, 'shell'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self.stdout = queue.Queue()
+        self.stderr = queue.Queue()
+        self.__start_reader(self.process.stdout, self.stdout)
+        self.__start_reader(self.process.stderr, self.stderr)
+
+    @staticmethod
+    def __start_reader(stream, lines: queue.Queue):
+        def read():
+            for line in iter(stream.readline, b''):
+                lines.put(line)
+            lines.put(None)  # EOF - session is dead
+
+        threading.Thread(target=read, daemon=True).start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stream(self, command: str, timeout: float = None):
+        """
+        Yields output lines (bytes) of the command, then sets 'exit_code' and 'error' of the session.
+        Raises TimeoutError if no line arrives in 'timeout' seconds (None - no limit), the session is unusable then
+        """
+        self.error = None
+        self.exit_code = None
+        self.timeout = timeout
+        # Only shell builtins are used for framing, so no extra processes are spawned on the device
+        script = '( command eval %s\n) </dev/null\n' \
+                 '__code=$?\n' \
+                 'echo >&2; echo "%s:ERR" >&2\n' \
+                 'echo; echo "%s:OUT $__code"\n' % (shlex.quote(command), self.sentinel, self.sentinel)
+        self.process.stdin.write(script.encode(encoding='utf-8'))
+        self.process.stdin.flush()
+
+        # Every sentinel is printed after an extra new line, so the last line is held until the next one arrives
+        held = None
+        out = ('%s:OUT' % self.sentinel).encode(encoding='utf-8')
+        err = ('%s:ERR' % self.sentinel).encode(encoding='utf-8')
+        while True:
+            line = self.__next_line(self.stdout)
+            if line.startswith(err):
+                self.merged = True
+                held = held[:-1] if held else None
+            elif line.startswith(out):
+                if held and held[:-1]:
+                    yield held[:-1]
+                code = line[len(out):].strip()
+                self.exit_code = int(code) if code.isdigit() else None
+                break
+            else:
+                if held:
+                    yield held
+                held = line
+
+        if not self.merged:
+            self.error = self.__read_error() or None
+
+    def __read_error(self) -> str:
+        data = []
+        err = ('%s:ERR' % self.sentinel).encode(encoding='utf-8')
+        while True:
+            line = self.__next_line(self.stderr)
+            if line.startswith(err):
+                if data:
+                    data[-1] = data[-1][:-1]
+                return b''.join(data).decode(encoding='utf-8')
+            data.append(line)
+
+    def __next_line(self, lines: queue.Queue) -> bytes:
+        try:
+            line = lines.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError('Shell session of device %s does not respond' % self.device_id)
+        if line is None:
+            raise BrokenPipeError('Shell session of device %s closed unexpectedly' % self.device_id)
+        return line
+
+    def close(self):
+        try:
+            if self.alive:
+                self.process.stdin.close()
+                self.process.terminate()
+        except BaseException as error:
+            logging.error(error)
+
+
+class ShellSessionPool:
+    """
+    ShellSessionPool - keeps up to 'size' ShellSessions per device.
+    A session serves one command at a time, idle sessions are reused by the next commands.
+    Commands outside of workers (without cancellation token) wait for every output line at most 'timeout' seconds,
+    a session which doesn't respond is killed and discarded
+    """
+
+    __lock = threading.Condition()
+    __idle = {}
+    __count = {}
+    __generation = 0  # Sessions of an older generation were checked out when the pool was closed
+
+    @classmethod
+    def execute(cls, adb_path: str, device_id: str, args: list, size: int, timeout: float = None) -> CommonResponse:
+        stream = cls.stream(adb_path, device_id, args, size, timeout=timeout)
+        output = stream.read()
+        return CommonResponse(output=output, error=stream.ErrorData, exit_code=stream.ExitCode)
+
+    @classmethod
+    def stream(cls, adb_path: str, device_id: str, args: list, size: int,
+               lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE, timeout: float = None) -> CommonStream:
+        def producer(stream: CommonStream):
+            completed = False
+            session = None
+            try:
+                session = cls.__acquire(adb_path, device_id, size)
+                unregister = CancellationToken.on_cancel(session.close)
+                try:
+                    # Cancellation token closes the session itself (on cancel or at its deadline)
+                    yield from session.stream(' '.join(args), None if CancellationToken.current() else timeout)
+                finally:
+                    unregister()
+                completed = True
+                stream.ExitCode = session.exit_code
+                stream.IsSuccessful = session.exit_code == 0
+                stream.ErrorData = session.error
+            except Exception as error:
+                logging.error(error)
+                token = CancellationToken.current()
+                stream.ErrorData = token.reason if token and token.cancelled else str(error)
+            finally:
+                # Session with unread output (error or stopped iteration) cannot be reused
+                if session and completed:
+                    cls.__release(session)
+                elif session:
+                    cls.__discard(session)
+
+        return CommonStream(producer, lines, buffer_size)
+
+    @classmethod
+    def __acquire(cls, adb_path: str, device_id: str, size: int) -> ShellSession:
+        with cls.__lock:
+            while True:
+                sessions = cls.__idle.setdefault(device_id, [])
+                while sessions:
+                    session = sessions.pop()
+                    if session.alive:
+                        return session
+                    cls.__count[device_id] -= 1
+                if cls.__count.get(device_id, 0) < size:
+                    cls.__count[device_id] = cls.__count.get(device_id, 0) + 1
+                    generation = cls.__generation
+                    break
+                cls.__lock.wait()
+        try:
+            return ShellSession(adb_path, device_id, generation)
+        except BaseException:
+            with cls.__lock:
+                if generation == cls.__generation:
+                    cls.__count[device_id] -= 1
+                cls.__lock.notify()
+            raise
+
+    @classmethod
+    def __release(cls, session: ShellSession):
+        with cls.__lock:
+            if session.generation == cls.__generation:
+                cls.__idle.setdefault(session.device_id, []).append(session)
+                cls.__lock.notify()
+                return
+        session.close()  # The pool was closed while the session was checked out, it's not counted anymore
+
+    @classmethod
+    def __discard(cls, session: ShellSession):
+        session.close()
+        with cls.__lock:
+            if session.generation == cls.__generation:
+                cls.__count[session.device_id] = max(cls.__count.get(session.device_id, 1) - 1, 0)
+            cls.__lock.notify()
+
+    @classmethod
+    def close(cls):
+        with cls.__lock:
+            for sessions in cls.__idle.values():
+                for session in sessions:
+                    session.close()
+            cls.__idle.clear()
+            cls.__count.clear()
+            cls.__generation += 1
+            cls.__lock.notify_all()
@@ -0,0 +1,534 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import logging
+import os
+import posixpath
+import socket
+import stat
+import struct
+import time
+import uuid
+from collections import namedtuple
+from typing import Union
+
+from app.helpers.tools import CommonResponse, CommonStream, CancellationToken, STREAM_BUFFER_SIZE
+
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT') or 5037)
+
+SYNC_DATA_MAX = 64 * 1024
+
+_features = {}
+
+SyncEntry = namedtuple('SyncEntry', ['mode', 'size', 'mtime', 'name', 'uid', 'gid', 'target_mode'])
+
+
+class AdbServerError(Exception):
+    pass
+
+
+class AdbConnection:
+    """
+    AdbConnection - single connection to the ADB server (smart socket protocol).
+    Every request is prefixed with its length (4 hex digits), server replies with 'OKAY' or 'FAIL' + message.
+    After 'host:transport:<serial>' the connection is forwarded to the device service requested next
+    """
+
+    def __init__(self, host: str = None, port: int = None):
+        if CancellationToken.current():
+            CancellationToken.current().check()
+        self.socket = socket.create_connection((host or ADB_SERVER_HOST, port or ADB_SERVER_PORT))
+        self.__unregister = CancellationToken.on_cancel(self.__abort)
+
+    def __abort(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.__unregister()
+        try:
+            self.socket.close()
+        except OSError as error:
+            logging.error(error)
+
+    def send(self, request: str):
+        data = request.encode(encoding='utf-8')
+        self.socket.sendall(b'%04x' % len(data) + data)
+        self.check_status()
+
+    def check_status(self):
+        status = self.read(4)
+        if status == b'FAIL':
+            raise AdbServerError(self.read_string())
+        if status != b'OKAY':
+            raise AdbServerError('Unexpected response from ADB server: %s' % status)
+
+    def transport(self, serial: str):
+        self.send('host:transport:%s' % serial)
+
+    def read(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('ADB server closed the connection')
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_string(self) -> str:
+        length = int(self.read(4), 16)
+        return self.read(length).decode(encoding='utf-8')
+
+    def read_stream(self):
+        for chunk in iter(lambda: self.socket.recv(SYNC_DATA_MAX), b''):
+            yield chunk
+
+    def read_all(self) -> bytes:
+        return b''.join(self.read_stream())
+
+
+class SyncConnection:
+    """
+    SyncConnection - 'sync:' service of the device (file transfer protocol).
+    Every packet is 4 bytes ID + 4 bytes little-endian length (or value) + data
+    """
+
+    STAT_V2 = '<4sIQQIIIIQqqq'
+    DENT_V2 = '<4sIQQIIIIQqqqI'
+
+    def __init__(self, serial: str):
+        self.connection = AdbConnection()
+        try:
+            self.v2 = 'stat_v2' in features(serial)
+            self.ls_v2 = 'ls_v2' in features(serial)
+            self.connection.transport(serial)
+            self.connection.send('sync:')
+        except BaseException:
+            self.connection.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        try:
+            self.__send(b'QUIT', b'')
+        except OSError:
+            pass
+        self.connection.close()
+
+    def __send(self, command: bytes, data: bytes):
+        self.connection.socket.sendall(command + struct.pack('<I', len(data)) + data)
+
+    def __fail(self, length: int):
+        raise AdbServerError(self.connection.read(length).decode(encoding='utf-8'))
+
+    def stat(self, path: str) -> (int, int, int):
+        self.__send(b'STAT', path.encode(encoding='utf-8'))
+        command, mode, size, mtime = struct.unpack('<4sIII', self.connection.read(16))
+        if command != b'STAT':
+            raise AdbServerError('Unexpected sync response: %s' % command)
+        return mode, size, mtime
+
+    def stat_v2(self, path: str, follow_links: bool = True) -> SyncEntry:
+        self.__send(b'STA2' if follow_links else b'LST2', path.encode(encoding='utf-8'))
+        data = struct.unpack(self.STAT_V2, self.connection.read(struct.calcsize(self.STAT_V2)))
+        command, error, _, _, mode, _, uid, gid, size, _, mtime, _ = data
+        if command not in (b'STA2', b'LST2'):
+            raise AdbServerError('Unexpected sync response: %s' % command)
+        if error:
+            raise AdbServerError("%s: %s" % (path, os.strerror(error)))
+        return SyncEntry(mode, size, mtime, posixpath.basename(path), uid, gid, None)
+
+    def list_v2(self, path: str):
+        self.__send(b'LIS2', path.encode(encoding='utf-8'))
+        while True:
+            data = struct.unpack(self.DENT_V2, self.connection.read(struct.calcsize(self.DENT_V2)))
+            command, error, _, _, mode, _, uid, gid, size, _, mtime, _, length = data
+            if command == b'DONE':
+                return
+            if command != b'DNT2':
+                raise AdbServerError('Unexpected sync response: %s' % command)
+            name = self.connection.read(length).decode(encoding='utf-8')
+            if not error:
+                yield SyncEntry(mode, size, mtime, name, uid, gid, None)
+
+    def entry(self, path: str) -> SyncEntry:
+        """
+        Entry of the path (not following links), links contain the mode of their target
+        """
+        if self.v2:
+            entry = self.stat_v2(path, follow_links=False)
+        else:
+            mode, size, mtime = self.stat(path)
+            if mode == 0:
+                raise AdbServerError("%s: No such file or directory" % path)
+            entry = SyncEntry(mode, size, mtime, posixpath.basename(path), None, None, None)
+        return self.__resolve(path, entry)
+
+    def entries(self, path: str) -> list:
+        """
+        Entries of the directory (without '.' and '..'), links contain the mode of their target
+        """
+        if self.ls_v2:
+            entries = list(self.list_v2(path))
+        else:
+            entries = [SyncEntry(*entry, None, None, None) for entry in self.list(path)]
+        return [
+            self.__resolve(posixpath.join(path, entry.name), entry)
+            for entry in entries if entry.name not in ('.', '..')
+        ]
+
+    def __resolve(self, path: str, entry: SyncEntry) -> SyncEntry:
+        if not stat.S_ISLNK(entry.mode):
+            return entry
+        try:
+            if self.v2:
+                return entry._replace(target_mode=self.stat_v2(path).mode)
+            # Without 'stat_v2' only a directory link can be listed with a trailing slash
+            return entry._replace(target_mode=stat.S_IFDIR if list(self.list(path + '/')) else stat.S_IFREG)
+        except AdbServerError:
+            return entry
+
+    def list(self, path: str):
+        self.__send(b'LIST', path.encode(encoding='utf-8'))
+        while True:
+            command, mode, size, mtime, length = struct.unpack('<4sIIII', self.connection.read(20))
+            if command == b'DONE':
+                return
+            if command == b'FAIL':
+                self.__fail(mode)
+            if command != b'DENT':
+                raise AdbServerError('Unexpected sync response: %s' % command)
+            yield mode, size, mtime, self.connection.read(length).decode(encoding='utf-8')
+
+    def recv(self, path: str):
+        self.__send(b'RECV', path.encode(encoding='utf-8'))
+        while True:
+            command, length = struct.unpack('<4sI', self.connection.read(8))
+            if command == b'DONE':
+                return
+            if command == b'FAIL':
+                self.__fail(length)
+            if command != b'DATA':
+                raise AdbServerError('Unexpected sync response: %s' % command)
+            yield self.connection.read(length)
+
+    def send(self, path: str, mode: int, mtime: int, chunks):
+        self.__send(b'SEND', ('%s,%d' % (path, mode)).encode(encoding='utf-8'))
+        for chunk in chunks:
+            self.__send(b'DATA', chunk)
+        self.connection.socket.sendall(b'DONE' + struct.pack('<I', mtime))
+        command, length = struct.unpack('<4sI', self.connection.read(8))
+        if command == b'FAIL':
+            self.__fail(length)
+        if command != b'OKAY':
+            raise AdbServerError('Unexpected sync response: %s' % command)
+
+
+class SyncProgress:
+    """
+    Reports sync transfer progress in the same format as `adb pull/push`: '[ 45%] <path>'
+    """
+
+    def __init__(self, callback: callable):
+        self.callback = callback
+        self.files = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    def file(self, path: str, size: int, chunks):
+        done = 0
+        last = -1
+        for chunk in chunks:
+            done += len(chunk)
+            percent = int(done * 100 / size) if size else 100
+            if self.callback and percent != last:
+                last = percent
+                self.callback('[%3d%%] %s' % (percent, path))
+            yield chunk
+        self.files += 1
+        self.bytes += done
+
+    def summary(self, path: str, action: str) -> str:
+        duration = max(time.time() - self.started, 0.001)
+        return '%s: %d file%s %s. %.1f MB/s (%d bytes in %.3fs)' % (
+            path, self.files, '' if self.files == 1 else 's', action,
+            self.bytes / duration / 1024 / 1024, self.bytes, duration
+        )
+
+
+def set_server(host: str = '127.0.0.1', port: int = 5037):
+    """
+    Address of the ADB server used by every connection (e.g. a local test server), known device features are reset
+    """
+    global ADB_SERVER_HOST, ADB_SERVER_PORT
+    ADB_SERVER_HOST, ADB_SERVER_PORT = host, port
+    _features.clear()
+
+
+def features(serial: str) -> list:
+    if serial not in _features:
+        with AdbConnection() as connection:
+            connection.send('host-serial:%s:features' % serial)
+            _features[serial] = connection.read_string().split(',')
+    return _features[serial]
+
+
+def _error(error: BaseException) -> str:
+    token = CancellationToken.current()
+    return token.reason if token and token.cancelled else str(error)
+
+
+def _host(request: str, prefix: str = '') -> CommonResponse:
+    try:
+        with AdbConnection() as connection:
+            connection.send(request)
+            return CommonResponse(output=prefix + connection.read_string(), exit_code=0)
+    except BaseException as error:
+        logging.error(error)
+        return CommonResponse(error=_error(error), exit_code=1)
+
+
+def version() -> CommonResponse:
+    response = _host('host:version')
+    if response.IsSuccessful:
+        response.OutputData = 'Android Debug Bridge version 1.0.%d' % int(response.OutputData, 16)
+    return response
+
+
+def devices() -> CommonResponse:
+    return _host('host:devices-l', prefix='List of devices attached\n')
+
+
+def connect(device_id: str) -> CommonResponse:
+    return _host('host:connect:%s' % device_id)
+
+
+def disconnect() -> CommonResponse:
+    return _host('host:disconnect:')
+
+
+def kill_server() -> CommonResponse:
+    try:
+        with AdbConnection() as connection:
+            connection.send('host:kill')
+            return CommonResponse(exit_code=0)
+    except BaseException as error:
+        return CommonResponse(error=_error(error), exit_code=1)
+
+
+def shell(device_id: str, args: list) -> CommonResponse:
+    command = ' '.join(args)
+    try:
+        if 'shell_v2' in features(device_id):
+            return _shell_v2(device_id, command)
+        return _shell_v1(device_id, command)
+    except BaseException as error:
+        logging.error(error)
+        return CommonResponse(error=_error(error), exit_code=1)
+
+
+def _shell_v2(device_id: str, command: str) -> CommonResponse:
+    # Shell protocol packets: 1 byte ID + 4 bytes little-endian length + data
+    output, error, exit_code = bytearray(), bytearray(), None
+    with AdbConnection() as connection:
+        connection.transport(device_id)
+        connection.send('shell,v2,raw:%s' % command)
+        while exit_code is None:
+            packet_id, length = struct.unpack('<BI', connection.read(5))
+            data = connection.read(length)
+            if packet_id == 1:
+                output.extend(data)
+            elif packet_id == 2:
+                error.extend(data)
+            elif packet_id == 3:
+                exit_code = data[0]
+    return CommonResponse(
+        output=output.decode(encoding='utf-8'),
+        error=error.decode(encoding='utf-8'),
+        exit_code=exit_code
+    )
+
+
+def shell_stream(device_id: str, args: list, lines: bool = True, buffer_size: int = STREAM_BUFFER_SIZE):
+    def producer(stream: CommonStream):
+        try:
+            if 'shell_v2' not in features(device_id):
+                response = _shell_v1(device_id, ' '.join(args))
+                stream.ExitCode, stream.IsSuccessful = response.ExitCode, response.IsSuccessful
+                stream.ErrorData = response.ErrorData
+                yield (response.OutputData or '').encode(encoding='utf-8')
+                return
+
+            error = bytearray()
+            with AdbConnection() as connection:
+                connection.transport(device_id)
+                connection.send('shell,v2,raw:%s' % ' '.join(args))
+                while stream.ExitCode is None:
+                    packet_id, length = struct.unpack('<BI', connection.read(5))
+                    data = connection.read(length)
+                    if packet_id == 1:
+                        yield data
+                    elif packet_id == 2:
+                        error.extend(data[:buffer_size - len(error)])
+                    elif packet_id == 3:
+                        stream.ExitCode = data[0]
+            stream.IsSuccessful = stream.ExitCode == 0
+            stream.ErrorData = error.decode(encoding='utf-8', errors='replace') or None
+        except Exception as error:
+            logging.error(error)
+            stream.ErrorData = _error(error)
+
+    return CommonStream(producer, lines, buffer_size)
+
+
+def _shell_v1(device_id: str, command: str) -> CommonResponse:
+    # Old devices do not report exit code, it is printed at the end of the output
+    sentinel = '__ADB_FILE_EXPLORER_%s__' % uuid.uuid4().hex
+    with AdbConnection() as connection:
+        connection.transport(device_id)
+        connection.send('shell:%s; __code=$?; echo; echo "%s $__code"' % (command, sentinel))
+        data = connection.read_all().decode(encoding='utf-8')
+    output, _, code = data.rpartition('%s ' % sentinel)
+    return CommonResponse(output=output[:-1], exit_code=int(code) if code.strip().isdigit() else None)
+
+
+def exec_out(device_id: str, args: list):
+    with AdbConnection() as connection:
+        connection.transport(device_id)
+        connection.send('exec:%s' % ' '.join(args))
+        yield from connection.read_stream()
+
+
+def exec_in(device_id: str, args: list, producer: callable) -> CommonResponse:
+    """
+    Runs the command with the data of 'producer' as its input, 'producer' is called with a 'write(data)' function.
+    The input is closed when 'producer' returns, then the output of the command is read
+    """
+    try:
+        with AdbConnection() as connection:
+            connection.transport(device_id)
+            connection.send('exec:%s' % ' '.join(args))
+            producer(connection.socket.sendall)
+            connection.socket.shutdown(socket.SHUT_WR)
+            output = connection.read_all().decode(encoding='utf-8', errors='replace')
+        return CommonResponse(output=output, exit_code=0)
+    except BaseException as error:
+        logging.error(error)
+        return CommonResponse(error=_error(error), exit_code=1)
+
+
+def file_list(device_id: str, path: str) -> list:
+    with SyncConnection(device_id) as sync:
+        return sync.entries(path)
+
+
+def file(device_id: str, path: str) -> SyncEntry:
+    with SyncConnection(device_id) as sync:
+        return sync.entry(path)
+
+
+def pull(device_id: str, source_path: Union[str, list], destination_path: str, stdout_callback: callable,
+         preserve_timestamp: bool = False) -> CommonResponse:
+    """
+    Pulls one or many sources in one sync session. Like `adb pull`, missing sources are reported and skipped
+    """
+    sources = [source_path] if isinstance(source_path, str) else source_path
+    output, errors = [], []
+    try:
+        with SyncConnection(device_id) as sync:
+            for source in sources:
+                mode, _, _ = sync.stat(source)
+                if mode == 0:
+                    errors.append("adb: error: remote object '%s' does not exist" % source)
+                    continue
+                destination = destination_path
+                if os.path.isdir(destination):
+                    destination = os.path.join(destination, posixpath.basename(posixpath.normpath(source)))
+                progress = SyncProgress(stdout_callback)
+                _pull(sync, progress, source, destination, preserve_timestamp)
+                output.append(progress.summary(source, 'pulled'))
+    except BaseException as error:
+        logging.error(error)
+        errors.append(_error(error))
+    return CommonResponse(output='\n'.join(output), error='\n'.join(errors), exit_code=1 if errors else 0)
+
+
+def _pull(sync: SyncConnection, progress: SyncProgress, source: str, destination: str, preserve_timestamp: bool):
+    mode, size, mtime = sync.stat(source)
+    if stat.S_ISLNK(mode):
+        # 'STAT' does not follow links, directory links can be listed with a trailing slash
+        entries = list(sync.list(source.rstrip('/') + '/'))
+        if len(entries) > 0:
+            mode = stat.S_IFDIR
+
+    if stat.S_ISDIR(mode):
+        os.makedirs(destination, exist_ok=True)
+        for _, _, _, name in list(sync.list(source)):
+            if name in ('.', '..'):
+                continue
+            _pull(
+                sync, progress,
+                posixpath.join(source, name), os.path.join(destination, name),
+                preserve_timestamp
+            )
+    else:
+        with open(destination, 'wb') as file:
+            for chunk in progress.file(source, size, sync.recv(source)):
+                file.write(chunk)
+
+    if preserve_timestamp:
+        os.utime(destination, (mtime, mtime))
+
+
+def push(device_id: str, source_path: Union[str, list], destination_path: str,
+         stdout_callback: callable) -> CommonResponse:
+    """
+    Pushes one or many sources into the 'destination_path' directory in one sync session
+    """
+    sources = [source_path] if isinstance(source_path, str) else source_path
+    output, errors = [], []
+    try:
+        with SyncConnection(device_id) as sync:
+            for source in sources:
+                if not os.path.exists(source):
+                    errors.append("adb: error: cannot stat '%s': No such file or directory" % source)
+                    continue
+                progress = SyncProgress(stdout_callback)
+                destination = posixpath.join(destination_path, os.path.basename(os.path.normpath(source)))
+                _push(device_id, sync, progress, source, destination)
+                output.append(progress.summary(source, 'pushed'))
+    except BaseException as error:
+        logging.error(error)
+        errors.append(_error(error))
+    return CommonResponse(output='\n'.join(output), error='\n'.join(errors), exit_code=1 if errors else 0)
+
+
+def _push(device_id: str, sync: SyncConnection, progress: SyncProgress, source: str, destination: str):
+    if os.path.isdir(source):
+        names = os.listdir(source)
+        if not names:
+            # 'SEND' creates parent directories only, empty directories are created separately
+            response = shell(device_id, ['mkdir', '-p', "'%s'" % destination.replace("'", "'\\''")])
+            if not response.IsSuccessful:
+                raise AdbServerError(response.ErrorData or response.OutputData)
+        for name in names:
+            _push(device_id, sync, progress, os.path.join(source, name), posixpath.join(destination, name))
+        return
+
+    info = os.stat(source)
+    with open(source, 'rb') as file:
+        chunks = iter(lambda: file.read(SYNC_DATA_MAX), b'')
+        sync.send(destination, info.st_mode, int(info.st_mtime), progress.file(destination, info.st_size, chunks))
@@ -0,0 +1,55 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+"""
+Parsing speed of `ls -a -l` listings (lines/sec) for the formats of tests/data/ls:
+python tests/bench_ls.py [lines]
+
+Listings are generated from the lines of the corpus with random dates (the worst case for the date cache),
+the time includes construction of the File objects
+"""
+import os
+import random
+import re
+import sys
+import time
+
+import conftest
+from app.helpers.converters import iterate_file_list_a
+
+DATES = {
+    'toybox': lambda rnd: '%04d-%02d-%02d %02d:%02d' % (
+        rnd.randint(2015, 2022), rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59)
+    ),
+    'toolbox': lambda rnd: '%04d-%02d-%02d %02d:%02d' % (
+        rnd.randint(2010, 2015), rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59)
+    ),
+    'busybox': lambda rnd: '%s %2d  %d' % (
+        rnd.choice(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']),
+        rnd.randint(1, 28), rnd.randint(2010, 2022)
+    ),
+}
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}|[A-Z][a-z]{2} [ \d]\d (?: \d{4}|\d{2}:\d{2})')
+
+
+def generate(name: str, count: int) -> str:
+    rnd = random.Random(count)
+    with open(os.path.join(conftest.DATA, 'ls', '%s.txt' % name)) as file:
+        lines = [line for line in file.read().splitlines() if DATE_PATTERN.search(line)]
+    result = []
+    for index in range(count):
+        line = DATE_PATTERN.sub(DATES[name](rnd), lines[index % len(lines)], count=1)
+        result.append(re.sub(r' \.\.?$', ' file%d' % index, line))  # '.' and '..' are not skipped
+    return '\n'.join(result)
+
+
+def main(count: int):
+    for name in DATES:
+        data = generate(name, count)
+        started = time.perf_counter()
+        files = sum(1 for _ in iterate_file_list_a(data, path='/sdcard/'))
+        duration = time.perf_counter() - started
+        print('%-8s %d lines, %d files: %.2f s, %d lines/s' % (name, count, files, duration, count / duration))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
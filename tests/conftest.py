@@ -0,0 +1,11 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'tests', 'data')
+
+# The application is imported as in run.sh: 'app' package from 'src', its modules from 'src/app'
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'src', 'app')]
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
@@ -0,0 +1,190 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import os
+import socketserver
+import struct
+import subprocess
+import threading
+
+SERIAL = 'emulator-5554'
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """
+    FakeAdbServer - local ADB server (smart socket protocol) with one device, for the tests.
+    Shell commands of the device run in the local 'sh' (in 'root'), the sync service serves the local files
+
+    Keyword arguments:
+    root -- working directory of the device shell
+    features -- features of the device ('shell_v2', 'stat_v2', 'ls_v2')
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, root: str, features: tuple = ('shell_v2', 'cmd', 'stat_v2', 'ls_v2')):
+        super(FakeAdbServer, self).__init__(('127.0.0.1', 0), FakeAdbHandler)
+        self.root = root
+        self.features = features
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    STAT_V2 = '<4sIQQIIIIQqqq'
+
+    def read(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def okay(self, payload: bytes = None):
+        self.request.sendall(b'OKAY' + (b'%04x' % len(payload) + payload if payload is not None else b''))
+
+    def handle(self):
+        try:
+            while True:
+                request = self.read(int(self.read(4), 16)).decode()
+                self.server.requests.append(request)
+                if request == 'host:version':
+                    return self.okay(b'0029')
+                if request == 'host:devices-l':
+                    return self.okay(b'%s\tdevice product:fake model:Fake_Phone device:fake\n' % SERIAL.encode())
+                if request == 'host-serial:%s:features' % SERIAL:
+                    return self.okay(','.join(self.server.features).encode())
+                if request == 'host:transport:%s' % SERIAL:
+                    self.okay()
+                    continue
+                if request.startswith('shell,v2,raw:'):
+                    self.okay()
+                    return self.shell_v2(request[len('shell,v2,raw:'):])
+                if request.startswith('shell:'):
+                    self.okay()
+                    return self.shell_v1(request[len('shell:'):])
+                if request.startswith('exec:'):
+                    self.okay()
+                    return self.exec(request[len('exec:'):])
+                if request == 'sync:':
+                    self.okay()
+                    return self.sync()
+                message = ('unknown request: %s' % request).encode()
+                return self.request.sendall(b'FAIL%04x' % len(message) + message)
+        except (EOFError, ConnectionError):
+            pass
+
+    def shell_v2(self, command: str):
+        process = subprocess.run(['sh', '-c', command], capture_output=True, cwd=self.server.root)
+        for packet_id, data in ((1, process.stdout), (2, process.stderr)):
+            if data:
+                self.request.sendall(struct.pack('<BI', packet_id, len(data)) + data)
+        self.request.sendall(struct.pack('<BI', 3, 1) + bytes([process.returncode]))
+
+    def shell_v1(self, command: str):
+        # No shell protocol: stderr is merged into stdout, the exit code is not sent
+        process = subprocess.run(
+            ['sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.server.root
+        )
+        self.request.sendall(process.stdout)
+
+    def exec(self, command: str):
+        process = subprocess.Popen(
+            ['sh', '-c', command], stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.server.root
+        )
+
+        def feed():
+            try:
+                for chunk in iter(lambda: self.request.recv(65536), b''):
+                    process.stdin.write(chunk)
+            except OSError:
+                pass
+            finally:
+                process.stdin.close()
+
+        threading.Thread(target=feed, daemon=True).start()
+        for chunk in iter(lambda: process.stdout.read(65536), b''):
+            self.request.sendall(chunk)
+        process.wait()
+
+    def stat_v2(self, packet_id: bytes, path: str, follow_links: bool) -> bytes:
+        try:
+            st = os.stat(path) if follow_links else os.lstat(path)
+        except OSError as error:
+            return struct.pack(self.STAT_V2, packet_id, error.errno, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        return struct.pack(
+            self.STAT_V2, packet_id, 0, st.st_dev, st.st_ino, st.st_mode, st.st_nlink, st.st_uid, st.st_gid,
+            st.st_size, int(st.st_atime), int(st.st_mtime), int(st.st_ctime)
+        )
+
+    def sync(self):
+        while True:
+            command, length = struct.unpack('<4sI', self.read(8))
+            if command == b'QUIT':
+                return
+            path = self.read(length).decode()
+            if command == b'STAT':
+                try:
+                    st = os.lstat(path)
+                    self.request.sendall(struct.pack('<4sIII', b'STAT', st.st_mode, st.st_size, int(st.st_mtime)))
+                except OSError:
+                    self.request.sendall(struct.pack('<4sIII', b'STAT', 0, 0, 0))
+            elif command in (b'STA2', b'LST2'):
+                self.request.sendall(self.stat_v2(command, path, command == b'STA2'))
+            elif command in (b'LIST', b'LIS2'):
+                self.list(command, path)
+            elif command == b'RECV':
+                try:
+                    with open(path, 'rb') as file:
+                        for chunk in iter(lambda: file.read(65536), b''):
+                            self.request.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+                    self.request.sendall(b'DONE\0\0\0\0')
+                except OSError as error:
+                    message = str(error).encode()
+                    self.request.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+            elif command == b'SEND':
+                path, _, _ = path.rpartition(',')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as file:
+                    while True:
+                        packet_id, length = struct.unpack('<4sI', self.read(8))
+                        if packet_id == b'DONE':
+                            break
+                        file.write(self.read(length))
+                os.utime(path, (length, length))
+                self.request.sendall(b'OKAY\0\0\0\0')
+
+    def list(self, command: bytes, path: str):
+        try:
+            names = ['.', '..'] + sorted(os.listdir(path))
+        except OSError:
+            names = []
+        for name in names:
+            st = os.lstat(os.path.join(path, name))
+            encoded = name.encode()
+            if command == b'LIST':
+                self.request.sendall(
+                    struct.pack('<4sIIII', b'DENT', st.st_mode, st.st_size, int(st.st_mtime), len(encoded)) + encoded
+                )
+            else:
+                self.request.sendall(
+                    self.stat_v2(b'DNT2', os.path.join(path, name), False) + struct.pack('<I', len(encoded)) + encoded
+                )
+        if command == b'LIST':
+            self.request.sendall(struct.pack('<4sIIII', b'DONE', 0, 0, 0, 0))
+        else:
+            self.request.sendall(struct.pack(self.STAT_V2 + 'I', b'DONE', 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
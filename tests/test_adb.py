@@ -0,0 +1,78 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.managers import ADBManager
+from app.data.models import TransferMode
+from app.data.repositories import android_adb
+from app.helpers.tools import CommonResponse
+from app.services import adb, smart_socket
+from fake_adb import FakeAdbServer, SERIAL
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(adb, 'SOCKET_TRANSPORT', True)
+    with FakeAdbServer(str(tmp_path)) as server:
+        smart_socket.set_server('127.0.0.1', server.port)
+        yield server
+
+
+@pytest.mark.parametrize('size', [1, 5, 100])
+def test_strip_status(size):
+    # The marker can be split between the chunks
+    data = b'\0binary\n' * 10 + b'__status_x__' + b'warning\nerror\n2'
+    response = CommonResponse()
+    chunks = [data[index:index + size] for index in range(0, len(data), size)]
+    assert b''.join(adb.strip_status(chunks, b'__status_x__', response)) == b'\0binary\n' * 10
+    assert (response.ExitCode, response.IsSuccessful, response.ErrorData) == (2, False, 'warning\nerror')
+
+
+def test_strip_status_missing():
+    response = CommonResponse()
+    assert b''.join(adb.strip_status([b'partial', b' output'], b'__status_x__', response)) == b'partial output'
+    assert not response.IsSuccessful and response.ErrorData
+
+
+def test_exec_out_status(server):
+    stream = adb.exec_out(SERIAL, ['printf', "'a\\0b'", '|', 'cat'])
+    assert b''.join(stream.chunks()) == b'a\0b'
+    assert (stream.ExitCode, stream.IsSuccessful, stream.ErrorData) == (0, True, None)
+
+    # Unreadable files of `tar -c` are not silently left out
+    stream = adb.exec_out(SERIAL, ['echo', 'partial;', 'cat', '/missing'])
+    assert b''.join(stream.chunks()) == b'partial\n'
+    assert stream.ExitCode == 1 and not stream.IsSuccessful and '/missing' in stream.ErrorData
+
+
+def test_exec_in_status(server, tmp_path):
+    response = adb.exec_in(SERIAL, ['cat', '>', 'input.txt'], lambda write: write(b'data'))
+    assert response.IsSuccessful and (tmp_path / 'input.txt').read_bytes() == b'data'
+
+    # Failing `tar -x` (e.g. no space left) fails the upload
+    response = adb.exec_in(SERIAL, ['cat', '>', 'missing/input.txt'], lambda write: write(b'data'))
+    assert not response.IsSuccessful and response.ErrorData
+
+
+@pytest.mark.parametrize('name', ['folder', 'link'])
+def test_download_tar_of_linked_folder(server, tmp_path_factory, monkeypatch, name):
+    # Linked folders (e.g. /sdcard) are downloaded as their target, as `adb pull` does
+    device = tmp_path_factory.mktemp('device')
+    (device / 'folder' / 'sub').mkdir(parents=True)
+    (device / 'folder' / 'a.txt').write_bytes(b'a')
+    (device / 'folder' / 'sub' / 'b.txt').write_bytes(b'bb')
+    os.symlink(str(device / 'folder'), str(device / 'link'))
+    monkeypatch.setattr(ADBManager, 'get_device', classmethod(lambda cls: SimpleNamespace(id=SERIAL, name='Fake')))
+
+    usage, _ = android_adb.FileRepository.disk_usage(str(device / name))
+    assert usage is not None and usage[1] == 2
+
+    local = tmp_path_factory.mktemp('local')
+    data, error = android_adb.FileRepository.download(lambda *args: None, str(device / name), str(local),
+                                                      TransferMode.TAR)
+    assert error is None, error
+    assert (local / name / 'a.txt').read_bytes() == b'a' and (local / name / 'sub' / 'b.txt').read_bytes() == b'bb'
+    assert not (local / name).is_symlink()
@@ -0,0 +1,24 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import datetime
+import stat
+
+from app.data.models import FileType
+from app.helpers.converters import convert_to_file_sync
+from app.services.smart_socket import SyncEntry
+
+
+def test_file_sync_v2():
+    entry = SyncEntry(stat.S_IFLNK | 0o777, 7, 1650000000, 'sdcard', 0, 1015, stat.S_IFDIR | 0o771)
+    file = convert_to_file_sync(entry, path='/sdcard')
+    assert (file.name, file.path, file.raw_size, file.owner, file.group) == ('sdcard', '/sdcard', 7, '0', '1015')
+    assert file.permissions == 'lrwxrwxrwx' and file.link_type == FileType.DIRECTORY
+    # Local time, as in the listings of `ls` and in the search results
+    assert file.raw_date == datetime.datetime.fromtimestamp(1650000000)
+
+
+def test_file_sync_v1():
+    # Without 'stat_v2' owners are unknown and the links are not resolved
+    file = convert_to_file_sync(SyncEntry(stat.S_IFREG | 0o660, 3, 0, 'a.txt', None, None, None))
+    assert (file.owner, file.group) == (None, None)
+    assert file.permissions == '-rw-rw----' and file.link_type is None
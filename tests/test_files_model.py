@@ -0,0 +1,37 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import datetime
+
+from app.data.models import File
+from app.gui.explorer.files import FileListModel
+
+
+def files(start: int, count: int) -> list:
+    date = datetime.datetime(2022, 2, 1, 12, 30)
+    return [
+        File(name='%d.jpg' % i, path='/sdcard/DCIM/%d.jpg' % i, size=i, date_time=date, permissions='-rw-rw----',
+             owner='u0_a1', group='media_rw')
+        for i in range(start, start + count)
+    ]
+
+
+def test_pages_over_the_budget_are_packed(monkeypatch):
+    monkeypatch.setattr(FileListModel, 'PAGE_SIZE', 10)
+    monkeypatch.setattr(FileListModel, 'MAX_PAGES', 3)
+    model = FileListModel()
+    model.populate(files(0, 95))
+    # The first pages are kept for the view, the last ones are packed
+    assert list(model.loaded) == [2, 1, 0]
+    assert sum(isinstance(page, bytes) for page in model.pages) == 7
+    assert (model.size, model.rowCount()) == (95, 10)
+
+    # The partial last page is unpacked to be filled
+    model.append(files(95, 20))
+    assert model.size == 115 and len(model.pages) == 12
+
+    for row in (0, 57, 94, 95, 114, 3):
+        file = model.file(row)
+        assert (file.name, file.path, file.raw_size, file.owner) == ('%d.jpg' % row, '/sdcard/DCIM/%d.jpg' % row,
+                                                                     row, 'u0_a1')
+        assert file.raw_date == datetime.datetime(2022, 2, 1, 12, 30) and file.permissions == '-rw-rw----'
+    assert len(model.loaded) == 3 and list(model.loaded)[-2:] == [11, 0]
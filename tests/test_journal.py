@@ -0,0 +1,71 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import threading
+import time
+
+import pytest
+
+from app.core.journal import ResumableDownload, TransferJournal, merge, missing
+from app.helpers.tools import CancellationToken
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    monkeypatch.setattr(TransferJournal, 'filename', str(tmp_path / 'transfers.json'))
+    monkeypatch.setattr(ResumableDownload, 'BLOCK_SIZE', 4)
+    monkeypatch.setattr(ResumableDownload, 'CHUNK_SIZE', 8)
+    return ResumableDownload('device', '/sdcard/file', str(tmp_path / 'file'), 80, 'mtime', lambda *args: None)
+
+
+def test_ranges():
+    assert merge([[8, 16], [0, 8], [20, 24]]) == [[0, 16], [20, 24]]
+    assert missing([[0, 8], [16, 24]], 32) == [[8, 16], [24, 32]]
+
+
+def test_resumed(download, tmp_path):
+    content = bytes(range(80))
+
+    def read(skip: int, count: int):
+        yield content[skip * 4:(skip + count) * 4]
+
+    TransferJournal.update(download.path, dict(device='device', source='/sdcard/file', size=80, mtime='mtime'))
+    download.open().write(0, 40, [content[:40]])
+    message, error = download.run(read, lambda: None, streams=3)
+    assert error is None and 'resumed at 40' in message
+    assert (tmp_path / 'file').read_bytes() == content and TransferJournal.entry(download.path) is None
+
+
+def test_failed_chunk_stops_download(download):
+    # The failure is not kept until the preceding chunks are done, the queued chunks are not read
+    reads = []
+
+    def read(skip: int, count: int):
+        reads.append(skip)
+        if skip == 2:
+            raise OSError('device disconnected')
+        time.sleep(0.5 if skip == 0 else 0.01)
+        yield b'\0' * count * 4
+
+    with pytest.raises(OSError):
+        download.run(read, lambda: None, streams=2)
+    assert len(reads) <= 3 < len(download.chunks())
+
+
+def test_failed_checksum_leaves_download_not_verified(download, tmp_path):
+    def checksum():
+        raise TimeoutError('no output from sha256sum')
+
+    message, error = download.run(lambda skip, count: iter([b'\0' * count * 4]), checksum)
+    assert error is None and 'not verified' in message and (tmp_path / 'file').exists()
+
+
+def test_short_read_stops_checksum(download):
+    stopped = threading.Event()
+
+    def checksum():
+        CancellationToken.current().register(stopped.set)
+        stopped.wait(10)
+
+    message, error = download.run(lambda skip, count: iter([b'\0' * 2]), checksum)
+    assert message is None and 'short read' in error
+    assert stopped.wait(1)
@@ -0,0 +1,85 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import datetime
+import os
+
+import pytest
+
+from app.data.models import FileType
+from app.helpers.converters import __convert_to_date__ as convert_to_date, iterate_file_list_a
+from conftest import DATA
+
+# Listings of `ls -a -l` of toybox (Android 6+), toolbox (older versions) and busybox: name -> (size, date, mode)
+TOYBOX = {
+    'Alarms': (4096, datetime.datetime(2022, 1, 31, 12, 0), 'drwxrwx--x'),
+    'Android': (4096, datetime.datetime(2022, 3, 14, 9, 21), 'drwxrwx--x'),
+    'backup.tar': (1048576, datetime.datetime(2022, 2, 1, 7, 45), '-rw-rw----'),
+    'My  Notes.txt': (12, datetime.datetime(2022, 2, 1, 7, 45), '-rw-rw----'),
+    'a -> b.txt': (0, datetime.datetime(2022, 2, 2, 10, 0), '-rw-rw----'),
+    '2019': (5234880, datetime.datetime(2019, 12, 31, 23, 59), '-rwxr-x---'),
+    'sdcard': (21, datetime.datetime(2022, 1, 1), 'lrwxrwxrwx'),
+    'link to dir': (6, datetime.datetime(2022, 1, 1), 'lrwxrwxrwx'),
+    'null': (3, datetime.datetime(2022, 1, 1), 'crw-rw-rw-'),
+    'mmcblk0': (0, datetime.datetime(2022, 1, 1), 'brw-------'),
+    'fifo': (0, datetime.datetime(2022, 1, 1), 'prw-------'),
+    'socket': (0, datetime.datetime(2022, 1, 1), 'srwxrwxrwx'),
+    'sticky': (4096, datetime.datetime(2022, 1, 1), 'drwxrwx--T'),
+    'su': (10240, datetime.datetime(2022, 1, 1), '-rwsr-sr-x'),
+}
+TOOLBOX = {
+    'Alarms': (0, datetime.datetime(2015, 6, 1, 10, 0), 'drwxrwx---'),
+    'photo 1.jpg': (123456, datetime.datetime(2015, 6, 1, 10, 0), '-rw-rw----'),
+    'empty': (0, datetime.datetime(2015, 6, 2, 11, 15), '-rw-rw----'),
+    'sdcard': (0, datetime.datetime(2015, 6, 1, 10, 0), 'lrwxrwxrwx'),
+    'null': (3, datetime.datetime(2015, 6, 1, 10, 0), 'crw-rw-rw-'),
+}
+BUSYBOX = {
+    'archive.zip': (1048576, datetime.datetime(2020, 3, 1), '-rw-rw----'),
+    'leap day.txt': (12, datetime.datetime(2020, 2, 29), '-rw-rw----'),
+    'recent.txt': (512, None, '-rw-rw----'),  # Date without the year, see test_recent_date
+    'Download': (4096, datetime.datetime(2021, 12, 24), 'drwxrwx---'),
+    'link': (19, datetime.datetime(2021, 12, 24), 'lrwxrwxrwx'),
+    'null': (3, datetime.datetime(2018, 11, 11), 'crw-rw-rw-'),
+}
+LINKS = {'sdcard': '/storage/self/primary', 'link to dir': 'Alarms', 'link': '/storage/emulated/0'}
+
+
+def listing(name: str) -> list:
+    with open(os.path.join(DATA, 'ls', '%s.txt' % name)) as file:
+        return list(iterate_file_list_a(file.read(), path='/sdcard/', dirs={'link to dir'}))
+
+
+@pytest.mark.parametrize('name,expected', [('toybox', TOYBOX), ('toolbox', TOOLBOX), ('busybox', BUSYBOX)])
+def test_listing(name, expected):
+    # '.', '..', 'total' and error lines are skipped
+    files = listing(name)
+    assert [file.name for file in files] == list(expected)
+    for file in files:
+        size, date, permissions = expected[file.name]
+        assert (file.raw_size, file.permissions, file.path) == (size, permissions, '/sdcard/' + file.name)
+        assert date is None or file.raw_date == date
+        if name == 'toolbox' and file.name == 'sdcard':
+            assert file.link == '/storage/emulated/legacy'
+        elif permissions[0] == 'l':
+            assert file.link == LINKS[file.name]
+            assert file.link_type == (FileType.DIRECTORY if file.name == 'link to dir' else FileType.FILE)
+        else:
+            assert file.link is None and file.link_type is None
+
+
+def test_recent_date():
+    # Busybox omits the year of recent files: the current year, the previous one for dates in the future
+    def recent(date: datetime.datetime) -> str:
+        return '%s %2d %s' % (date.strftime('%b'), date.day, date.strftime('%H:%M'))
+
+    now = datetime.datetime.now()
+    past, future = now - datetime.timedelta(days=3), now + datetime.timedelta(days=40)
+    assert convert_to_date(recent(past), now.year) == past.replace(second=0, microsecond=0)
+    assert convert_to_date(recent(future), now.year).year == future.year - 1
+    assert convert_to_date('Jan  5  2019', now.year) == datetime.datetime(2019, 1, 5)
+    assert convert_to_date('2022-01-31 12:00', now.year) == datetime.datetime(2022, 1, 31, 12, 0)
+
+
+def test_recent_leap_day():
+    assert convert_to_date('Feb 29 12:00', 2025) == datetime.datetime(2024, 2, 29, 12, 0)
+    assert convert_to_date('Feb 29 12:00', 2024) == datetime.datetime(2024, 2, 29, 12, 0)
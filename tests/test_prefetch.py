@@ -0,0 +1,60 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import os
+
+import pytest
+
+from app.core import prefetch
+from app.core.prefetch import ListingPrefetcher
+from app.data.models import File
+from app.helpers.converters import convert_to_modified
+from app.services import adb, smart_socket
+from fake_adb import FakeAdbServer, SERIAL
+
+FILES = [File(name='a.jpg', path='/sdcard/DCIM/a.jpg')]
+
+
+def test_modified_in_seconds(tmp_path, monkeypatch):
+    monkeypatch.setattr(adb, 'SOCKET_TRANSPORT', True)
+    (tmp_path / 'folder').mkdir()
+    os.utime(str(tmp_path / 'folder'), (1650000007, 1650000007))
+    with FakeAdbServer(str(tmp_path)) as server:
+        smart_socket.set_server('127.0.0.1', server.port)
+        response = adb.shell(SERIAL, [adb.ShellCommand.MODIFIED % 'folder'])
+    mtime, now = convert_to_modified(response.OutputData)
+    assert mtime == 1650000007 and now > mtime
+    assert convert_to_modified("stat: 'folder': No such file or directory") is None
+
+
+@pytest.fixture
+def device(monkeypatch):
+    listed, stored = [], []
+    files = classmethod(lambda cls, path: listed.append(path) or (FILES, None))
+    monkeypatch.setattr(prefetch.FileRepository, 'files', files)
+    monkeypatch.setattr(prefetch.ListingIndex, 'get', classmethod(lambda cls, device, path: (FILES, '1000')))
+    monkeypatch.setattr(prefetch.ListingCache, 'put', classmethod(lambda cls, *args: stored.append(args)))
+
+    def modified(times):
+        monkeypatch.setattr(prefetch.FileRepository, 'modified', classmethod(lambda cls, path: (times, None)))
+        return listed, stored
+
+    return modified
+
+
+def test_revalidate_unchanged(device):
+    listed, stored = device((1000, 1060))
+    assert ListingPrefetcher.revalidate(SERIAL, '/sdcard/DCIM/', '1000') == (FILES, None)
+    assert not listed and not stored
+
+
+def test_revalidate_changed(device):
+    listed, stored = device((1030, 1060))
+    assert ListingPrefetcher.revalidate(SERIAL, '/sdcard/DCIM/', '1000') == (FILES, None)
+    assert listed == ['/sdcard/DCIM/'] and stored[0][-1] == '1030'
+
+
+def test_revalidate_modified_within_resolution(device):
+    # Files added later in the same second would not change the time: it's not stored, the listing is not trusted
+    listed, stored = device((1000, 1000))
+    ListingPrefetcher.revalidate(SERIAL, '/sdcard/DCIM/', '1000')
+    assert listed == ['/sdcard/DCIM/'] and stored[0][-1] is None
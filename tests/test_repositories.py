@@ -0,0 +1,76 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.configurations import Settings
+from app.core.listings import ListingCache
+from app.core.main import Adb
+from app.data import repositories
+from app.data.models import File, TransferMode
+from app.helpers.tools import CancellationToken
+
+DEVICE = SimpleNamespace(id='emulator-5554')
+
+
+@pytest.fixture
+def device(monkeypatch):
+    monkeypatch.setattr(Settings, 'data', {'listing_cache_ttl': 60, 'listing_cache_memory': 64, 'listing_index': False})
+    manager = SimpleNamespace(get_device=lambda: DEVICE, path=lambda: '/sdcard/')
+    monkeypatch.setattr(Adb, 'core', Adb.EXTERNAL_TOOL_ADB)
+    monkeypatch.setattr(Adb, 'manager', classmethod(lambda cls: manager))
+    yield
+    ListingCache.clear()
+
+
+def test_listing_made_during_a_change_not_cached(device, monkeypatch):
+
+    def new_folder(name):
+        # The folder is listed (or prefetched) while it's made, before the device is changed
+        ListingCache.put(DEVICE.id, '/sdcard/', [File(name='old', path='/sdcard/old')], ListingCache.generation())
+        return None, None
+
+    monkeypatch.setattr(repositories.android_adb.FileRepository, 'new_folder', new_folder)
+    repositories.FileRepository.new_folder('new')
+    assert ListingCache.get(DEVICE.id, '/sdcard/') == (None, False)
+
+
+def test_async_files_and_transfers(device, monkeypatch):
+    calls = []
+
+    def files(path=None, batch_callback=None):
+        batch_callback([File(name='a', path=path + 'a')])
+        return [File(name='a', path=path + 'a')], None
+
+    def upload(progress_callback, source, destination, mode):
+        calls.append((source, destination, mode, CancellationToken.current() is not None))
+        return 'uploaded', None
+
+    monkeypatch.setattr(repositories.android_adb.FileRepository, 'files', files)
+    monkeypatch.setattr(repositories.android_adb.FileRepository, 'upload', upload)
+    ListingCache.put(DEVICE.id, '/sdcard/', [], ListingCache.generation())
+    batches = []
+    result, error = asyncio.run(repositories.AsyncFileRepository.files('/sdcard/', batches.append))
+    assert [file.path for file in result] == ['/sdcard/a'] and error is None and len(batches) == 1
+
+    # Same as the blocking upload: the mode is passed and the destination listing is invalidated
+    result = asyncio.run(repositories.AsyncFileRepository.upload(None, '/tmp/a', None, TransferMode.TAR))
+    assert result == ('uploaded', None) and calls == [('/tmp/a', None, TransferMode.TAR, True)]
+    assert ListingCache.get(DEVICE.id, '/sdcard/') == (None, False)
+
+
+def test_async_cancelled_with_the_coroutine(device, monkeypatch):
+    cancelled = threading.Event()
+
+    def files(path=None, batch_callback=None):
+        CancellationToken.current().register(cancelled.set)
+        cancelled.wait(10)
+        return None, CancellationToken.current().reason
+
+    monkeypatch.setattr(repositories.android_adb.FileRepository, 'files', files)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(repositories.AsyncFileRepository.files('/sdcard/'), 0.2))
+    assert cancelled.wait(1)
@@ -0,0 +1,34 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import pytest
+
+from app.services.sessions import ShellSession
+
+
+@pytest.fixture
+def session(tmp_path):
+    # `adb -s <device> shell` of a device whose shell is the local one
+    adb = tmp_path / 'adb'
+    adb.write_text('#!/bin/sh\nexec sh\n')
+    adb.chmod(0o755)
+    session = ShellSession(str(adb), 'emulator-5554')
+    yield session
+    session.close()
+
+
+def run(session: ShellSession, command: str) -> (bytes, int):
+    output = b''.join(session.stream(command, timeout=10))
+    return output, session.exit_code
+
+
+def test_commands_do_not_change_the_session(session, tmp_path):
+    assert run(session, 'cd %s' % tmp_path) == (b'', 0)
+    assert run(session, 'pwd')[0] != str(tmp_path).encode()
+    assert run(session, '__value=1; set -e; trap "echo trap" EXIT; exit 3') == (b'trap\n', 3)
+    assert run(session, 'echo "[$__value]"; false; echo next') == (b'[]\nnext\n', 0)
+    assert session.alive
+
+
+def test_syntax_error_fails_alone(session):
+    assert run(session, "echo 'unbalanced")[1] != 0
+    assert run(session, 'echo ok') == (b'ok\n', 0)
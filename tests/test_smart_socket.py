@@ -0,0 +1,79 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import os
+import stat
+
+import pytest
+
+from app.services import smart_socket
+from fake_adb import FakeAdbServer, SERIAL
+
+
+@pytest.fixture
+def device(tmp_path):
+    (tmp_path / 'folder').mkdir()
+    (tmp_path / 'folder' / 'file.txt').write_bytes(b'hello\n')
+    os.symlink(str(tmp_path / 'folder'), str(tmp_path / 'link'))
+    return tmp_path
+
+
+def serve(root, features=('shell_v2', 'cmd', 'stat_v2', 'ls_v2')):
+    server = FakeAdbServer(str(root), features)
+    smart_socket.set_server('127.0.0.1', server.port)
+    return server
+
+
+def test_host_requests(device):
+    with serve(device):
+        assert smart_socket.version().OutputData == 'Android Debug Bridge version 1.0.41'
+        response = smart_socket.devices()
+        assert response.IsSuccessful
+        assert response.OutputData.splitlines()[1].startswith(SERIAL)
+
+
+def test_shell_v2(device):
+    with serve(device):
+        response = smart_socket.shell(SERIAL, ['echo', 'out;', 'echo', 'err', '>&2;', 'exit', '3'])
+        assert (response.OutputData, response.ErrorData, response.ExitCode) == ('out\n', 'err\n', 3)
+
+        stream = smart_socket.shell_stream(SERIAL, ['ls', 'folder'])
+        assert [line.strip() for line in stream] == ['file.txt']
+        assert stream.IsSuccessful
+
+
+def test_shell_v1(device):
+    with serve(device, features=()) as server:
+        response = smart_socket.shell(SERIAL, ['echo', 'old;', 'false'])
+        assert (response.OutputData, response.ExitCode) == ('old\n', 1)
+        assert not any(request.startswith('shell,v2') for request in server.requests)
+
+
+@pytest.mark.parametrize('features', [('stat_v2', 'ls_v2'), ()])
+def test_sync_entries(device, features):
+    with serve(device, features):
+        entries = {entry.name: entry for entry in smart_socket.file_list(SERIAL, str(device))}
+        assert set(entries) == {'folder', 'link'}
+        assert stat.S_ISDIR(entries['folder'].mode)
+        assert stat.S_ISLNK(entries['link'].mode) and stat.S_ISDIR(entries['link'].target_mode)
+
+        entry = smart_socket.file(SERIAL, str(device / 'folder' / 'file.txt'))
+        assert (entry.name, entry.size) == ('file.txt', 6)
+
+
+def test_pull_and_push(device, tmp_path_factory):
+    local = tmp_path_factory.mktemp('local')
+    with serve(device):
+        response = smart_socket.pull(SERIAL, [str(device / 'folder'), '/missing'], str(local), None, True)
+        assert (local / 'folder' / 'file.txt').read_bytes() == b'hello\n'
+        assert not response.IsSuccessful and "'/missing' does not exist" in response.ErrorData
+
+        response = smart_socket.push(SERIAL, str(local / 'folder'), str(device / 'copy'), None)
+        assert response.IsSuccessful, response.ErrorData
+        assert (device / 'copy' / 'folder' / 'file.txt').read_bytes() == b'hello\n'
+
+
+def test_server_error(device):
+    with serve(device):
+        response = smart_socket.connect('192.0.2.1:5555')
+        assert not response.IsSuccessful
+        assert 'unknown request' in response.ErrorData
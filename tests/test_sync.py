@@ -0,0 +1,39 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+from app.core import sync
+from app.core.sync import DirectorySync
+from app.data.models import TransferType
+
+
+def manifest(result):
+    return classmethod(lambda cls, path: result)
+
+
+def test_plan_download(tmp_path, monkeypatch):
+    (tmp_path / 'same.txt').write_bytes(b'123')
+    (tmp_path / 'old.txt').write_bytes(b'1')
+    monkeypatch.setattr(sync.FileRepository, 'manifest', manifest(({'same.txt': (3, 0), 'new.txt': (5, 0)}, None)))
+    plan, error = DirectorySync.plan(TransferType.DOWNLOAD, '/sdcard/folder', str(tmp_path))
+    assert error is None
+    assert (plan.copy, plan.update, plan.delete, plan.unchanged) == (['new.txt'], [], ['old.txt'], 1)
+
+
+def test_plan_incomplete_listing(tmp_path, monkeypatch):
+    # Files of unreadable directories are not listed, they are not missing on the device
+    (tmp_path / 'private.txt').write_bytes(b'1')
+    result = ({'new.txt': (5, 0)}, "find: './private': Permission denied")
+    monkeypatch.setattr(sync.FileRepository, 'manifest', manifest(result))
+    plan, error = DirectorySync.plan(TransferType.DOWNLOAD, '/sdcard/folder', str(tmp_path))
+    assert error is None and plan.copy == ['new.txt']
+    assert plan.delete == [] and 'Permission denied' in plan.error and 'incomplete' in plan.summary
+
+
+def test_plan_failed_listing(tmp_path, monkeypatch):
+    (tmp_path / 'file.txt').write_bytes(b'1')
+    monkeypatch.setattr(sync.FileRepository, 'manifest', manifest((None, "cd: /sdcard/folder: No such directory")))
+    plan, error = DirectorySync.plan(TransferType.DOWNLOAD, '/sdcard/folder', str(tmp_path))
+    assert plan is None and 'No such directory' in error
+
+    # Destination of an upload is created by the transfers
+    plan, error = DirectorySync.plan(TransferType.UPLOAD, '/sdcard/folder', str(tmp_path))
+    assert error is None and plan.copy == ['file.txt'] and plan.error is None
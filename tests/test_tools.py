@@ -0,0 +1,33 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import pytest
+
+from app.helpers.tools import CancellationToken, StreamingProcess
+
+
+def test_streaming_process_output_closed_before_exit():
+    # The process is not killed when its output ends before it exits, its error output is still read
+    stream = StreamingProcess(['sh', '-c', 'echo hi; exec 1>&-; sleep 0.3; echo warn >&2; exit 0'])
+    assert list(stream) == ['hi\n']
+    assert (stream.ExitCode, stream.IsSuccessful, stream.ErrorData) == (0, True, 'warn\n')
+
+
+def test_streaming_process_stopped_early():
+    stream = StreamingProcess(['sh', '-c', 'seq 1 1000000'])
+    for _ in stream:
+        break
+    assert stream.ExitCode == -9 and not stream.IsSuccessful
+
+
+def test_streaming_process_read_once():
+    stream = StreamingProcess(['echo', 'once'])
+    assert stream.read() == 'once\n'
+    with pytest.raises(RuntimeError):
+        stream.read()
+
+
+def test_cancellation_token_remaining():
+    assert CancellationToken().remaining() is None
+    token = CancellationToken(30)
+    assert 29 < token.remaining() <= 30
+    token.dispose()
@@ -0,0 +1,72 @@
+# ADB File Explorer
+# Copyright (C) 2022  Azat Aldeshov
+import hashlib
+import os
+import time
+
+import pytest
+
+from app.core import transfers, verification
+from app.core.configurations import Settings
+from app.core.transfers import TransferQueue
+from app.core.verification import TransferVerifier
+from app.data.models import Transfer, TransferType
+
+
+def test_arrived_downloads(tmp_path):
+    # Files of a failed batch are done when found complete at the destination
+    (tmp_path / 'done.txt').write_bytes(b'12345')
+    (tmp_path / 'partial.txt').write_bytes(b'12')
+    transfers = [
+        Transfer(id=index, type=TransferType.DOWNLOAD, source='/sdcard/%s' % name, destination=str(tmp_path),
+                 size=5, files=1)
+        for index, name in enumerate(['done.txt', 'partial.txt', 'missing.txt'])
+    ]
+    assert TransferVerifier.arrived(transfers) == transfers[:1]
+
+
+def test_arrived_in_this_attempt(tmp_path):
+    # A copy of an earlier run is not evidence: only the progress or a newer modification time are
+    for name in ('stale.txt', 'completed.txt', 'written.txt'):
+        (tmp_path / name).write_bytes(b'12345')
+    for name in ('stale.txt', 'completed.txt'):
+        os.utime(str(tmp_path / name), (1000000000, 1000000000))
+    transfers = [
+        Transfer(id=index, type=TransferType.DOWNLOAD, source='/sdcard/%s' % name, destination=str(tmp_path),
+                 size=5, files=1)
+        for index, name in enumerate(['stale.txt', 'completed.txt', 'written.txt'])
+    ]
+    transfers[1].update('/sdcard/completed.txt', 100)
+    assert TransferVerifier.arrived(transfers, time.time() - 60) == transfers[1:]
+
+
+def test_failed_batch_with_stale_destination(tmp_path, monkeypatch):
+    monkeypatch.setattr(Settings, 'data', {})
+    (tmp_path / 'old.txt').write_bytes(b'12345')
+    os.utime(str(tmp_path / 'old.txt'), (1000000000, 1000000000))
+    monkeypatch.setattr(transfers.FileRepository, 'download', classmethod(lambda *args: (None, 'device offline')))
+    batch = [
+        Transfer(id=index, type=TransferType.DOWNLOAD, source='/sdcard/%s' % name, destination=str(tmp_path),
+                 size=5, files=1)
+        for index, name in enumerate(['old.txt', 'new.txt'])
+    ]
+    _, error = TransferQueue._TransferQueue__transfer(batch, False)
+    assert error == 'device offline'
+    assert [transfer.missing for transfer in batch] == [True, True]
+
+
+def test_sources_hashed_during_upload(tmp_path):
+    (tmp_path / 'folder').mkdir()
+    (tmp_path / 'folder' / 'a.txt').write_bytes(b'a')
+    transfer = Transfer(id=1, type=TransferType.UPLOAD, source=str(tmp_path / 'folder'), destination='/sdcard')
+    TransferVerifier.start(transfer)
+    assert TransferVerifier.known(transfer) == {str(tmp_path / 'folder' / 'a.txt'): hashlib.sha256(b'a').hexdigest()}
+
+
+def test_known_checksums_not_calculated_again(tmp_path, monkeypatch):
+    # Device checksums of a download calculated during the transfer, only the local files are hashed after it
+    (tmp_path / 'a.txt').write_bytes(b'a')
+    monkeypatch.setattr(verification.FileRepository, 'checksums', classmethod(lambda *args: pytest.fail()))
+    digest = hashlib.sha256(b'a').hexdigest()
+    local, remote = TransferVerifier.checksums([(str(tmp_path / 'a.txt'), '/sdcard/a.txt')], {'/sdcard/a.txt': digest})
+    assert local == {str(tmp_path / 'a.txt'): digest} and remote == {'/sdcard/a.txt': digest}